@@ -0,0 +1,122 @@
+"""Ingestion throughput of data_prep/dataflow_pipeline.py on the DirectRunner, without GCP.
+
+Generates synthetic description files, embeds them with the fake Vertex AI
+client from bench/fakes.py (latency per request plus per text), and writes
+them into a scratch pgvector Postgres named by BENCH_DB_* (see
+bench/benchdb.py; the app's DB_* variables are never used). The schema is
+migrated first. Each run empties the pokemon table unless --incremental is
+passed through. Arguments the script doesn't know are passed on to the
+pipeline:
+
+    export BENCH_DB_HOST=127.0.0.1 BENCH_DB_NAME=postgres BENCH_DB_USER=postgres BENCH_DB_PASSWORD=bench
+
+    python bench/bench_ingest.py --files 2000 --repeat 3 --write_batch_size 500 --output ingest.json
+    python bench/bench_ingest.py --files 2000 --repeat 3 --write_batch_size 500 --baseline ingest.json
+
+The report's rps column is files per second. Its latency columns are whole-run
+wall times. The last run's rows are left in place for bench/bench_recommend.py.
+"""
+import argparse
+import logging
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+import psycopg2
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, "..", "data_prep"))
+sys.path.insert(0, os.path.join(BENCH_DIR, "..", "db"))
+
+import dataflow_pipeline  # noqa: E402
+import migrate  # noqa: E402
+from benchdb import bench_db_settings  # noqa: E402
+from fakes import FakeGenAIClient, Latency  # noqa: E402
+from report import add_report_arguments, finish, summarize  # noqa: E402
+
+WORDS = (
+    "fire water grass electric fast loyal calm fierce small tiny huge flying swims glows "
+    "sleepy playful shy brave forest cave ocean mountain storm spark flame leaf shell tail"
+).split()
+
+
+def write_descriptions(directory, count, words):
+    rng = random.Random(0)  # Same corpus every run
+    for i in range(count):
+        text = " ".join(rng.choice(WORDS) for _ in range(words)) + "."
+        with open(os.path.join(directory, f"benchmon{i:05d}.txt"), "w") as f:
+            f.write(text)
+
+
+def run(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--files", type=int, default=500, help="Synthetic description files to ingest")
+    parser.add_argument("--words", type=int, default=120, help="Words per description")
+    parser.add_argument("--repeat", type=int, default=1, help="Timed pipeline runs")
+    parser.add_argument("--embed-latency-ms", type=float, default=300, help="Fake embed_content latency per request")
+    parser.add_argument("--embed-per-item-ms", type=float, default=2, help="Extra fake latency per text in a request")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of fake embed calls failing with 429")
+    parser.add_argument("--skip-migrate", action="store_true")
+    add_report_arguments(parser)
+    args, pipeline_args = parser.parse_known_args(argv)
+
+    db = bench_db_settings()  # Exits unless a separate benchmark database is configured
+    db_args = [
+        f"--db_host={db['host']}",
+        f"--db_port={db['port']}",
+        f"--db_name={db['name']}",
+        f"--db_user={db['user']}",
+        f"--db_password={db['password']}",
+    ]
+    if not args.skip_migrate:
+        migrate.run(db_args)
+
+    fake_client = FakeGenAIClient(
+        dim=dataflow_pipeline.EMBEDDING_DIM,
+        embed_latency=Latency(args.embed_latency_ms / 1000, args.embed_per_item_ms / 1000),
+        error_rate=args.error_rate,
+    )
+    dataflow_pipeline.get_genai_client = lambda: fake_client  # The DirectRunner runs DoFns in this process
+
+    directory = tempfile.mkdtemp(prefix="pokemon-bench-")
+    try:
+        write_descriptions(directory, args.files, args.words)
+        conn = psycopg2.connect(
+            host=db["host"], port=db["port"], database=db["name"], user=db["user"], password=db["password"]
+        )
+        conn.autocommit = True
+        walls = []
+        for attempt in range(args.repeat):
+            if "--incremental" not in pipeline_args:
+                with conn.cursor() as cursor:
+                    cursor.execute("TRUNCATE pokemon;")
+            start = time.perf_counter()
+            dataflow_pipeline.run(
+                [f"--input_pattern={directory}/*.txt", "--runner=DirectRunner"] + db_args + pipeline_args
+            )
+            walls.append(time.perf_counter() - start)
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT count(*) FROM pokemon WHERE name LIKE 'Benchmon%%';")
+                rows = cursor.fetchone()[0]
+            print(f"Run {attempt + 1}: {args.files} files in {walls[-1]:.1f}s ({args.files / walls[-1]:.1f} files/s); {rows} rows")
+        conn.close()
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    stages = summarize({"ingest": walls}, sum(walls))
+    stages["ingest"]["count"] = args.files * args.repeat
+    stages["ingest"]["rps"] = args.files * args.repeat / sum(walls)
+    result = {
+        "config": dict(vars(args), pipeline_args=pipeline_args),
+        "vertex_calls": dict(fake_client.models.calls),
+        "stages": stages,
+    }
+    finish(result, args)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING)
+    run()
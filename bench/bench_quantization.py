@@ -0,0 +1,154 @@
+"""Recall and latency of compact embedding search compared with the current exact search.
+
+In-process (the default) needs neither GCP nor Postgres. The app's
+InMemoryVectorIndex is built from a synthetic catalogue of clustered unit
+vectors at each MEMORY_INDEX_DTYPE, with and without the exact re-rank of a
+shortlist. Each variant is compared with float32 brute force. Re-ranking
+reads an in-process float32 copy here. In the app it is one primary-key
+lookup of RERANK_CANDIDATES rows, which adds a database round trip.
+
+    python bench/bench_quantization.py --rows 100000 --queries 500 --output quant.json
+
+With --sql, the catalogue is read from the pokemon table of the scratch
+database named by BENCH_DB_* (see bench/benchdb.py) instead. The
+VECTOR_SEARCH_MODE queries (exact, halfvec, binary) also run against it; the
+compact columns must exist (db/migrate.py --compact_embeddings). Recall is
+then measured against brute force over the stored vectors. That way it also
+covers what HNSW itself misses.
+
+    python bench/bench_quantization.py --sql --queries 500 --rerank-candidates 40
+
+Recall@k is the fraction of the exact top k that a variant returns. The size
+column is the vectors' memory, or the HNSW index size on disk for --sql.
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, "..", "webapp"))
+
+from benchdb import use_bench_db_for_app  # noqa: E402
+from report import add_report_arguments, finish, summarize  # noqa: E402
+
+MEMORY_VARIANTS = (  # (label, dtype, re-rank)
+    ("memory_float32", "float32", False),
+    ("memory_float16", "float16", False),
+    ("memory_float16_rr", "float16", True),
+    ("memory_int8", "int8", False),
+    ("memory_int8_rr", "int8", True),
+)
+
+
+def synthetic_catalogue(rows, dim, clusters, spread, seed=0):
+    """Unit vectors scattered around `clusters` random centres, like embeddings of similar descriptions."""
+    rng = np.random.default_rng(seed)
+    centres = rng.normal(size=(clusters, dim)).astype(np.float32)
+    matrix = centres[rng.integers(clusters, size=rows)] + spread * rng.normal(size=(rows, dim)).astype(np.float32)
+    matrix /= np.linalg.norm(matrix, axis=1, keepdims=True)
+    return [f"Synthmon{i:06d}" for i in range(rows)], matrix
+
+
+def synthetic_queries(matrix, count, noise, seed=1):
+    """Perturbed catalogue rows, so each query has a few clear near neighbours."""
+    rng = np.random.default_rng(seed)
+    queries = matrix[rng.integers(len(matrix), size=count)] + noise * rng.normal(size=(count, matrix.shape[1])).astype(np.float32)
+    return queries / np.linalg.norm(queries, axis=1, keepdims=True)
+
+
+def recall(results, truths, k):
+    return float(np.mean([len(set(result) & set(truth)) / k for result, truth in zip(results, truths)]))
+
+
+def run(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=50000, help="Synthetic catalogue size")
+    parser.add_argument("--clusters", type=int, default=500)
+    parser.add_argument("--spread", type=float, default=0.05, help="Per-dimension noise around a cluster centre")
+    parser.add_argument("--queries", type=int, default=300)
+    parser.add_argument("--query-noise", type=float, default=0.03, help="Per-dimension noise added to a catalogue row")
+    parser.add_argument("--k", type=int, default=3, help="Results per search (the app asks for 3)")
+    parser.add_argument("--rerank-candidates", type=int, default=None, help="Shortlist size (default: RERANK_CANDIDATES)")
+    parser.add_argument("--sql", action="store_true", help="Use the pokemon table and also time the SQL search modes")
+    add_report_arguments(parser)
+    args = parser.parse_args(argv)
+
+    # Read by the app at import time
+    if args.sql:
+        use_bench_db_for_app()
+    os.environ["SEARCH_BACKEND"] = "pgvector"
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    if args.rerank_candidates is not None:
+        os.environ["RERANK_CANDIDATES"] = str(args.rerank_candidates)
+    import app  # noqa: E402
+
+    if args.sql:
+        loader = app.InMemoryVectorIndex(app.db_pool, dtype="float32")
+        if not loader.load() or not loader.ready:
+            raise SystemExit("Could not read the pokemon table; check the BENCH_DB_* variables.")
+        names, _, matrix, _, _ = loader._snapshot  # Normalized for cosine, as the index compares them
+        matrix = matrix.copy()
+    else:
+        names, matrix = synthetic_catalogue(args.rows, app.EMBEDDING_DIM, args.clusters, args.spread)
+    queries = synthetic_queries(matrix, args.queries, args.query_noise)
+    row_of = {name: i for i, name in enumerate(names)}
+    print(f"{len(names)} vectors, {len(queries)} queries, k={args.k}, shortlist {app.RERANK_CANDIDATES}, {app.VECTOR_DISTANCE}")
+
+    class LocalRerankIndex(app.InMemoryVectorIndex):
+        """Re-ranks from the float32 catalogue in this process, timing the compute alone."""
+
+        def fetch_vectors(self, shortlist):
+            return [matrix[row_of[name]].copy() for name in shortlist]
+
+    samples, recalls, sizes, truths = {}, {}, {}, None
+    for label, dtype, rerank in MEMORY_VARIANTS:
+        index = LocalRerankIndex(None, dtype=dtype, rerank=app.RERANK_CANDIDATES if rerank else 0)
+        index.build(names, [""] * len(names), matrix.copy())
+        index.search(queries[0], args.k)  # Warm up
+        results, samples[label] = [], []
+        for query in queries:
+            start = time.perf_counter()
+            rows = index.search(query, args.k)
+            samples[label].append(time.perf_counter() - start)
+            results.append([name for name, _ in rows])
+        truths = truths or results  # float32 brute force is exact and runs first
+        recalls[label] = recall(results, truths, args.k)
+        sizes[label] = index.nbytes
+
+    if args.sql:
+        for mode in ("exact",) + tuple(app.COMPACT_SEARCHES):
+            label = f"sql_{mode}"
+            _, _, index_name = app.vector_search_query(queries[0], args.k, mode)
+            with app.db_pool.connection() as conn:
+                with conn.cursor() as cursor:
+                    cursor.execute("SELECT coalesce(pg_relation_size(to_regclass(%s)), 0);", (index_name,))
+                    sizes[label] = cursor.fetchone()[0]
+                    cursor.execute(f"SET hnsw.ef_search = {app.search_ef(mode)};")
+                    results, samples[label] = [], []
+                    for query in queries:
+                        sql, params, _ = app.vector_search_query(query, args.k, mode)
+                        start = time.perf_counter()
+                        cursor.execute(sql, params)
+                        rows = cursor.fetchall()
+                        samples[label].append(time.perf_counter() - start)
+                        results.append([name for name, _ in rows])
+                conn.rollback()
+            recalls[label] = recall(results, truths, args.k)
+
+    result = {
+        "config": vars(args),
+        "recall": recalls,
+        "bytes": sizes,
+        "stages": {label: summarize({label: values}, sum(values))[label] for label, values in samples.items()},
+    }
+    print(f"{'variant':20s} {f'recall@{args.k}':>9s} {'size MiB':>9s}")
+    for label, value in recalls.items():
+        print(f"{label:20s} {value:9.3f} {sizes[label] / 2**20:9.1f}")
+    finish(result, args)
+
+
+if __name__ == "__main__":
+    run()
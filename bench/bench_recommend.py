@@ -0,0 +1,163 @@
+"""Load test for the recommend path of webapp/app.py, without GCP.
+
+Vertex AI (embeddings and Gemini) and Cloud Storage are replaced by the fakes
+in bench/fakes.py, with configurable latency. Postgres is real: the
+scratch pgvector instance named by BENCH_DB_* (see bench/benchdb.py) and
+loaded by bench/bench_ingest.py. The query corpus is replayed through the Flask app
+in-process at a fixed concurrency. Per-stage latency comes from each
+response's Server-Timing header and is reported as p50/p95/p99 and
+requests per second.
+
+    docker run -d -p 5432:5432 -e POSTGRES_PASSWORD=bench pgvector/pgvector:pg16
+    export BENCH_DB_HOST=127.0.0.1 BENCH_DB_NAME=postgres BENCH_DB_USER=postgres BENCH_DB_PASSWORD=bench
+    python bench/bench_ingest.py --files 1000          # migrate and load the catalogue
+    python bench/bench_recommend.py --concurrency 16 --requests 2000 --output before.json
+    python bench/bench_recommend.py --concurrency 16 --requests 2000 --baseline before.json
+
+Use --cold to disable the app's caches so every request runs every stage.
+"""
+import argparse
+import collections
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, "..", "webapp"))
+
+from benchdb import use_bench_db_for_app  # noqa: E402
+from fakes import FakeCredentials, FakeGenAIClient, FakeStorageClient, Latency  # noqa: E402
+from report import add_report_arguments, finish, summarize  # noqa: E402
+
+
+def load_queries(path, field):
+    """Plain text (one query per line, # comments) or JSONL (the `field` of each record)."""
+    with open(path) as f:
+        if path.endswith(".jsonl"):
+            return [json.loads(line)[field] for line in f if line.strip()]
+        return [line.strip() for line in f if line.strip() and not line.startswith("#")]
+
+
+def parse_server_timing(header):
+    """'embedding;dur=12.5, llm;dur=800.1' -> [('embedding', 0.0125), ('llm', 0.8001)]."""
+    stages = []
+    for entry in filter(None, (part.strip() for part in (header or "").split(","))):
+        name, _, params = entry.partition(";")
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key == "dur":
+                stages.append((name, float(value) / 1000))
+    return stages
+
+
+def run(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--queries", default=os.path.join(BENCH_DIR, "queries.txt"), help="Query corpus (.txt or .jsonl)")
+    parser.add_argument("--query-field", default="query", help="Field holding the query in a .jsonl corpus")
+    parser.add_argument("--requests", type=int, default=None, help="Requests to send (default: one pass over the corpus)")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--warmup", type=int, default=20, help="Unrecorded requests sent first")
+    parser.add_argument("--embed-latency-ms", type=float, default=60)
+    parser.add_argument("--llm-latency-ms", type=float, default=800)
+    parser.add_argument("--storage-latency-ms", type=float, default=30)
+    parser.add_argument("--jitter", type=float, default=0.2, help="Random +/- fraction applied to every fake latency")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of fake Vertex AI calls failing with 429")
+    parser.add_argument("--search-backend", choices=["pgvector", "memory"], default=os.environ.get("SEARCH_BACKEND", "pgvector"))
+    parser.add_argument("--cold", action="store_true", help="Disable the embedding, LLM and signed URL caches")
+    add_report_arguments(parser)
+    args = parser.parse_args(argv)
+
+    # Read by the app at import time
+    use_bench_db_for_app()
+    os.environ["SEARCH_BACKEND"] = args.search_backend
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    import app  # noqa: E402
+
+    logging.getLogger("app").setLevel(os.environ["LOG_LEVEL"])
+    app.start_background_tasks()  # As gunicorn's post_worker_init does: warmup and the catalogue watchers
+    app.startup_complete.wait(60)  # Let the warmup finish before swapping in the fakes
+    fake_client = FakeGenAIClient(
+        dim=app.EMBEDDING_DIM,
+        embed_latency=Latency(args.embed_latency_ms / 1000, jitter=args.jitter),
+        llm_latency=Latency(args.llm_latency_ms / 1000, jitter=args.jitter),
+        error_rate=args.error_rate,
+    )
+    app._genai_client = fake_client
+    app.storage_client = FakeStorageClient(Latency(args.storage_latency_ms / 1000, jitter=args.jitter))
+    app.credentials = FakeCredentials()
+    if args.cold:
+        for cache in (app.embedding_cache.local, app.llm_cache, app.signed_url_cache):
+            cache.max_size = 0
+    if args.search_backend == "memory":
+        deadline = time.monotonic() + 60
+        while not app.vector_index.ready and time.monotonic() < deadline:
+            time.sleep(0.1)
+        if not app.vector_index.ready:
+            raise SystemExit("In-memory vector index did not load; is the database reachable and populated?")
+
+    queries = load_queries(args.queries, args.query_field)
+    total = args.requests or len(queries)
+    local = threading.local()
+    samples = collections.defaultdict(list)
+    samples["request"] = []  # Listed first in the report
+    statuses = collections.Counter()
+    lock = threading.Lock()
+
+    # URL signing runs on the app's I/O threads, outside the request's Server-Timing
+    get_signed_url = app.get_signed_url
+    recording = threading.Event()
+
+    def timed_get_signed_url(name):
+        start = time.perf_counter()
+        try:
+            return get_signed_url(name)
+        finally:
+            if recording.is_set():
+                with lock:
+                    samples["signed_url"].append(time.perf_counter() - start)
+
+    app.get_signed_url = timed_get_signed_url
+
+    def send(i, record=True):
+        if not hasattr(local, "client"):
+            local.client = app.app.test_client()
+        start = time.perf_counter()
+        response = local.client.post("/", data={"query_text": queries[i % len(queries)]})
+        elapsed = time.perf_counter() - start
+        if not record:
+            return
+        with lock:
+            statuses[response.status_code] += 1
+            samples["request"].append(elapsed)
+            for stage, seconds in parse_server_timing(response.headers.get("Server-Timing")):
+                samples[stage].append(seconds)
+
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        list(executor.map(lambda i: send(i, record=False), range(args.warmup)))
+        recording.set()
+        start = time.perf_counter()
+        list(executor.map(send, range(total)))
+        wall = time.perf_counter() - start
+
+    result = {
+        "config": vars(args),
+        "wall_seconds": wall,
+        "statuses": {str(code): count for code, count in statuses.items()},
+        "vertex_calls": dict(fake_client.models.calls),
+        "stages": summarize(samples, wall),
+    }
+    print(
+        f"{total} requests in {wall:.1f}s at concurrency {args.concurrency} "
+        f"({total / wall:.1f} req/s); statuses {dict(statuses)}; fake Vertex AI calls {result['vertex_calls']}"
+    )
+    if "llm" not in samples:
+        print("No request reached the LLM stage; is the pokemon table loaded (bench/bench_ingest.py)?")
+    finish(result, args)
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,50 @@
+"""Micro-benchmark: cost of turning a query embedding into a SQL parameter.
+
+Compares the old `str(list)` parameter with the VectorParam adapter used by
+webapp/app.py. pgvector's binary encoding (what the pipeline's binary COPY
+sends) is listed for reference when the pgvector package is installed.
+
+    python bench/bench_vector_serialization.py [--dim 768] [--iterations 2000]
+"""
+import argparse
+import os
+import sys
+import timeit
+
+import numpy as np
+from psycopg2.extensions import adapt
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "webapp"))
+import app  # noqa: E402
+
+
+def run(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--dim", type=int, default=app.EMBEDDING_DIM)
+    parser.add_argument("--iterations", type=int, default=2000)
+    args = parser.parse_args(argv)
+
+    embedding = (np.random.default_rng(0).normal(size=args.dim) * 0.05).tolist()  # What the GenAI SDK returns
+    cases = {
+        "str(list) [before]": lambda: str(embedding).encode("ascii"),
+        "VectorParam [after]": lambda: adapt(app.VectorParam(embedding)).getquoted(),
+    }
+    try:
+        from pgvector import Vector
+
+        cases["pgvector binary [COPY]"] = lambda: Vector(np.asarray(embedding, dtype=np.float32)).to_binary()
+    except ImportError:
+        pass
+
+    print(f"{'encoding':26s} {'us/op':>10s} {'bytes':>8s}")
+    for name, encode in cases.items():
+        seconds = timeit.timeit(encode, number=args.iterations) / args.iterations
+        print(f"{name:26s} {seconds * 1e6:10.1f} {len(encode()):8d}")
+
+    # Server-side parse cost scales with the payload, so the byte counts matter too.
+    literal = app.VectorParam(embedding).literal()
+    assert np.array_equal(app.parse_vector(literal), np.asarray(embedding, dtype=np.float32))
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,45 @@
+"""Database the benchmarks run against, kept apart from the app's DB_* variables.
+
+bench_ingest.py migrates and empties the pokemon table, so the benchmarks
+only use a database named by BENCH_DB_* (HOST, PORT, NAME, USER, PASSWORD).
+The DB_* variables exported for the real Cloud SQL proxy are never used. The
+benchmarks refuse to run if BENCH_DB_NAME is unset, or if the settings point
+at the same host, port and database as DB_HOST_PROXY / DB_PORT / DB_NAME.
+"""
+import os
+
+
+def bench_db_settings():
+    """{'host', 'port', 'name', 'user', 'password'} from BENCH_DB_*; exits if they are missing or look like production."""
+    settings = {
+        "host": os.environ.get("BENCH_DB_HOST", "127.0.0.1"),
+        "port": int(os.environ.get("BENCH_DB_PORT", 5432)),
+        "name": os.environ.get("BENCH_DB_NAME"),
+        "user": os.environ.get("BENCH_DB_USER", "postgres"),
+        "password": os.environ.get("BENCH_DB_PASSWORD"),
+    }
+    if not settings["name"]:
+        raise SystemExit(
+            "Set BENCH_DB_NAME (and BENCH_DB_HOST/PORT/USER/PASSWORD) to a scratch pgvector database; "
+            "the benchmarks overwrite its pokemon table and never use the app's DB_* settings."
+        )
+    app_db = (os.environ.get("DB_HOST_PROXY"), int(os.environ.get("DB_PORT", 5432)), os.environ.get("DB_NAME"))
+    if (settings["host"], settings["port"], settings["name"]) == app_db:
+        raise SystemExit(
+            f"BENCH_DB_* points at the app database ({settings['name']} on {settings['host']}:{settings['port']}); "
+            "refusing to benchmark against it."
+        )
+    return settings
+
+
+def use_bench_db_for_app():
+    """Points the DB_* variables read by webapp/app.py at the benchmark database. Call before importing app."""
+    settings = bench_db_settings()
+    os.environ.update({
+        "DB_HOST_PROXY": settings["host"],
+        "DB_PORT": str(settings["port"]),
+        "DB_NAME": settings["name"],
+        "DB_USER": settings["user"],
+        "DB_PASSWORD": settings["password"] or "",
+    })
+    return settings
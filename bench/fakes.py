@@ -0,0 +1,152 @@
+"""Offline stand-ins for Vertex AI and Cloud Storage used by the benchmarks.
+
+The fakes return real google.genai response types, so the app and pipeline
+code paths run unchanged. Latency is simulated with sleeps, which release the
+GIL like real network waits do:
+
+    latency = base + per_item * items, scaled by a random +/- jitter fraction
+
+Embeddings are deterministic per text (seeded by its hash), so repeated runs
+search the same vectors and return the same candidates.
+"""
+import hashlib
+import random
+import re
+import threading
+import time
+
+import numpy as np
+from google.genai import errors as genai_errors
+from google.genai import types
+
+
+class Latency:
+    """Simulated service latency in seconds."""
+
+    def __init__(self, base=0.0, per_item=0.0, jitter=0.2):
+        self.base = base
+        self.per_item = per_item
+        self.jitter = jitter
+
+    def sleep(self, items=1):
+        seconds = self.base + self.per_item * items
+        if seconds > 0:
+            time.sleep(seconds * random.uniform(1 - self.jitter, 1 + self.jitter))
+
+
+def fake_embedding(text, dim):
+    """Unit-length pseudo-random vector, stable for a given text."""
+    seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "big")
+    vector = np.random.default_rng(seed).normal(size=dim).astype(np.float32)
+    return (vector / np.linalg.norm(vector)).tolist()
+
+
+class FakeModels:
+    """The `client.models` surface the app and pipeline call: embed_content and generate_content(_stream)."""
+
+    def __init__(self, dim, embed_latency, llm_latency, error_rate=0.0):
+        self.dim = dim
+        self.embed_latency = embed_latency
+        self.llm_latency = llm_latency
+        self.error_rate = error_rate  # Fraction of calls failing with a retryable 429
+        self.calls = {"embed_content": 0, "generate_content": 0}
+        self._lock = threading.Lock()
+
+    def _count(self, method):
+        with self._lock:
+            self.calls[method] += 1
+        if self.error_rate and random.random() < self.error_rate:
+            raise genai_errors.ClientError(
+                429, {"error": {"code": 429, "message": "Fake quota exceeded", "status": "RESOURCE_EXHAUSTED"}}, None
+            )
+
+    def embed_content(self, model, contents, config=None):
+        texts = [contents] if isinstance(contents, str) else list(contents)
+        self._count("embed_content")
+        self.embed_latency.sleep(len(texts))
+        return types.EmbedContentResponse(
+            embeddings=[types.ContentEmbedding(values=fake_embedding(text, self.dim)) for text in texts]
+        )
+
+    @staticmethod
+    def _answer(prompt):
+        # Answer in the app's expected format, picking the first candidate listed in the prompt
+        match = re.search(r"^\s*1\. (.+?):\s*$", prompt, re.MULTILINE)
+        name = match.group(1) if match else "Unknown"
+        return f"{name}\nIt matches the request best among the candidates."
+
+    @staticmethod
+    def _response(text):
+        return types.GenerateContentResponse(
+            candidates=[types.Candidate(content=types.Content(role="model", parts=[types.Part(text=text)]))]
+        )
+
+    def generate_content(self, model, contents, config=None):
+        self._count("generate_content")
+        self.llm_latency.sleep()
+        return self._response(self._answer(contents))
+
+    def generate_content_stream(self, model, contents, config=None, chunks=8):
+        """Yields the answer in `chunks` pieces, spreading the LLM latency across them."""
+        self._count("generate_content")
+        text = self._answer(contents)
+        size = max(1, len(text) // chunks)
+        for start in range(0, len(text), size):
+            time.sleep(self.llm_latency.base / chunks)
+            yield self._response(text[start:start + size])
+
+
+class FakeGenAIClient:
+    def __init__(self, dim=768, embed_latency=None, llm_latency=None, error_rate=0.0):
+        self.models = FakeModels(dim, embed_latency or Latency(), llm_latency or Latency(), error_rate)
+
+
+class FakeBlob:
+    def __init__(self, name, latency):
+        self.name = name
+        self.latency = latency
+
+    def exists(self):
+        self.latency.sleep()
+        return True
+
+    def generate_signed_url(self, version="v4", expiration=900, **unused):
+        # V4 signing is local computation (or an IAM signBlob call without a key file)
+        self.latency.sleep()
+        return f"https://storage.invalid/{self.name}?X-Goog-Expires={expiration}"
+
+
+class FakeBucket:
+    def __init__(self, name, latency):
+        self.name = name
+        self.latency = latency
+
+    def blob(self, name):
+        return FakeBlob(name, self.latency)
+
+
+class FakeStorageClient:
+    """Every images/<name>.png exists; list_blobs returns the given names."""
+
+    def __init__(self, latency=None, image_names=()):
+        self.latency = latency or Latency()
+        self.image_names = list(image_names)
+
+    def bucket(self, name):
+        return FakeBucket(name, self.latency)
+
+    def list_blobs(self, bucket_name, prefix=""):
+        self.latency.sleep()
+        return [FakeBlob(f"images/{name.lower()}.png", self.latency) for name in self.image_names]
+
+
+class FakeCredentials:
+    """What get_signed_url reads from the resolved ADC."""
+
+    service_account_email = "bench@example.iam.gserviceaccount.com"
+    token = "fake-token"
+    valid = True
+    expired = False
+
+    def refresh(self, request):
+        pass
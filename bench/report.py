@@ -0,0 +1,70 @@
+"""Latency summaries and baseline comparison shared by the benchmarks."""
+import json
+
+import numpy as np
+
+
+def summarize(samples, wall_seconds):
+    """{stage: {count, rps, mean, p50, p95, p99}} from {stage: [seconds, ...]}; latencies in ms."""
+    summary = {}
+    for stage, values in samples.items():
+        values = np.asarray(values, dtype=np.float64) * 1000
+        p50, p95, p99 = np.percentile(values, [50, 95, 99]) if len(values) else (0.0, 0.0, 0.0)
+        summary[stage] = {
+            "count": int(len(values)),
+            "rps": len(values) / wall_seconds if wall_seconds else 0.0,
+            "mean": float(values.mean()) if len(values) else 0.0,
+            "p50": float(p50),
+            "p95": float(p95),
+            "p99": float(p99),
+        }
+    return summary
+
+
+def print_table(summary):
+    print(f"{'stage':16s} {'count':>7s} {'rps':>9s} {'mean ms':>9s} {'p50 ms':>9s} {'p95 ms':>9s} {'p99 ms':>9s}")
+    for stage, s in summary.items():
+        print(
+            f"{stage:16s} {s['count']:7d} {s['rps']:9.1f} {s['mean']:9.1f} "
+            f"{s['p50']:9.1f} {s['p95']:9.1f} {s['p99']:9.1f}"
+        )
+
+
+def check_baseline(result, baseline_path, tolerance):
+    """Regressions (list of messages) against a saved --output file.
+
+    A stage regresses when its p95 grows, or its throughput drops, by more
+    than `tolerance` (a fraction) compared to the baseline.
+    """
+    with open(baseline_path) as f:
+        baseline = json.load(f)["stages"]
+    regressions = []
+    for stage, before in baseline.items():
+        after = result["stages"].get(stage)
+        if after is None:
+            continue
+        if before["p95"] and after["p95"] > before["p95"] * (1 + tolerance):
+            regressions.append(f"{stage}: p95 {before['p95']:.1f}ms -> {after['p95']:.1f}ms")
+        if before["rps"] and after["rps"] < before["rps"] * (1 - tolerance):
+            regressions.append(f"{stage}: {before['rps']:.1f} -> {after['rps']:.1f} per second")
+    return regressions
+
+
+def finish(result, args):
+    """Prints the table, writes --output and exits non-zero on a --baseline regression."""
+    print_table(result["stages"])
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+    if args.baseline:
+        regressions = check_baseline(result, args.baseline, args.tolerance)
+        for message in regressions:
+            print(f"REGRESSION {message}")
+        if regressions:
+            raise SystemExit(1)
+
+
+def add_report_arguments(parser):
+    parser.add_argument("--output", help="Write the results as JSON (usable as a later --baseline)")
+    parser.add_argument("--baseline", help="Fail if p95 or throughput regressed against this --output file")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed regression vs --baseline (fraction)")
@@ -1,18 +1,42 @@
 import apache_beam as beam
 from apache_beam.io import fileio
-from beam_postgres.io import WriteToPostgres
-from apache_beam.options.pipeline_options import PipelineOptions
+from apache_beam.options.pipeline_options import PipelineOptions, StandardOptions, WorkerOptions
+from apache_beam.transforms.window import GlobalWindows
+from apache_beam.utils.timestamp import MAX_TIMESTAMP, Timestamp
 import argparse
+import hashlib
+import io
+import random
+from concurrent.futures import ThreadPoolExecutor
 import logging
 import os
 from google import genai
-from google.genai.types import EmbedContentConfig
+from google.genai import errors as genai_errors
+from google.genai.types import EmbedContentConfig, HttpOptions
+import httpx
+import numpy as np
+import psycopg2
 import re
+import struct
+import threading
 import time  # Import the time module
 
 # Define the embedding dimension
 EMBEDDING_DIM = 768
 MODEL_NAME = "text-embedding-005"
+# Stored per row; a change forces re-embedding in incremental mode
+EMBEDDING_MODEL_VERSION = f"{MODEL_NAME}/{EMBEDDING_DIM}"
+REGION = "us-central1"
+EMBEDDING_TIMEOUT_MS = 60000  # Per-request timeout for embed_content
+WRITE_BATCH_SIZE = 1000  # Rows per COPY + merge transaction
+# text-embedding-005 request limits: at most 250 texts and 20k tokens per embed_content call
+EMBED_MAX_ITEMS_PER_REQUEST = 250
+EMBED_MAX_TOKENS_PER_REQUEST = 20000
+# Retry policy for transient Vertex AI errors (429 quota, 5xx, timeouts)
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+EMBED_MAX_ATTEMPTS = 6
+BACKOFF_BASE_SECONDS = 1.0
+BACKOFF_MAX_SECONDS = 60.0
 
 
 def log_matched_file(match_result):
@@ -27,65 +51,190 @@ def log_read_file(readable_file):
     return readable_file
 
 
-def generate_embedding_genai(text):
-    """Generates text embedding using Google GenAI SDK."""
-    if not text:
-        logging.warning("Received empty text for embedding.")
-        return None
+# Process-wide GenAI client, shared by every DoFn instance on a worker.
+# It holds the resolved credentials and the HTTP connection pool.
+_genai_client = None
+_genai_client_lock = threading.Lock()
 
-    try:
-        # ADC should be picked up automatically by the client on Dataflow workers
-        PROJECT_ID = os.environ.get("GOOGLE_CLOUD_PROJECT")
-        region = "us-central1"
-        client = genai.Client(
-            vertexai=True, project=PROJECT_ID, location=region
-        )  # Create client on demand
-
-        logging.debug(f"Sending text to GenAI embed_content: {text[:60]}...")
-        start_time = time.time()  # Record the start time
-        response = client.models.embed_content(
-            model=MODEL_NAME,
-            contents=[
-                text,
-            ],
-            config=EmbedContentConfig(
-                task_type="RETRIEVAL_DOCUMENT",  # Optional
-                output_dimensionality=768,  # Optional
-            ),
-        )
-        end_time = time.time()  # Record the end time
-        logging.debug(
-            f"Received response from GenAI embed_content in {end_time - start_time:.2f} seconds."
-        )
 
-        # Response structure is {'embedding': [float, float, ...]}
-        embedding_vector = response.embeddings  # Use .get for safer access
+def get_genai_client():
+    """Returns the worker's shared GenAI client, creating it on first use."""
+    global _genai_client
+    with _genai_client_lock:
+        if _genai_client is None:
+            # ADC should be picked up automatically by the client on Dataflow workers
+            _genai_client = genai.Client(
+                vertexai=True,
+                project=os.environ.get("GOOGLE_CLOUD_PROJECT"),
+                location=REGION,
+                http_options=HttpOptions(timeout=EMBEDDING_TIMEOUT_MS),
+            )
+        return _genai_client
+
+
+class TokenBucket:
+    """Thread-safe token-bucket rate limiter shared by every embedding call in a worker process."""
+
+    def __init__(self, rate, burst):
+        self.rate = rate  # Tokens (requests) per second
+        self.capacity = max(1.0, burst)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Blocks until a request may be sent. Returns the seconds spent waiting."""
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return waited
+                delay = (1 - self._tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+
+_rate_limiter = None
+_rate_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter(requests_per_minute):
+    """Returns the worker's shared rate limiter (one per process, like the GenAI client)."""
+    global _rate_limiter
+    with _rate_limiter_lock:
+        if _rate_limiter is None:
+            rate = requests_per_minute / 60.0
+            _rate_limiter = TokenBucket(rate, burst=rate)  # Up to one second of requests at once
+        return _rate_limiter
+
+
+def per_process_rpm(quota_rpm, max_workers, processes_per_worker=None):
+    """Share of a project-wide requests/minute quota for one SDK process.
+
+    Each SDK process has its own rate limiter, and Dataflow Runner v2 starts
+    one Python SDK process per worker vCPU, so the quota is split across
+    max_workers x vCPUs (this worker's, by default) processes.
+    """
+    processes = processes_per_worker or os.cpu_count() or 1
+    return quota_rpm / (max(1, max_workers) * processes)
+
+
+def is_retryable(error):
+    """Quota (429), server-side (5xx) and transport errors are worth retrying; bad requests are not."""
+    if isinstance(error, genai_errors.APIError):
+        return error.code in RETRYABLE_STATUS_CODES
+    return isinstance(error, (httpx.TimeoutException, httpx.TransportError))
+
+
+def backoff_delay(attempt):
+    """Exponential backoff with full jitter, so throttled workers don't retry in lockstep."""
+    return random.uniform(0, min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2 ** attempt))
+
+
+def generate_embeddings_genai(texts, client, limiter=None, max_attempts=EMBED_MAX_ATTEMPTS, stats=None):
+    """Embeds a list of texts in one GenAI SDK call. Returns one vector per text, or None on failure.
+
+    Retryable errors are retried with backoff (each attempt waits on `limiter`).
+    If `stats` is a list, a dict describing the call is appended to it; on
+    failure its "error" says why: "retryable" (quota, 5xx or transport errors
+    that outlasted every attempt), "rejected" (a non-retryable API error, e.g.
+    a bad or oversized request) or "invalid_response".
+    """
+    if not texts:
+        logging.warning("Received empty batch for embedding.")
+        return None
 
-        if embedding_vector and isinstance(embedding_vector, list):
-            # logging.info(f"Generated embedding dim {len(embedding_vector)} for text: {text[:50]}...")
-            if len(embedding_vector) != EMBEDDING_DIM:
+    call = {"texts": len(texts), "retries": 0, "wait_seconds": 0.0, "latency_seconds": 0.0, "ok": False, "error": None}
+    if stats is not None:
+        stats.append(call)
+    for attempt in range(max_attempts):
+        if limiter is not None:
+            call["wait_seconds"] += limiter.acquire()
+        try:
+            logging.debug(f"Sending {len(texts)} texts to GenAI embed_content.")
+            start_time = time.time()  # Record the start time
+            response = client.models.embed_content(
+                model=MODEL_NAME,
+                contents=texts,
+                config=EmbedContentConfig(
+                    task_type="RETRIEVAL_DOCUMENT",  # Optional
+                    output_dimensionality=EMBEDDING_DIM,  # Optional
+                ),
+            )
+            end_time = time.time()  # Record the end time
+            call["latency_seconds"] = end_time - start_time
+            logging.debug(
+                f"Received {len(texts)} embeddings from GenAI embed_content in {end_time - start_time:.2f} seconds."
+            )
+        except Exception as e:
+            if is_retryable(e) and attempt + 1 < max_attempts:
+                delay = backoff_delay(attempt)
+                call["retries"] += 1
                 logging.warning(
-                    f"Expected embedding dim {EMBEDDING_DIM} but got {len(embedding_vector)}."
+                    f"Retryable embedding error ({e}); attempt {attempt + 1}/{max_attempts}, retrying in {delay:.1f}s."
                 )
-            return embedding_vector  # Return the list of floats
-        else:
+                time.sleep(delay)
+                continue
+            logging.error(
+                f"Failed to get {len(texts)} embeddings from GenAI SDK (first text '{texts[0][:50]}...'): {e}",
+                exc_info=True,
+            )
+            # Log details about the exception if possible
+            if hasattr(e, "response"):
+                logging.error(f"GenAI API Error Response: {e.response}")
+            call["error"] = "retryable" if is_retryable(e) else "rejected"
+            return None
+
+        embeddings = response.embeddings
+        if not embeddings or len(embeddings) != len(texts):
             logging.warning(
-                f"GenAI SDK returned no valid embedding structure for text: {text[:50]}..."
+                f"GenAI SDK returned {len(embeddings or [])} embeddings for {len(texts)} texts."
             )
             logging.warning(
                 f"GenAI Raw Response: {response}"
             )  # Log raw response for debugging
+            call["error"] = "invalid_response"
             return None
 
-    except Exception as e:
-        logging.error(
-            f"Failed to get embedding from GenAI SDK for text '{text[:50]}...': {e}",
-            exc_info=True,
-        )
-        # Log details about the exception if possible
-        if hasattr(e, "response"):
-            logging.error(f"GenAI API Error Response: {e.response}")
-        return None
+        vectors = [embedding.values for embedding in embeddings]
+        for vector in vectors:
+            if not vector or len(vector) != EMBEDDING_DIM:
+                logging.warning(
+                    f"Expected embedding dim {EMBEDDING_DIM} but got {len(vector or [])}."
+                )
+                call["error"] = "invalid_response"
+                return None
+        call["ok"] = True
+        return vectors
+    return None
+
+
+def estimate_tokens(text):
+    """Conservative token estimate (~3 characters per token) for request-size limits."""
+    return len(text) // 3 + 1
+
+
+def split_into_requests(records, max_items, max_tokens):
+    """Splits records into consecutive chunks that fit the per-request item and token limits."""
+    chunk, chunk_tokens = [], 0
+    for record in records:
+        tokens = estimate_tokens(record["description"])
+        if chunk and (len(chunk) >= max_items or chunk_tokens + tokens > max_tokens):
+            yield chunk
+            chunk, chunk_tokens = [], 0
+        chunk.append(record)
+        chunk_tokens += tokens
+    if chunk:
+        yield chunk
+
+
+def content_hash(text):
+    """Hash of a description, stored per row to detect unchanged files."""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
 
 
 # --- Keep extract_name_from_filename as before ---
@@ -101,11 +250,11 @@ def extract_name_from_filename(filename):
         return None
 
 
-class ProcessFileDoFn(beam.DoFn):
-    """A DoFn to process files using the GenAI SDK."""
+class ReadFileDoFn(beam.DoFn):
+    """Reads a matched file into a {name, description} record (embedding happens later, in batches)."""
 
     def process(self, readable_file):
-        """Reads file content, extracts name, generates embedding."""
+        """Reads file content and extracts the Pokemon name."""
         filename = readable_file.metadata.path
         logging.info(f"Processing file: {filename}")
         name = extract_name_from_filename(filename)
@@ -124,30 +273,11 @@ class ProcessFileDoFn(beam.DoFn):
                 )
                 return
 
-            # Generate embedding using the GenAI SDK function
-            embedding_response = generate_embedding_genai(content)  # Get embedding response
-
-            if embedding_response is None or not hasattr(embedding_response[0], 'values'):
-                logging.warning(
-                    f"Skipping {name} due to embedding generation failure."
-                )
-                yield beam.pvalue.TaggedOutput(
-                    "failed", f"Embedding failed for {filename}"
-                )
-                return
-
-            embedding = embedding_response[0].values # Access the values attribute
-
-            logging.info(f"Successfully processed: {name}")
-
-            # Format the embedding as a string for PostgreSQL vector type
-            #embedding_str = '[' + ','.join(f'{x:.10f}' for x in embedding) + ']'
-            #logging.info(f"Formatted embedding: {embedding_str[:100]}...")
-
-            yield {  # Yield the successful record directly
+            yield {
                 "name": name,
                 "description": content,
-                "embedding": embedding,
+                "path": filename,
+                "content_hash": content_hash(content),
             }
         except Exception as e:
             logging.error(f"Error processing file {filename}: {e}", exc_info=True)
@@ -156,6 +286,375 @@ class ProcessFileDoFn(beam.DoFn):
             )
 
 
+class FilterUnchangedDoFn(beam.DoFn):
+    """Drops records whose description hash and embedding model match the stored row (incremental mode).
+
+    Works on batches so each lookup is one query for many names.
+    """
+
+    def __init__(self, db_config):
+        self.db_config = db_config
+        self.unchanged = beam.metrics.Metrics.counter(self.__class__, "unchanged_skipped")
+
+    def setup(self):
+        self.conn = psycopg2.connect(**self.db_config)
+
+    def process(self, records):
+        with self.conn.cursor() as cursor:
+            cursor.execute(
+                "SELECT name, content_hash, embedding_model FROM pokemon WHERE name = ANY(%s);",
+                ([r["name"] for r in records],),
+            )
+            stored = {row[0]: (row[1], row[2]) for row in cursor.fetchall()}
+        self.conn.rollback()  # Read-only; don't hold a transaction open between batches
+        for record in records:
+            if stored.get(record["name"]) == (record["content_hash"], EMBEDDING_MODEL_VERSION):
+                self.unchanged.inc()
+                logging.info(f"Unchanged, skipping: {record['name']}")
+                continue
+            yield record
+
+    def teardown(self):
+        if getattr(self, "conn", None) is not None:
+            self.conn.close()
+
+
+class DeleteMissingRowsDoFn(beam.DoFn):
+    """Deletes pokemon rows whose source file no longer exists (--delete_missing).
+
+    Receives the full list of names derived from the matched file paths, so a
+    file that exists but failed to read or embed is never deleted.
+    """
+
+    def __init__(self, db_config):
+        self.db_config = db_config
+
+    def process(self, names):
+        if not names:
+            logging.warning("No input files matched; refusing to delete every pokemon row.")
+            return
+        conn = psycopg2.connect(**self.db_config)
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(
+                    "DELETE FROM pokemon WHERE NOT (name = ANY(%s)) RETURNING name;",
+                    (sorted(set(names)),),
+                )
+                deleted = [row[0] for row in cursor.fetchall()]
+            conn.commit()
+        finally:
+            conn.close()
+        logging.info(f"Deleted {len(deleted)} rows without a source file: {deleted}")
+
+
+class EmbedBatchDoFn(beam.DoFn):
+    """Embeds batches of records (from BatchElements), fanning request-sized chunks out over a thread pool.
+
+    Every request goes through the worker's shared token bucket and is retried
+    with backoff on transient errors. A request the API rejects (or answers
+    with unusable embeddings) is split in half and retried, down to single
+    records, to isolate the bad item; a record that still fails on its own goes
+    to the `failed` output. A request that outlasted every retry on quota or
+    server errors goes to `failed` whole instead: splitting it would only send
+    more requests against an exhausted quota. Those records are picked up by
+    the next --incremental run. Throughput and latency are exported as
+    Beam metrics (recorded on the bundle thread, where Beam collects them).
+    """
+
+    def __init__(
+        self,
+        max_items=EMBED_MAX_ITEMS_PER_REQUEST,
+        max_tokens=EMBED_MAX_TOKENS_PER_REQUEST,
+        concurrency=8,
+        requests_per_minute=300,
+        quota_rpm=None,
+        max_workers=1,
+    ):
+        self.max_items = max_items
+        self.max_tokens = max_tokens
+        self.concurrency = concurrency
+        self.requests_per_minute = requests_per_minute
+        self.quota_rpm = quota_rpm  # Project-wide; overrides requests_per_minute once split per process
+        self.max_workers = max_workers
+        self.requests = beam.metrics.Metrics.counter(self.__class__, "embedding_requests")
+        self.retries = beam.metrics.Metrics.counter(self.__class__, "embedding_retries")
+        self.failed_requests = beam.metrics.Metrics.counter(self.__class__, "embedding_failed_requests")
+        self.embedded = beam.metrics.Metrics.counter(self.__class__, "embedded_texts")
+        self.latency_ms = beam.metrics.Metrics.distribution(self.__class__, "embedding_latency_ms")
+        self.throttle_ms = beam.metrics.Metrics.distribution(self.__class__, "rate_limit_wait_ms")
+
+    def setup(self):
+        # Reuse the worker's client for every batch instead of building one per call
+        self.client = get_genai_client()
+        rpm = self.requests_per_minute
+        if self.quota_rpm:
+            rpm = per_process_rpm(self.quota_rpm, self.max_workers)
+            logging.info(
+                f"Embedding rate limit: {rpm:.1f} requests/min for this SDK process "
+                f"({self.quota_rpm:g}/min over {self.max_workers} workers x {os.cpu_count()} processes)."
+            )
+        self.limiter = get_rate_limiter(rpm)
+        self.executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="embed")
+
+    def teardown(self):
+        if getattr(self, "executor", None) is not None:
+            self.executor.shutdown(wait=False)
+
+    def process(self, records):
+        chunks = list(split_into_requests(records, self.max_items, self.max_tokens))
+        for outputs, stats in self.executor.map(self._embed, chunks):
+            for call in stats:
+                self.requests.inc(call["retries"] + 1)
+                self.retries.inc(call["retries"])
+                self.throttle_ms.update(int(call["wait_seconds"] * 1000))
+                if call["ok"]:
+                    self.embedded.inc(call["texts"])
+                    self.latency_ms.update(int(call["latency_seconds"] * 1000))
+                else:
+                    self.failed_requests.inc()
+            yield from outputs
+
+    def _embed(self, chunk, stats=None):
+        """Runs on an executor thread. Returns (outputs, per-call stats); outputs are emitted by process()."""
+        stats = [] if stats is None else stats
+        outputs = []
+        vectors = generate_embeddings_genai(
+            [r["description"] for r in chunk], self.client, limiter=self.limiter, stats=stats
+        )
+        if vectors is not None:
+            for record, vector in zip(chunk, vectors):
+                logging.info(f"Successfully processed: {record['name']}")
+                outputs.append(dict(record, embedding=vector))
+        elif stats[-1]["error"] == "retryable":
+            logging.warning(f"Embedding request for {len(chunk)} records exhausted its retries; not splitting it.")
+            outputs.extend(
+                beam.pvalue.TaggedOutput("failed", f"Embedding retries exhausted for {r['path']}") for r in chunk
+            )
+        elif len(chunk) == 1:
+            logging.warning(f"Skipping {chunk[0]['name']} due to embedding generation failure.")
+            outputs.append(beam.pvalue.TaggedOutput(
+                "failed", f"Embedding failed for {chunk[0]['path']}"
+            ))
+        else:
+            logging.warning(f"Embedding request for {len(chunk)} records failed; splitting and retrying.")
+            middle = len(chunk) // 2
+            outputs.extend(self._embed(chunk[:middle], stats)[0])
+            outputs.extend(self._embed(chunk[middle:], stats)[0])
+        return outputs, stats
+
+
+# Binary COPY framing (https://www.postgresql.org/docs/current/sql-copy.html#id-1.9.3.55.9.4)
+PGCOPY_HEADER = b"PGCOPY\n\xff\r\n\x00" + struct.pack(">ii", 0, 0)  # Signature, flags, no extension area
+PGCOPY_TRAILER = struct.pack(">h", -1)
+STAGING_COLUMNS = ("name", "description", "embedding", "content_hash", "embedding_model", "source_path")
+
+# Per-connection staging table; rows vanish at commit so every batch starts empty
+CREATE_STAGING_SQL = """
+    CREATE TEMP TABLE IF NOT EXISTS pokemon_staging
+    (LIKE pokemon INCLUDING DEFAULTS) ON COMMIT DELETE ROWS
+"""
+COPY_STAGING_SQL = f"COPY pokemon_staging ({', '.join(STAGING_COLUMNS)}) FROM STDIN WITH (FORMAT binary)"
+
+# Re-running the job updates rows in place instead of colliding on the name primary key.
+# DISTINCT ON keeps one row per name, since ON CONFLICT can't touch a row twice in one statement.
+MERGE_STAGING_SQL = f"""
+    INSERT INTO pokemon ({', '.join(STAGING_COLUMNS)}{{compact_columns}})
+    SELECT DISTINCT ON (name) {', '.join(STAGING_COLUMNS)}{{compact_values}}
+    FROM pokemon_staging
+    ORDER BY name
+    ON CONFLICT (name) DO UPDATE SET
+        description = EXCLUDED.description,
+        embedding = EXCLUDED.embedding,{{compact_updates}}
+        content_hash = EXCLUDED.content_hash,
+        embedding_model = EXCLUDED.embedding_model,
+        source_path = EXCLUDED.source_path,
+        updated_at = now()
+"""
+# The optional compact copies used by two-stage search (db/migrate.py --compact_embeddings) are
+# derived server-side, so they round exactly like pgvector's own casts and cost nothing on the wire.
+COMPACT_MERGE_PARTS = {
+    "compact_columns": ", embedding_half, embedding_bits",
+    "compact_values": f",\n        embedding::halfvec({EMBEDDING_DIM}), binary_quantize(embedding)::bit({EMBEDDING_DIM})",
+    "compact_updates": "\n        embedding_half = EXCLUDED.embedding_half,\n        embedding_bits = EXCLUDED.embedding_bits,",
+}
+COMPACT_COLUMNS_SQL = """
+    SELECT count(*) = 2 FROM information_schema.columns
+    WHERE table_name = 'pokemon' AND column_name IN ('embedding_half', 'embedding_bits')
+"""
+
+
+def merge_staging_sql(compact_embeddings=False):
+    return MERGE_STAGING_SQL.format(**{
+        part: sql if compact_embeddings else "" for part, sql in COMPACT_MERGE_PARTS.items()
+    })
+
+
+# Operator class per distance; keep in sync with db/migrate.py and migration 0002
+VECTOR_OPCLASSES = {
+    "cosine": "vector_cosine_ops",
+    "l2": "vector_l2_ops",
+    "ip": "vector_ip_ops",
+}
+VECTOR_INDEX_NAME = "pokemon_embedding_idx"
+# All HNSW indexes on pokemon, including the optional ones over the compact columns
+VECTOR_INDEX_NAMES = (VECTOR_INDEX_NAME, "pokemon_embedding_half_idx", "pokemon_embedding_bits_idx")
+DEFAULT_INDEX_SQL = (
+    f"CREATE INDEX {VECTOR_INDEX_NAME} ON pokemon USING hnsw (embedding {{opclass}}) "
+    "WITH (m = 16, ef_construction = 256)"
+)
+
+
+def encode_vector(values):
+    """Encodes an embedding in pgvector's binary wire format (int16 dim, int16 unused, float32s)."""
+    arr = np.asarray(values, dtype=">f4")
+    return struct.pack(">hh", len(arr), 0) + arr.tobytes()
+
+
+def encode_copy_row(fields):
+    """Encodes one tuple for COPY ... (FORMAT binary); fields are bytes or None for NULL."""
+    parts = [struct.pack(">h", len(fields))]
+    for field in fields:
+        if field is None:
+            parts.append(struct.pack(">i", -1))
+        else:
+            parts.append(struct.pack(">i", len(field)))
+            parts.append(field)
+    return b"".join(parts)
+
+
+class CopyToPostgresDoFn(beam.DoFn):
+    """Bulk-loads processed records into the pokemon table.
+
+    Each batch is streamed with a binary COPY into a temp staging table and
+    merged with a single INSERT ... ON CONFLICT, so vectors travel as raw
+    float32 instead of text and the server does one statement per batch.
+    Yields the number of rows written per flush.
+
+    compact_embeddings is "auto" (fill the halfvec/bit columns if the table
+    has them), "on" (require them) or "off" (leave them alone).
+    """
+
+    def __init__(self, db_config, batch_size=WRITE_BATCH_SIZE, compact_embeddings="auto"):
+        self.db_config = db_config
+        self.batch_size = batch_size
+        self.compact_embeddings = compact_embeddings
+
+    def setup(self):
+        self.conn = psycopg2.connect(**self.db_config)
+        with self.conn.cursor() as cursor:
+            cursor.execute(CREATE_STAGING_SQL)
+            cursor.execute(COMPACT_COLUMNS_SQL)
+            has_compact = cursor.fetchone()[0]
+        self.conn.commit()
+        if self.compact_embeddings == "on" and not has_compact:
+            raise RuntimeError("--compact_embeddings=on, but pokemon has no compact columns (db/migrate.py --compact_embeddings)")
+        if self.compact_embeddings == "off" and has_compact:
+            logging.warning("--compact_embeddings=off: embedding_half/embedding_bits of rewritten rows will be stale.")
+        self.merge_sql = merge_staging_sql(has_compact and self.compact_embeddings != "off")
+
+    def start_bundle(self):
+        self.rows = []
+
+    def process(self, record, *unused_side_inputs):
+        # Side inputs (e.g. the dropped index) only order this step after their producer
+        self.rows.append(
+            encode_copy_row(
+                (
+                    record["name"].encode("utf-8"),
+                    record["description"].encode("utf-8"),
+                    encode_vector(record["embedding"]),
+                    record["content_hash"].encode("utf-8"),
+                    EMBEDDING_MODEL_VERSION.encode("utf-8"),
+                    record["path"].encode("utf-8"),
+                )
+            )
+        )
+        if len(self.rows) >= self.batch_size:
+            yield self._flush()
+
+    def finish_bundle(self):
+        if self.rows:
+            yield GlobalWindows.windowed_value(self._flush())
+
+    def teardown(self):
+        if getattr(self, "conn", None) is not None:
+            self.conn.close()
+
+    def _flush(self):
+        payload = io.BytesIO(PGCOPY_HEADER + b"".join(self.rows) + PGCOPY_TRAILER)
+        try:
+            with self.conn.cursor() as cursor:
+                cursor.copy_expert(COPY_STAGING_SQL, payload)
+                cursor.execute(self.merge_sql)
+                written = cursor.rowcount
+            self.conn.commit()
+        except psycopg2.Error:
+            self.conn.rollback()
+            raise  # Let Beam retry the bundle
+        logging.info(f"Copied {len(self.rows)} rows into pokemon ({written} upserted).")
+        self.rows = []
+        return written
+
+
+class DropVectorIndexDoFn(beam.DoFn):
+    """Drops the HNSW indexes before a full reload and yields the statements that recreate them.
+
+    Maintaining the graphs row by row is much slower than building them once at
+    the end. The existing definitions are kept so the rebuild matches them; if
+    the main index is already gone (e.g. a retried or earlier failed run) the
+    default migration definition is used instead. The compact-column indexes
+    are only rebuilt if they existed.
+    """
+
+    def __init__(self, db_config, distance):
+        self.db_config = db_config
+        self.distance = distance
+
+    def process(self, unused_element):
+        conn = psycopg2.connect(**self.db_config)
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(
+                    "SELECT indexname, indexdef FROM pg_indexes WHERE tablename = 'pokemon' AND indexname = ANY(%s)",
+                    (list(VECTOR_INDEX_NAMES),),
+                )
+                definitions = dict(cursor.fetchall())
+                for name in definitions:
+                    cursor.execute(f"DROP INDEX IF EXISTS {name}")
+            conn.commit()
+        finally:
+            conn.close()
+        for name, definition in definitions.items():
+            logging.info(f"Dropped {name} for the reload: {definition}")
+        definitions.setdefault(VECTOR_INDEX_NAME, DEFAULT_INDEX_SQL.format(opclass=VECTOR_OPCLASSES[self.distance]))
+        yield [definitions[name] for name in VECTOR_INDEX_NAMES if name in definitions]
+
+
+class RebuildVectorIndexDoFn(beam.DoFn):
+    """Recreates the HNSW indexes once every write has finished."""
+
+    def __init__(self, db_config, maintenance_work_mem):
+        self.db_config = db_config
+        self.maintenance_work_mem = maintenance_work_mem
+
+    def process(self, rows_written, index_sqls):
+        conn = psycopg2.connect(**self.db_config)
+        try:
+            with conn.cursor() as cursor:
+                # A larger build memory keeps the graph in RAM and speeds the build up considerably
+                cursor.execute("SET maintenance_work_mem = %s", (self.maintenance_work_mem,))
+                for index_sql in index_sqls:
+                    start_time = time.monotonic()
+                    cursor.execute(index_sql.replace("CREATE INDEX ", "CREATE INDEX IF NOT EXISTS ", 1))
+                    logging.info(
+                        f"Rebuilt index over {rows_written} written rows in {time.monotonic() - start_time:.1f}s: {index_sql}"
+                    )
+            conn.commit()
+        finally:
+            conn.close()
+        yield rows_written
+
+
 def run(argv=None):
     parser = argparse.ArgumentParser()
     parser.add_argument(
@@ -179,12 +678,134 @@ def run(argv=None):
         required=True,
         help="Database password",
     )
+    parser.add_argument(
+        "--db_port", dest="db_port", type=int, default=5432, help="Database port"
+    )
+    parser.add_argument(
+        "--streaming",
+        dest="streaming",
+        action="store_true",
+        help="Keep watching --input_pattern and ingest new or modified files as they appear",
+    )
+    parser.add_argument(
+        "--watch_interval",
+        dest="watch_interval",
+        type=float,
+        default=60,
+        help="Streaming: seconds between input pattern matches",
+    )
+    parser.add_argument(
+        "--watch_duration",
+        dest="watch_duration",
+        type=float,
+        default=None,
+        help="Streaming: stop watching after this many seconds (local testing); default runs until cancelled",
+    )
+    parser.add_argument(
+        "--embedding_batch_size",
+        dest="embedding_batch_size",
+        type=int,
+        default=EMBED_MAX_ITEMS_PER_REQUEST,
+        help="Max descriptions per embed_content request (capped by the model's limit)",
+    )
+    parser.add_argument(
+        "--embedding_concurrency",
+        dest="embedding_concurrency",
+        type=int,
+        default=8,
+        help="Concurrent embed_content requests per DoFn instance",
+    )
+    parser.add_argument(
+        "--embedding_rpm",
+        dest="embedding_rpm",
+        type=float,
+        default=300,
+        help="embed_content requests per minute per SDK process. Runner v2 runs one Python SDK process per "
+        "worker vCPU, so this is project quota / (max workers x vCPUs per worker); see --embedding_quota_rpm",
+    )
+    parser.add_argument(
+        "--embedding_quota_rpm",
+        dest="embedding_quota_rpm",
+        type=float,
+        default=None,
+        help="Project-wide embed_content quota per minute; each SDK process takes quota / (--max_num_workers "
+        "x its worker's vCPUs). Overrides --embedding_rpm",
+    )
+    parser.add_argument(
+        "--incremental",
+        dest="incremental",
+        action="store_true",
+        help="Skip files whose content hash and embedding model match the stored row",
+    )
+    parser.add_argument(
+        "--delete_missing",
+        dest="delete_missing",
+        action="store_true",
+        help="Delete rows whose source file is no longer matched by --input_pattern",
+    )
+    parser.add_argument(
+        "--write_batch_size",
+        dest="write_batch_size",
+        type=int,
+        default=WRITE_BATCH_SIZE,
+        help="Rows per binary COPY + merge transaction",
+    )
+    parser.add_argument(
+        "--write_parallelism",
+        dest="write_parallelism",
+        type=int,
+        default=None,
+        help="Spread writes over this many keys (concurrent DB writers); default keeps the upstream sharding",
+    )
+    parser.add_argument(
+        "--rebuild_index",
+        dest="rebuild_index",
+        action="store_true",
+        help="Drop the HNSW indexes before writing and rebuild them after (full reloads)",
+    )
+    parser.add_argument(
+        "--distance",
+        dest="distance",
+        choices=sorted(VECTOR_OPCLASSES),
+        default="cosine",
+        help="Distance for the rebuilt index if none exists yet (see db/migrate.py)",
+    )
+    parser.add_argument(
+        "--compact_embeddings",
+        dest="compact_embeddings",
+        choices=["auto", "on", "off"],
+        default="auto",
+        help="Fill the optional halfvec/bit columns: auto = if the table has them (db/migrate.py --compact_embeddings)",
+    )
+    parser.add_argument(
+        "--index_build_memory",
+        dest="index_build_memory",
+        default="1GB",
+        help="maintenance_work_mem for the index rebuild",
+    )
     # REMOVED: --vertex_project and --vertex_region arguments
 
     known_args, pipeline_args = parser.parse_known_args(argv)
+    known_args.embedding_batch_size = max(
+        1, min(known_args.embedding_batch_size, EMBED_MAX_ITEMS_PER_REQUEST)
+    )
+    embed_batch = known_args.embedding_batch_size * max(1, known_args.embedding_concurrency)
+    if known_args.streaming and known_args.delete_missing:
+        parser.error("--delete_missing needs the full file list and is not supported with --streaming")
+    if known_args.streaming and known_args.rebuild_index:
+        parser.error("--rebuild_index needs the writes to finish and is not supported with --streaming")
+    if known_args.streaming:
+        # Modified files are re-emitted, so skip ones whose content didn't actually change
+        known_args.incremental = True
     pipeline_options = PipelineOptions(
-        pipeline_args, save_main_session=True, streaming=False
+        pipeline_args, save_main_session=True, streaming=known_args.streaming
     )
+    worker_options = pipeline_options.view_as(WorkerOptions)
+    max_workers = worker_options.max_num_workers or worker_options.num_workers
+    if known_args.embedding_quota_rpm and not max_workers:
+        if pipeline_options.view_as(StandardOptions).runner not in (None, "DirectRunner"):
+            parser.error("--embedding_quota_rpm needs --max_num_workers to split the quota between workers")
+        max_workers = 1
 
     # Extract bucket name from input pattern
     match = re.match(r"gs://([^/]+)/", known_args.input_pattern)
@@ -196,10 +817,33 @@ def run(argv=None):
             f"Could not extract bucket name from input pattern: {known_args.input_pattern}"
         )
 
+    db_config = {
+        "host": known_args.db_host,
+        "database": known_args.db_name,
+        "user": known_args.db_user,
+        "password": known_args.db_password,
+        "port": known_args.db_port,
+    }
+
     with beam.Pipeline(options=pipeline_options) as pipeline:
+        if known_args.streaming:
+            stop = (
+                Timestamp.now() + known_args.watch_duration
+                if known_args.watch_duration
+                else MAX_TIMESTAMP  # Run until cancelled
+            )
+            match = fileio.MatchContinuously(
+                known_args.input_pattern,
+                interval=known_args.watch_interval,
+                match_updated_files=True,
+                stop_timestamp=stop,
+            )
+        else:
+            match = fileio.MatchFiles(known_args.input_pattern)
+
         matched_files = (
             pipeline
-            | "MatchFiles" >> fileio.MatchFiles(known_args.input_pattern)
+            | "MatchFiles" >> match
             | "LogMatchedFiles" >> beam.Map(log_matched_file)
         )
 
@@ -214,31 +858,91 @@ def run(argv=None):
             | "LogReadFiles" >> beam.Map(log_read_file)
         )
 
-        processed_records = (
+        records = (
             read_files
-            | "ProcessFile"
-            >> beam.ParDo(ProcessFileDoFn()).with_outputs(
-                "failed", main="processed"
+            | "ReadFile"
+            >> beam.ParDo(ReadFileDoFn()).with_outputs(
+                "failed", main="records"
             )
         )
 
-        # Write successful records to DB
-        (
-            processed_records["processed"]
-            | "WriteToPostgres"
-            >> WriteToPostgres(
-                host=known_args.db_host,
-                database=known_args.db_name,
-                table="pokemon",
-                user=known_args.db_user,
-                password=known_args.db_password,
-                port=5432,
+        to_embed = records["records"]
+        if known_args.incremental:
+            to_embed = (
+                to_embed
+                | "BatchForLookup"
+                >> beam.BatchElements(min_batch_size=100, max_batch_size=1000)
+                | "FilterUnchanged" >> beam.ParDo(FilterUnchangedDoFn(db_config))
+            )
+
+        if known_args.delete_missing:
+            (
+                matched_files
+                | "SourceNames" >> beam.Map(lambda m: extract_name_from_filename(m.path))
+                | "DropUnnamed" >> beam.Filter(bool)
+                | "AllSourceNames" >> beam.combiners.ToList()
+                | "DeleteMissingRows" >> beam.ParDo(DeleteMissingRowsDoFn(db_config))
+            )
+
+        processed_records = (
+            to_embed
+            | "BatchForEmbedding"
+            >> beam.BatchElements(
+                # Per-call overhead dominates, so always fill batches (bundle ends flush the remainder).
+                # One batch holds enough records for every concurrent request slot.
+                min_batch_size=embed_batch,
+                max_batch_size=embed_batch,
             )
+            | "EmbedBatches"
+            >> beam.ParDo(
+                EmbedBatchDoFn(
+                    max_items=known_args.embedding_batch_size,
+                    concurrency=known_args.embedding_concurrency,
+                    requests_per_minute=known_args.embedding_rpm,
+                    quota_rpm=known_args.embedding_quota_rpm,
+                    max_workers=max_workers or 1,
+                )
+            ).with_outputs("failed", main="processed")
         )
 
+        to_write = processed_records["processed"]
+        if known_args.write_parallelism:
+            to_write = to_write | "SpreadWrites" >> beam.Reshuffle(
+                num_buckets=known_args.write_parallelism
+            )
+
+        write_side_inputs = []
+        if known_args.rebuild_index:
+            index_sqls = (
+                pipeline
+                | "StartReload" >> beam.Create([None])
+                | "DropVectorIndex"
+                >> beam.ParDo(DropVectorIndexDoFn(db_config, known_args.distance))
+            )
+            # The side input makes every write wait for the drop
+            write_side_inputs.append(beam.pvalue.AsSingleton(index_sqls))
+
+        # Write successful records to DB
+        rows_written = to_write | "WriteToPostgres" >> beam.ParDo(
+            CopyToPostgresDoFn(db_config, known_args.write_batch_size, known_args.compact_embeddings),
+            *write_side_inputs,
+        )
+
+        if known_args.rebuild_index:
+            (
+                rows_written
+                | "TotalRowsWritten" >> beam.CombineGlobally(sum)
+                | "RebuildVectorIndex"
+                >> beam.ParDo(
+                    RebuildVectorIndexDoFn(db_config, known_args.index_build_memory),
+                    beam.pvalue.AsSingleton(index_sqls),
+                )
+            )
+
         # Log failed records
         (
-            processed_records["failed"]
+            (records["failed"], processed_records["failed"])
+            | "CollectFailures" >> beam.Flatten()
             | "LogFailures"
             >> beam.Map(lambda x: logging.error(f"Failed record reason: {x}"))
         )
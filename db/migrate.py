@@ -0,0 +1,136 @@
+"""Applies the SQL files in db/migrations/ to the pokemon database, in order.
+
+Each file runs once, in its own transaction, and is recorded in
+schema_migrations. Files may use ${vector_opclass} and ${halfvec_opclass},
+which are filled in from --distance. This keeps the HNSW indexes in line with
+the web app's VECTOR_DISTANCE setting.
+
+Run it through the Cloud SQL proxy, e.g.:
+    python db/migrate.py --db_host=127.0.0.1 --db_name=$DB_NAME --db_user=$DB_USER --db_password=$DB_PASSWORD
+
+Optional schema under db/migrations/optional/ is applied only when asked for;
+--compact_embeddings adds the halfvec/bit columns used for two-stage search.
+
+Migrations only ever run once, so changing --distance later needs --reindex.
+It rebuilds the distance-specific HNSW indexes with the new operator class.
+Each new index is built concurrently under a temporary name and then swapped
+in, so searches keep using the old index until the new one is ready.
+"""
+import argparse
+import logging
+import os
+from string import Template
+
+import psycopg2
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "migrations")
+COMPACT_EMBEDDINGS_MIGRATION = "optional/compact_embeddings.sql"  # Relative to MIGRATIONS_DIR; also its schema_migrations version
+
+# Distance name -> (operator used in ORDER BY, HNSW operator class). Keep in sync with webapp/app.py.
+VECTOR_DISTANCES = {
+    "cosine": ("<=>", "vector_cosine_ops"),
+    "l2": ("<->", "vector_l2_ops"),
+    "ip": ("<#>", "vector_ip_ops"),
+}
+
+
+def pending_migrations(cursor, optional=()):
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version TEXT PRIMARY KEY,
+            applied_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        );
+        """
+    )
+    cursor.execute("SELECT version FROM schema_migrations;")
+    applied = {row[0] for row in cursor.fetchall()}
+    files = sorted(f for f in os.listdir(MIGRATIONS_DIR) if f.endswith(".sql")) + list(optional)
+    return [f for f in files if f not in applied]
+
+
+# HNSW indexes whose operator class follows --distance: name -> (column, operator class parameter)
+DISTANCE_INDEXES = {
+    "pokemon_embedding_idx": ("embedding", "vector_opclass"),
+    "pokemon_embedding_half_idx": ("embedding_half", "halfvec_opclass"),
+}
+
+
+def reindex(conn, params):
+    """Rebuilds DISTANCE_INDEXES with the operator classes in `params`; skips indexes whose column doesn't exist."""
+    conn.autocommit = True  # CREATE INDEX CONCURRENTLY can't run inside a transaction
+    with conn.cursor() as cursor:
+        for name, (column, opclass) in DISTANCE_INDEXES.items():
+            cursor.execute(
+                "SELECT 1 FROM information_schema.columns WHERE table_name = 'pokemon' AND column_name = %s;",
+                (column,),
+            )
+            if cursor.fetchone() is None:
+                continue
+            logging.info(f"Rebuilding {name} with {params[opclass]}")
+            cursor.execute(f"DROP INDEX IF EXISTS {name}_new;")  # Left invalid by an interrupted run
+            cursor.execute(
+                f"CREATE INDEX CONCURRENTLY {name}_new ON pokemon USING hnsw ({column} {params[opclass]}) "
+                "WITH (m = 16, ef_construction = 256);"
+            )
+            cursor.execute(f"BEGIN; DROP INDEX IF EXISTS {name}; ALTER INDEX {name}_new RENAME TO {name}; COMMIT;")
+
+
+def run(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--db_host", dest="db_host", default=os.environ.get("DB_HOST_PROXY", "127.0.0.1"))
+    parser.add_argument("--db_port", dest="db_port", type=int, default=int(os.environ.get("DB_PORT", 5432)))
+    parser.add_argument("--db_name", dest="db_name", default=os.environ.get("DB_NAME"))
+    parser.add_argument("--db_user", dest="db_user", default=os.environ.get("DB_USER"))
+    parser.add_argument("--db_password", dest="db_password", default=os.environ.get("DB_PASSWORD"))
+    parser.add_argument(
+        "--distance",
+        dest="distance",
+        choices=sorted(VECTOR_DISTANCES),
+        default=os.environ.get("VECTOR_DISTANCE", "cosine"),
+        help="Distance metric the app searches with; selects the HNSW operator class",
+    )
+    parser.add_argument(
+        "--compact_embeddings",
+        action="store_true",
+        help="Also add the halfvec/bit embedding columns and HNSW indexes for two-stage search (pgvector >= 0.7)",
+    )
+    parser.add_argument(
+        "--reindex",
+        action="store_true",
+        help="Rebuild the HNSW indexes for --distance even if their migrations already ran",
+    )
+    args = parser.parse_args(argv)
+    opclass = VECTOR_DISTANCES[args.distance][1]
+    params = {"vector_opclass": opclass, "halfvec_opclass": opclass.replace("vector_", "halfvec_", 1)}
+
+    conn = psycopg2.connect(
+        host=args.db_host,
+        port=args.db_port,
+        database=args.db_name,
+        user=args.db_user,
+        password=args.db_password,
+    )
+    try:
+        with conn.cursor() as cursor:
+            todo = pending_migrations(cursor, [COMPACT_EMBEDDINGS_MIGRATION] if args.compact_embeddings else ())
+        conn.commit()
+        if not todo:
+            logging.info("Schema is up to date.")
+        for filename in todo:
+            with open(os.path.join(MIGRATIONS_DIR, filename)) as f:
+                sql = Template(f.read()).substitute(params)
+            logging.info(f"Applying migration {filename}")
+            with conn.cursor() as cursor:
+                cursor.execute(sql)
+                cursor.execute("INSERT INTO schema_migrations (version) VALUES (%s);", (filename,))
+            conn.commit()
+        if args.reindex:
+            reindex(conn, params)
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    run()
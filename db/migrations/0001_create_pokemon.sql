@@ -0,0 +1,8 @@
+-- Catalogue table loaded by data_prep/dataflow_pipeline.py and queried by webapp/app.py
+CREATE EXTENSION IF NOT EXISTS vector;
+
+CREATE TABLE IF NOT EXISTS pokemon (
+    name VARCHAR(255) PRIMARY KEY,
+    description TEXT,
+    embedding vector(768) -- Correct dimension for text-embedding-005
+);
@@ -0,0 +1,9 @@
+-- HNSW index whose operator class matches the distance operator used by the
+-- web app's ORDER BY (VECTOR_DISTANCE). The original index used vector_l2_ops
+-- while the app ordered by <=> (cosine), so the planner could never use it.
+-- ${vector_opclass} is filled in by db/migrate.py from --distance.
+DROP INDEX IF EXISTS pokemon_embedding_idx;
+
+CREATE INDEX pokemon_embedding_idx ON pokemon
+USING hnsw (embedding ${vector_opclass})
+WITH (m = 16, ef_construction = 256);
@@ -0,0 +1,7 @@
+-- Bookkeeping for incremental ingestion (dataflow_pipeline.py --incremental):
+-- rows whose description hash and embedding model are unchanged are not re-embedded.
+ALTER TABLE pokemon
+    ADD COLUMN IF NOT EXISTS content_hash TEXT,
+    ADD COLUMN IF NOT EXISTS embedding_model TEXT,
+    ADD COLUMN IF NOT EXISTS source_path TEXT,
+    ADD COLUMN IF NOT EXISTS updated_at TIMESTAMPTZ NOT NULL DEFAULT now();
@@ -0,0 +1,13 @@
+-- Precomputed answers for popular queries, written by webapp/precompute.py after each catalogue load.
+-- webapp/app.py only serves rows whose catalog_version matches the current pokemon table fingerprint.
+CREATE TABLE IF NOT EXISTS popular_answers (
+    query_norm TEXT PRIMARY KEY, -- normalize_query(query_text)
+    query_text TEXT NOT NULL,
+    embedding vector(768) NOT NULL,
+    candidates JSONB NOT NULL, -- [{"name": ..., "description": ...}] in search order
+    choice_name TEXT NOT NULL,
+    explanation TEXT NOT NULL,
+    catalog_version TEXT NOT NULL,
+    model_version TEXT NOT NULL, -- Embedding and LLM models the answer was produced with
+    created_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
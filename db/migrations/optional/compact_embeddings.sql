@@ -0,0 +1,22 @@
+-- Opt-in (python db/migrate.py --compact_embeddings): compact copies of the embedding for two-stage search
+-- (VECTOR_SEARCH_MODE=halfvec|binary in webapp/app.py). The HNSW index over a compact column picks a shortlist,
+-- which is re-ranked with the full float32 vectors. halfvec is float16 (half the size, near-identical ranking);
+-- bit keeps only the sign of each dimension (1/32 of the size, searched by Hamming distance).
+-- Needs pgvector >= 0.7, and every ingest then maintains two more HNSW graphs.
+-- The pipeline's merge fills both columns once they exist; existing rows are backfilled here.
+ALTER TABLE pokemon
+    ADD COLUMN IF NOT EXISTS embedding_half halfvec(768),
+    ADD COLUMN IF NOT EXISTS embedding_bits bit(768);
+
+UPDATE pokemon SET
+    embedding_half = embedding::halfvec(768),
+    embedding_bits = binary_quantize(embedding)::bit(768)
+WHERE embedding IS NOT NULL;
+
+CREATE INDEX IF NOT EXISTS pokemon_embedding_half_idx ON pokemon
+USING hnsw (embedding_half ${halfvec_opclass})
+WITH (m = 16, ef_construction = 256);
+
+CREATE INDEX IF NOT EXISTS pokemon_embedding_bits_idx ON pokemon
+USING hnsw (embedding_bits bit_hamming_ops)
+WITH (m = 16, ef_construction = 256);
@@ -51,6 +51,11 @@ python dataflow_pipeline.py \
   --db_name=$DB_NAME \
   --db_user=$DB_USER \
   --db_password=$DB_PASSWORD \
+  --incremental \
   --experiments=use_runner_v2 \
   --sdk_container_image=${REGION}-docker.pkg.dev/${PROJECT_ID}/${AR_REPO_NAME}/dataflow/txt-embedding-lib:latest \
-  --sdk_location=container
\ No newline at end of file
+  --sdk_location=container
+# Refresh the precomputed answers for popular queries against the new catalogue
+# (uses the webapp's virtualenv and connects through the Cloud SQL proxy on DB_HOST_PROXY=127.0.0.1,
+# like db/migrate.py; start it first: cloud-sql-proxy --private-ip $INSTANCE_CONNECTION_NAME &)
+(cd ~/webapp && source env/bin/activate && python precompute.py --if-stale)
@@ -0,0 +1,15 @@
+"""Puts the app, pipeline and benchmark fakes on sys.path.
+
+Importing webapp/app.py starts no background work, so the tests need neither
+a database nor GCP. Google clients are replaced per test with the fakes from
+bench/fakes.py.
+"""
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for subdir in ("webapp", "bench", "data_prep"):
+    sys.path.insert(0, os.path.join(ROOT, subdir))
+
+# Read by the app at import time
+os.environ.setdefault("LOG_LEVEL", "CRITICAL")
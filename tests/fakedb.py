@@ -0,0 +1,112 @@
+"""psycopg2 connection and pool stand-ins."""
+import psycopg2
+from psycopg2 import extensions
+
+
+class FakeCursor:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+    def execute(self, sql, params=None):
+        self.conn.queries.append(sql)
+        if self.conn.dead:
+            self.conn.closed = 2  # As psycopg2 does when the server goes away
+            raise psycopg2.OperationalError("server closed the connection unexpectedly")
+        if sql == "timeout":
+            raise extensions.QueryCanceledError("canceling statement due to statement timeout")
+        self.conn.status = extensions.TRANSACTION_STATUS_INTRANS
+
+    def fetchall(self):
+        return [(self.conn.id,)]
+
+
+class FakeConnection:
+    def __init__(self, id):
+        self.id = id
+        self.closed = 0
+        self.dead = False
+        self.queries = []
+        self.rollbacks = 0
+        self.status = extensions.TRANSACTION_STATUS_IDLE
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def get_transaction_status(self):
+        return self.status
+
+    def commit(self):
+        self.status = extensions.TRANSACTION_STATUS_IDLE
+
+    def rollback(self):
+        if self.dead:
+            self.closed = 2
+            raise psycopg2.OperationalError("server closed the connection unexpectedly")
+        self.rollbacks += 1
+        self.status = extensions.TRANSACTION_STATUS_IDLE
+
+    def close(self):
+        self.closed = 1
+
+
+class Connector:
+    def __init__(self):
+        self.opened = []
+        self.down = False
+
+    def __call__(self):
+        if self.down:
+            return None
+        conn = FakeConnection(len(self.opened) + 1)
+        self.opened.append(conn)
+        return conn
+
+
+class ScriptedConnection:
+    """Answers each query with respond(sql, params), a list of rows (or an exception it raises)."""
+
+    closed = 0
+
+    def __init__(self, respond):
+        self.respond = respond
+        self.rows = []
+
+    def cursor(self):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+    def execute(self, sql, params=None):
+        self.rows = self.respond(sql, params)
+
+    def fetchone(self):
+        return self.rows[0]
+
+    def fetchall(self):
+        return self.rows
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+
+class StubPool:
+    """The DBConnectionPool surface used by the app's loaders, backed by ScriptedConnection."""
+
+    def __init__(self, respond):
+        self.respond = respond
+
+    def run(self, fn, *args):
+        return fn(ScriptedConnection(self.respond), *args)
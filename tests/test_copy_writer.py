@@ -0,0 +1,34 @@
+"""Binary COPY encoding used by CopyToPostgresDoFn."""
+import struct
+
+import numpy as np
+
+import dataflow_pipeline
+
+
+def test_encode_copy_row_fields_and_nulls():
+    row = dataflow_pipeline.encode_copy_row([b"Pikachu", None, b""])
+    assert row == (
+        b"\x00\x03"  # Field count
+        + b"\x00\x00\x00\x07Pikachu"
+        + b"\xff\xff\xff\xff"  # NULL
+        + b"\x00\x00\x00\x00"  # Empty, not NULL
+    )
+
+
+def test_encode_vector_round_trips():
+    values = [0.5, -1.25, 3.0]
+    encoded = dataflow_pipeline.encode_vector(values)
+    dim, unused = struct.unpack(">hh", encoded[:4])
+    assert (dim, unused) == (3, 0)
+    assert np.frombuffer(encoded[4:], dtype=">f4").tolist() == values
+
+
+def test_encode_copy_row_with_vector_field():
+    vector = dataflow_pipeline.encode_vector([1.0, 2.0])
+    row = dataflow_pipeline.encode_copy_row([b"a", vector])
+    (count,) = struct.unpack(">h", row[:2])
+    assert count == 2
+    offset = 2 + 4 + 1
+    (length,) = struct.unpack(">i", row[offset:offset + 4])
+    assert row[offset + 4:] == vector and length == len(vector)
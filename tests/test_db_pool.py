@@ -0,0 +1,105 @@
+"""DBConnectionPool in webapp/app.py."""
+import threading
+
+import psycopg2
+import pytest
+from psycopg2 import extensions
+
+import app
+from fakedb import Connector
+
+
+def make_pool(**kwargs):
+    connector = Connector()
+    return app.DBConnectionPool(connector, **kwargs), connector
+
+
+def test_pool_reuses_connections():
+    pool, connector = make_pool(max_size=2)
+    with pool.connection() as conn:
+        conn.cursor().execute("SELECT 1")
+    with pool.connection() as again:
+        assert again is conn
+    assert conn.rollbacks == 1  # The open transaction was rolled back on return
+    assert len(connector.opened) == 1
+    assert pool.stats()['checkouts'] == 2
+
+
+def test_pool_prefill_opens_min_size():
+    pool, connector = make_pool(min_size=2, max_size=4)
+    pool.prefill()
+    assert len(connector.opened) == 2
+    assert pool.stats()['idle'] == 2
+
+
+def test_pool_waits_then_times_out_when_exhausted():
+    pool, _ = make_pool(max_size=1, timeout=0.05)
+    held = pool.getconn()
+    assert pool.getconn() is None
+    assert pool.stats()['timeouts'] == 1
+
+    threading.Timer(0.02, pool.putconn, args=(held,)).start()
+    pool.timeout = 5
+    assert pool.getconn() is held
+
+
+def test_pool_returns_none_when_database_is_down():
+    pool, connector = make_pool()
+    connector.down = True
+    with pool.connection() as conn:
+        assert conn is None
+    assert pool.stats()['size'] == 0
+
+
+def test_pool_discards_connection_on_operational_error():
+    pool, _ = make_pool()
+    with pytest.raises(psycopg2.OperationalError):
+        with pool.connection() as conn:
+            conn.dead = True
+            conn.cursor().execute("SELECT 1")
+    assert conn.closed
+    assert pool.stats()['size'] == 0
+
+
+def test_pool_replaces_broken_idle_connection_on_checkout():
+    pool, connector = make_pool(healthcheck_interval=0)
+    with pool.connection() as conn:
+        pass
+    conn.dead = True
+    with pool.connection() as fresh:
+        assert fresh is not conn
+    assert conn.closed
+    assert pool.stats()['reconnects'] == 1
+
+
+def test_pool_run_retries_once_on_lost_connection():
+    pool, connector = make_pool(min_size=2, max_size=2)
+    pool.prefill()
+    for conn in connector.opened:  # e.g. the Cloud SQL proxy restarted
+        conn.dead = True
+    rows = pool.run(app.fetch_rows, "SELECT 1")
+    assert rows == [(3,)]  # Served by a newly opened connection
+    assert all(conn.closed for conn in connector.opened[:2])
+
+
+def test_pool_run_does_not_retry_other_errors():
+    pool, connector = make_pool()
+    with pytest.raises(extensions.QueryCanceledError):
+        pool.run(app.fetch_rows, "timeout")
+    assert connector.opened[0].queries == ["timeout"]
+    assert len(connector.opened) == 1
+
+
+def test_pool_run_gives_up_after_one_retry():
+    pool, connector = make_pool()
+    original = connector.__call__
+
+    def open_dead():
+        conn = original()
+        conn.dead = True
+        return conn
+
+    pool._connect = open_dead
+    with pytest.raises(psycopg2.OperationalError):
+        pool.run(app.fetch_rows, "SELECT 1")
+    assert len(connector.opened) == 2
@@ -0,0 +1,51 @@
+"""Batched embedding requests in the Dataflow pipeline."""
+import dataflow_pipeline
+from fakes import FakeGenAIClient, fake_embedding
+
+
+def record(name, description):
+    return {"name": name, "description": description, "path": f"gs://bucket/{name.lower()}.txt"}
+
+
+def test_split_into_requests_respects_item_limit():
+    records = [record(f"P{i}", "short") for i in range(7)]
+    chunks = list(dataflow_pipeline.split_into_requests(records, max_items=3, max_tokens=10000))
+    assert [len(chunk) for chunk in chunks] == [3, 3, 1]
+    assert [r["name"] for chunk in chunks for r in chunk] == [r["name"] for r in records]
+
+
+def test_split_into_requests_respects_token_limit():
+    text = "x" * 299  # 100 estimated tokens
+    assert dataflow_pipeline.estimate_tokens(text) == 100
+    records = [record(f"P{i}", text) for i in range(5)]
+    chunks = list(dataflow_pipeline.split_into_requests(records, max_items=250, max_tokens=250))
+    assert [len(chunk) for chunk in chunks] == [2, 2, 1]
+
+
+def test_oversized_record_gets_its_own_request():
+    records = [record("Small", "x"), record("Huge", "x" * 3000), record("Small2", "x")]
+    chunks = list(dataflow_pipeline.split_into_requests(records, max_items=250, max_tokens=500))
+    assert [[r["name"] for r in chunk] for chunk in chunks] == [["Small"], ["Huge"], ["Small2"]]
+
+
+def test_one_request_embeds_a_whole_chunk_in_order():
+    client = FakeGenAIClient(dim=dataflow_pipeline.EMBEDDING_DIM)
+    texts = ["a fire lizard", "a water turtle", "a grass seed"]
+    stats = []
+    vectors = dataflow_pipeline.generate_embeddings_genai(texts, client, stats=stats)
+    assert vectors == [fake_embedding(text, dataflow_pipeline.EMBEDDING_DIM) for text in texts]
+    assert client.models.calls["embed_content"] == 1
+    assert stats[0]["ok"] and stats[0]["texts"] == 3
+
+
+def test_embed_batch_dofn_outputs_records_with_embeddings():
+    client = FakeGenAIClient(dim=dataflow_pipeline.EMBEDDING_DIM)
+    dofn = dataflow_pipeline.EmbedBatchDoFn(max_items=2)
+    dofn.client, dofn.limiter = client, None
+    records = [record(f"P{i}", f"description {i}") for i in range(5)]
+    outputs = []
+    for chunk in dataflow_pipeline.split_into_requests(records, dofn.max_items, dofn.max_tokens):
+        outputs.extend(dofn._embed(chunk)[0])
+    assert [o["name"] for o in outputs] == [r["name"] for r in records]
+    assert all(len(o["embedding"]) == dataflow_pipeline.EMBEDDING_DIM for o in outputs)
+    assert client.models.calls["embed_content"] == 3
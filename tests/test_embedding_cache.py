@@ -0,0 +1,97 @@
+"""LRUCache and the two-tier QueryEmbeddingCache in webapp/app.py."""
+import time
+from array import array
+
+import app
+
+
+class FakeRedis:
+    """The get/setex subset of redis.Redis the shared cache tier uses, backed by a dict."""
+
+    def __init__(self, fail=False):
+        self.data = {}
+        self.ttls = {}
+        self.fail = fail
+
+    def get(self, key):
+        if self.fail:
+            raise ConnectionError("redis down")
+        return self.data.get(key)
+
+    def setex(self, key, ttl, value):
+        if self.fail:
+            raise ConnectionError("redis down")
+        self.data[key] = value
+        self.ttls[key] = ttl
+
+
+def test_lru_cache_evicts_least_recently_used():
+    cache = app.LRUCache(max_size=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1  # "b" is now the least recently used
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert cache.stats() == {'size': 2, 'max_size': 2, 'hits': 3, 'misses': 1}
+
+
+def test_lru_cache_expires_entries():
+    cache = app.LRUCache(max_size=4, ttl=0.05)
+    cache.set("short", 1)
+    cache.set("long", 2, ttl=60)
+    time.sleep(0.1)
+    assert cache.get("short") is None
+    assert cache.get("long") == 2
+    assert cache.stats()['size'] == 1  # The expired entry was dropped on read
+
+
+def test_query_embedding_cache_normalizes_queries():
+    cache = app.QueryEmbeddingCache(app.LRUCache(8, 60))
+    cache.set("Fire type!", [0.5, 0.25])
+    assert cache.get("  fire   TYPE ") == [0.5, 0.25]
+    assert cache.get("water type") is None
+
+
+def test_query_embedding_cache_keys_include_model_and_dim():
+    shared = FakeRedis()
+    app.QueryEmbeddingCache(app.LRUCache(8, 60), shared, model="a", dim=2).set("fire", [1.0, 0.0])
+    other_model = app.QueryEmbeddingCache(app.LRUCache(8, 60), shared, model="b", dim=2)
+    other_dim = app.QueryEmbeddingCache(app.LRUCache(8, 60), shared, model="a", dim=3)
+    assert other_model.get("fire") is None
+    assert other_dim.get("fire") is None
+
+
+def test_query_embedding_cache_shares_across_replicas():
+    shared = FakeRedis()
+    writer = app.QueryEmbeddingCache(app.LRUCache(8, 60), shared)
+    writer.set("fire type", [0.5, 0.25])
+    key = writer.key("fire type")
+    assert shared.data[key] == array('f', [0.5, 0.25]).tobytes()
+    assert shared.ttls[key] == 60
+
+    reader = app.QueryEmbeddingCache(app.LRUCache(8, 60), shared)  # Another replica, empty local tier
+    assert reader.get("Fire type.") == [0.5, 0.25]
+    shared.data.clear()
+    assert reader.get("fire type") == [0.5, 0.25]  # Now served by its local tier
+    assert reader.get("water type") is None
+    stats = reader.stats()
+    assert (stats['shared_hits'], stats['shared_misses'], stats['shared_errors']) == (1, 1, 0)
+
+
+def test_query_embedding_cache_survives_shared_tier_errors():
+    cache = app.QueryEmbeddingCache(app.LRUCache(8, 60), FakeRedis(fail=True))
+    cache.set("fire type", [0.5])
+    assert cache.get("fire type") == [0.5]  # Local tier still works
+    assert cache.get("water type") is None
+    assert cache.stats()['shared_errors'] == 2
+
+
+def test_query_embedding_cache_local_tier_expires():
+    shared = FakeRedis()
+    cache = app.QueryEmbeddingCache(app.LRUCache(8, 0.05), shared)
+    cache.set("fire type", [0.5])
+    time.sleep(0.1)
+    shared.data.clear()  # Redis enforces its own TTL; simulate it having expired too
+    assert cache.get("fire type") is None
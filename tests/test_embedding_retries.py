@@ -0,0 +1,142 @@
+"""Rate limiting, retries and failure isolation for embedding requests in the Dataflow pipeline."""
+import time
+
+import httpx
+import pytest
+from google.genai import errors as genai_errors
+
+import dataflow_pipeline
+from fakes import FakeGenAIClient, FakeModels, Latency
+
+DIM = dataflow_pipeline.EMBEDDING_DIM
+
+
+backoff_delay = dataflow_pipeline.backoff_delay  # The real one; tests below patch it out of the retry loop
+
+
+def api_error(code):
+    error_class = genai_errors.ServerError if code >= 500 else genai_errors.ClientError
+    return error_class(code, {"error": {"code": code, "message": "fake", "status": "FAKE"}}, None)
+
+
+class ScriptedModels(FakeModels):
+    """embed_content fails with the queued errors first, then rejects any request containing a 'bad' text."""
+
+    def __init__(self, errors=()):
+        super().__init__(DIM, Latency(), Latency())
+        self.errors = list(errors)
+        self.requests = []
+
+    def embed_content(self, model, contents, config=None):
+        self.requests.append(list(contents))
+        if self.errors:
+            self.calls["embed_content"] += 1
+            raise self.errors.pop(0)
+        if any("bad" in text for text in contents):
+            self.calls["embed_content"] += 1
+            raise api_error(400)
+        return super().embed_content(model, contents, config)
+
+
+def scripted_client(errors=()):
+    client = FakeGenAIClient(dim=DIM)
+    client.models = ScriptedModels(errors)
+    return client
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(dataflow_pipeline, "backoff_delay", lambda attempt: 0)
+
+
+def record(name, description=None):
+    return {"name": name, "description": description or f"{name} description", "path": f"gs://b/{name}.txt"}
+
+
+def dofn_with(client):
+    dofn = dataflow_pipeline.EmbedBatchDoFn()
+    dofn.client, dofn.limiter = client, None
+    return dofn
+
+
+def failed(outputs):
+    return [o.value for o in outputs if isinstance(o, dataflow_pipeline.beam.pvalue.TaggedOutput)]
+
+
+def test_retryable_errors_are_retried():
+    client = scripted_client([api_error(429), api_error(503), httpx.ConnectTimeout("slow")])
+    stats = []
+    vectors = dataflow_pipeline.generate_embeddings_genai(["text"], client, stats=stats)
+    assert len(vectors) == 1
+    assert stats[0]["retries"] == 3 and stats[0]["ok"]
+
+
+def test_rejected_request_is_not_retried():
+    client = scripted_client([api_error(400)])
+    stats = []
+    assert dataflow_pipeline.generate_embeddings_genai(["text"], client, stats=stats) is None
+    assert client.models.calls["embed_content"] == 1
+    assert stats[0]["error"] == "rejected"
+
+
+def test_retries_are_bounded():
+    client = scripted_client([api_error(429)] * 10)
+    stats = []
+    assert dataflow_pipeline.generate_embeddings_genai(["text"], client, max_attempts=3, stats=stats) is None
+    assert client.models.calls["embed_content"] == 3
+    assert stats[0]["error"] == "retryable"
+
+
+def test_rejected_chunk_is_split_to_isolate_the_bad_record():
+    client = scripted_client()
+    records = [record("A"), record("B", "bad text"), record("C"), record("D")]
+    outputs, stats = dofn_with(client)._embed(records)
+    assert [o["name"] for o in outputs if isinstance(o, dict)] == ["A", "C", "D"]
+    assert failed(outputs) == ["Embedding failed for gs://b/B.txt"]
+    assert client.models.requests == [
+        ["A description", "bad text", "C description", "D description"],
+        ["A description", "bad text"],
+        ["A description"],
+        ["bad text"],
+        ["C description", "D description"],
+    ]
+    assert [call["ok"] for call in stats] == [False, False, True, False, True]
+
+
+def test_chunk_that_exhausted_retries_is_not_split():
+    client = scripted_client([api_error(429)] * 100)
+    records = [record(name) for name in "ABCD"]
+    outputs, _ = dofn_with(client)._embed(records)
+    assert failed(outputs) == [f"Embedding retries exhausted for gs://b/{name}.txt" for name in "ABCD"]
+    assert client.models.calls["embed_content"] == dataflow_pipeline.EMBED_MAX_ATTEMPTS  # One request's retries only
+
+
+def test_is_retryable():
+    assert dataflow_pipeline.is_retryable(api_error(429))
+    assert dataflow_pipeline.is_retryable(api_error(503))
+    assert dataflow_pipeline.is_retryable(httpx.ReadTimeout("slow"))
+    assert not dataflow_pipeline.is_retryable(api_error(400))
+    assert not dataflow_pipeline.is_retryable(ValueError("bug"))
+
+
+def test_backoff_delay_grows_with_full_jitter_and_a_cap():
+    for attempt in range(12):
+        bound = min(dataflow_pipeline.BACKOFF_MAX_SECONDS, dataflow_pipeline.BACKOFF_BASE_SECONDS * 2 ** attempt)
+        samples = [backoff_delay(attempt) for _ in range(50)]
+        assert all(0 <= s <= bound for s in samples)
+    assert max(backoff_delay(20) for _ in range(200)) > dataflow_pipeline.BACKOFF_MAX_SECONDS / 2
+
+
+def test_token_bucket_allows_a_burst_then_paces():
+    bucket = dataflow_pipeline.TokenBucket(rate=50, burst=3)
+    start = time.monotonic()
+    assert [bucket.acquire() for _ in range(3)] == [0.0, 0.0, 0.0]
+    waits = [bucket.acquire() for _ in range(5)]
+    elapsed = time.monotonic() - start
+    assert all(wait > 0 for wait in waits)
+    assert 0.08 <= elapsed < 0.5  # 5 tokens at 50/s
+
+
+def test_per_process_rpm_splits_quota_across_sdk_processes():
+    assert dataflow_pipeline.per_process_rpm(600, max_workers=5, processes_per_worker=4) == 30
+    assert dataflow_pipeline.per_process_rpm(600, max_workers=0, processes_per_worker=2) == 300
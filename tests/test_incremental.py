@@ -0,0 +1,50 @@
+"""Incremental mode re-embeds only new or changed Pokémon."""
+import dataflow_pipeline
+from fakedb import ScriptedConnection
+
+MODEL = dataflow_pipeline.EMBEDDING_MODEL_VERSION
+
+
+def record(name, description):
+    return {"name": name, "description": description, "content_hash": dataflow_pipeline.content_hash(description)}
+
+
+def filter_against(stored, records):
+    """Runs FilterUnchangedDoFn over one batch, with `stored` as the pokemon table's (name, hash, model) rows."""
+    queries = []
+
+    def respond(sql, params):
+        queries.append(params)
+        return [row for row in stored if row[0] in params[0]]
+
+    dofn = dataflow_pipeline.FilterUnchangedDoFn(db_config={})
+    dofn.conn = ScriptedConnection(respond)
+    kept = [r["name"] for r in dofn.process(records)]
+    return kept, queries
+
+
+def test_unchanged_rows_are_skipped_and_others_kept():
+    stored = [
+        ("Bulbasaur", dataflow_pipeline.content_hash("A grass seed."), MODEL),
+        ("Charmander", dataflow_pipeline.content_hash("A fire lizard."), MODEL),
+        ("Squirtle", dataflow_pipeline.content_hash("A water turtle."), "textembedding-gecko@003/768"),
+    ]
+    records = [
+        record("Bulbasaur", "A grass seed."),  # Unchanged
+        record("Charmander", "A fire lizard with a flame on its tail."),  # Description edited
+        record("Squirtle", "A water turtle."),  # Embedded by an older model
+        record("Pikachu", "An electric mouse."),  # New
+    ]
+    kept, queries = filter_against(stored, records)
+    assert kept == ["Charmander", "Squirtle", "Pikachu"]
+    assert queries == [(["Bulbasaur", "Charmander", "Squirtle", "Pikachu"],)]  # One lookup per batch
+
+
+def test_empty_table_keeps_everything():
+    records = [record("Bulbasaur", "A grass seed."), record("Pikachu", "An electric mouse.")]
+    assert filter_against([], records)[0] == ["Bulbasaur", "Pikachu"]
+
+
+def test_content_hash_is_stable_and_sensitive():
+    assert dataflow_pipeline.content_hash("A grass seed.") == dataflow_pipeline.content_hash("A grass seed.")
+    assert dataflow_pipeline.content_hash("A grass seed.") != dataflow_pipeline.content_hash("A grass seed")
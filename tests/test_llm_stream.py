@@ -0,0 +1,103 @@
+"""Parsing of the streamed LLM answer in stream_llm_choice()."""
+import pytest
+
+import app
+from fakes import FakeGenAIClient, FakeModels, Latency
+
+
+CANDIDATES = [
+    {'name': 'Charmander', 'description': 'A fire lizard.'},
+    {'name': 'Squirtle', 'description': 'A water turtle.'},
+    {'name': 'Bulbasaur', 'description': 'A grass seed.'},
+]
+
+
+class ScriptedModels(FakeModels):
+    """Streams the given text chunks; an exception in the list is raised at that point."""
+
+    def __init__(self, chunks):
+        super().__init__(dim=768, embed_latency=Latency(), llm_latency=Latency())
+        self.chunks = chunks
+
+    def generate_content_stream(self, model, contents, config=None):
+        self._count("generate_content")
+        for chunk in self.chunks:
+            if isinstance(chunk, Exception):
+                raise chunk
+            yield self._response(chunk)
+
+
+@pytest.fixture
+def llm(monkeypatch):
+    """Installs a GenAI client streaming the given chunks; returns its models."""
+    monkeypatch.setattr(app, "llm_cache", app.LRUCache(16, 60))
+
+    def install(*chunks):
+        client = FakeGenAIClient()
+        client.models = ScriptedModels(list(chunks))
+        monkeypatch.setattr(app, "get_genai_client", lambda: client)
+        return client.models
+
+    return install
+
+
+def test_stream_llm_choice_parses_name_then_explanation(llm):
+    models = llm("Char", "mander\nIt breathes ", "fire.")
+    events = list(app.stream_llm_choice("fire type", CANDIDATES))
+    assert events == [
+        ('choice', {'name': 'Charmander'}),
+        ('token', 'It breathes '),
+        ('token', 'fire.'),
+        ('done', {'name': 'Charmander', 'explanation': 'It breathes fire.'}),
+    ]
+
+    assert list(app.stream_llm_choice("Fire type!", CANDIDATES)) == [  # Cached by normalized query
+        ('choice', {'name': 'Charmander'}),
+        ('token', 'It breathes fire.'),
+        ('done', {'name': 'Charmander', 'explanation': 'It breathes fire.'}),
+    ]
+    assert models.calls['generate_content'] == 1
+
+
+def test_stream_llm_choice_with_fake_client_answer(llm, monkeypatch):
+    client = FakeGenAIClient()
+    monkeypatch.setattr(app, "get_genai_client", lambda: client)
+    events = list(app.stream_llm_choice("fire type", CANDIDATES))
+    assert events[0] == ('choice', {'name': 'Charmander'})
+    assert events[-1] == ('done', {'name': 'Charmander', 'explanation': 'It matches the request best among the candidates.'})
+
+
+def test_stream_llm_choice_single_line_uses_default_explanation(llm):
+    llm("  Squirtle  ")
+    events = list(app.stream_llm_choice("water type", CANDIDATES))
+    assert events == [
+        ('choice', {'name': 'Squirtle'}),
+        ('token', app.DEFAULT_EXPLANATION),
+        ('done', {'name': 'Squirtle', 'explanation': app.DEFAULT_EXPLANATION}),
+    ]
+
+
+def test_stream_llm_choice_falls_back_on_unknown_name(llm):
+    llm("Pikachu\nIt is electric.")
+    events = list(app.stream_llm_choice("fire type", CANDIDATES))
+    assert events[0] == ('choice', {'name': 'Charmander'})
+    assert events[-1][1]['fallback'] is True
+    assert app.llm_cache.stats()['size'] == 0  # Fallbacks are never cached
+
+
+def test_stream_llm_choice_falls_back_on_error_before_name(llm):
+    llm("Char", RuntimeError("stream reset"))
+    events = list(app.stream_llm_choice("fire type", CANDIDATES))
+    assert events[0] == ('choice', {'name': 'Charmander'})
+    assert "(LLM refinement failed)" in events[-1][1]['explanation']
+
+
+def test_stream_llm_choice_keeps_name_on_error_after_it(llm):
+    llm("Bulbasaur\nA seed ", RuntimeError("stream reset"))
+    events = list(app.stream_llm_choice("grass type", CANDIDATES))
+    assert events == [
+        ('choice', {'name': 'Bulbasaur'}),
+        ('token', 'A seed '),
+        ('done', {'name': 'Bulbasaur', 'explanation': 'A seed', 'fallback': True}),
+    ]
+    assert app.llm_cache.stats()['size'] == 0
@@ -0,0 +1,52 @@
+"""Prometheus text exposition from /metrics."""
+import os
+import re
+
+import app
+
+# name{labels} value, as the text format requires
+SAMPLE_LINE = re.compile(r'^[a-zA-Z_:][a-zA-Z0-9_:]*\{([a-zA-Z_][a-zA-Z0-9_]*="(\\.|[^"\\])*",?)*\} \S+$')
+
+
+def test_histogram_buckets_are_cumulative():
+    histogram = app.Histogram('test_seconds', 'Test latency.', ('stage',), buckets=(0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 2.0):
+        histogram.observe(value, 'embed')
+    worker = os.getpid()
+    assert histogram.render() == [
+        '# HELP test_seconds Test latency.',
+        '# TYPE test_seconds histogram',
+        f'test_seconds_bucket{{worker="{worker}",stage="embed",le="0.1"}} 2',  # le is inclusive
+        f'test_seconds_bucket{{worker="{worker}",stage="embed",le="1.0"}} 3',
+        f'test_seconds_bucket{{worker="{worker}",stage="embed",le="+Inf"}} 4',
+        f'test_seconds_sum{{worker="{worker}",stage="embed"}} 2.65',
+        f'test_seconds_count{{worker="{worker}",stage="embed"}} 4',
+    ]
+
+
+def test_histogram_keeps_one_series_per_label_set():
+    histogram = app.Histogram('test_seconds', 'Test latency.', ('endpoint', 'status'), buckets=(1.0,))
+    histogram.observe(0.5, 'index', 200)
+    histogram.observe(0.5, 'index', 500)
+    histogram.observe(0.5, 'index', 200)
+    counts = [line for line in histogram.render() if line.startswith('test_seconds_count')]
+    assert [line.rsplit(' ', 1)[1] for line in counts] == ['2', '1']
+    assert 'status="500"' in counts[1]
+
+
+def test_label_values_are_escaped():
+    assert app.metric_labels(('a', 'b'), ('say "hi"\n', 'C:\\x')) == 'a="say \\"hi\\"\\n",b="C:\\\\x"'
+
+
+def test_metrics_endpoint_is_valid_exposition():
+    app.request_latency.observe(0.2, 'index', 'GET', 200)
+    response = app.app.test_client().get('/metrics')
+    assert response.status_code == 200
+    assert response.mimetype == 'text/plain'
+    body = response.get_data(as_text=True)
+    assert body.endswith('\n')
+    for line in body.splitlines():
+        assert line.startswith(('# HELP ', '# TYPE ')) or SAMPLE_LINE.match(line), line
+    for name in ('pokemon_http_request_duration_seconds_bucket', 'pokemon_cache_hits_total',
+                 'pokemon_singleflight_requests_total', 'pokemon_db_pool_connections'):
+        assert f'\n{name}{{worker="{os.getpid()}"' in body
@@ -0,0 +1,108 @@
+"""Catalogue change detection and precomputed popular answers."""
+import json
+
+import numpy as np
+import psycopg2
+
+import app
+from fakedb import StubPool
+
+
+class Catalogue:
+    """A pokemon/popular_answers database whose fingerprint and failures the test controls."""
+
+    def __init__(self):
+        self.version = (3, "abc")
+        self.answers = []  # (query_norm, embedding, candidates, choice_name, explanation)
+        self.answers_error = None
+
+    def respond(self, sql, params):
+        if "popular_answers" in sql:
+            if self.answers_error:
+                raise self.answers_error
+            return self.answers
+        return [self.version]
+
+
+def test_watcher_retries_only_the_failed_listener():
+    catalogue = Catalogue()
+    catalogue.answers_error = psycopg2.errors.UndefinedTable('relation "popular_answers" does not exist')
+    watcher = app.CatalogWatcher(StubPool(catalogue.respond), interval=60)
+    calls = {"clear": 0}
+    answers = app.PopularAnswers(StubPool(catalogue.respond))
+
+    def clear():
+        calls["clear"] += 1
+
+    watcher.add_listener(clear)
+    watcher.add_listener(answers.load)
+    assert watcher.check() is True
+    assert watcher.check() is False  # Only answers.load runs again
+    assert watcher.check() is False
+    assert calls["clear"] == 1
+
+    catalogue.answers_error = None
+    assert watcher.check() is False
+    assert watcher._pending == []
+    catalogue.version = (4, "def")
+    assert watcher.check() is True
+    assert calls["clear"] == 2
+
+
+def test_watcher_retries_a_raising_listener():
+    catalogue = Catalogue()
+    watcher = app.CatalogWatcher(StubPool(catalogue.respond), interval=60)
+    attempts = []
+
+    def flaky():
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise RuntimeError("transient")
+
+    watcher.add_listener(flaky)
+    watcher.check()
+    watcher.check()
+    watcher.check()
+    assert len(attempts) == 2
+
+
+def test_watcher_refresh_reruns_every_listener():
+    catalogue = Catalogue()
+    watcher = app.CatalogWatcher(StubPool(catalogue.respond), interval=60)
+    calls = []
+    watcher.add_listener(lambda: calls.append(1))
+    watcher.check()
+    watcher.check(force=True)
+    assert len(calls) == 2
+
+
+def unit(*values):
+    vector = np.zeros(app.EMBEDDING_DIM, dtype=np.float32)
+    vector[:len(values)] = values
+    return vector / np.linalg.norm(vector)
+
+
+def test_popular_answer_matches_text_then_similar_embedding():
+    catalogue = Catalogue()
+    candidates = [{'name': 'Charmander', 'description': 'A fire lizard.'}]
+    catalogue.answers = [
+        ("fire type", str(unit(1, 0).tolist()), json.dumps(candidates), "Charmander", "It breathes fire."),
+    ]
+    answers = app.PopularAnswers(StubPool(catalogue.respond), threshold=0.95)
+    assert answers.load() is True
+
+    assert answers.match("  Fire TYPE!")['name'] == "Charmander"  # Normalized text
+    assert answers.match("a fire pokemon") is None  # No embedding yet
+    close = unit(1, 0.2)  # cosine ~0.98
+    far = unit(1, 0.5)  # cosine ~0.89
+    assert answers.match("a fire pokemon", close)['candidates'] == candidates
+    assert answers.match("a fire pokemon", far) is None
+    assert answers.match("a fire pokemon", np.zeros(app.EMBEDDING_DIM)) is None
+
+
+def test_popular_answers_not_loaded_on_error():
+    catalogue = Catalogue()
+    catalogue.answers_error = psycopg2.OperationalError("gone")
+    answers = app.PopularAnswers(StubPool(catalogue.respond))
+    assert answers.load() is False
+    assert answers.match("fire type") is None
@@ -0,0 +1,42 @@
+"""Request latency recording, including the streamed /recommend/stream route."""
+import logging
+import time
+
+import app
+
+
+def request_series(endpoint):
+    """(count, sum) observed for an endpoint's 200s so far."""
+    series = app.request_latency._series.get((endpoint, 'GET', 200))
+    return (0, 0.0) if series is None else (sum(series[:-1]), series[-1])
+
+
+def test_streamed_request_is_recorded_when_the_body_finishes(monkeypatch, caplog):
+    def slow_recommendation(query_text):
+        with app.timed('llm_stream'):
+            time.sleep(0.05)
+        yield 'done', {'name': 'Charmander', 'explanation': 'It breathes fire.'}
+
+    monkeypatch.setattr(app, "stream_recommendation", slow_recommendation)
+    monkeypatch.setattr(app, "SLOW_REQUEST_SECONDS", 0.01)
+    caplog.set_level(logging.WARNING, logger="app")
+    count, total = request_series('recommend_stream')
+
+    response = app.app.test_client().get('/recommend/stream?query_text=fire+type')
+    assert request_series('recommend_stream')[0] == count  # Not yet: the body hasn't been sent
+    body = response.get_data(as_text=True)
+    response.close()
+
+    assert 'event: done' in body
+    new_count, new_total = request_series('recommend_stream')
+    assert new_count == count + 1
+    assert new_total - total >= 0.05
+    slow = [r.getMessage() for r in caplog.records if '/recommend/stream' in r.getMessage()]
+    assert len(slow) == 1 and 'llm_stream=' in slow[0]
+
+
+def test_plain_request_is_recorded_in_after_request():
+    count, _ = request_series('healthz')
+    response = app.app.test_client().get('/healthz')
+    assert response.status_code == 200
+    assert request_series('healthz')[0] == count + 1
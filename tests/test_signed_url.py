@@ -0,0 +1,57 @@
+"""Signed URL and image existence caching in get_signed_url()."""
+import time
+
+import pytest
+
+import app
+from fakes import FakeCredentials, FakeStorageClient, Latency
+
+
+class CountingLatency(Latency):
+    """No delay; counts calls to Cloud Storage."""
+
+    def __init__(self):
+        super().__init__()
+        self.calls = 0
+
+    def sleep(self, items=1):
+        self.calls += 1
+
+
+@pytest.fixture
+def storage(monkeypatch):
+    latency = CountingLatency()
+    monkeypatch.setattr(app, "storage_client", FakeStorageClient(latency))
+    monkeypatch.setattr(app, "credentials", FakeCredentials())
+    monkeypatch.setattr(app, "BUCKET_NAME", "test-bucket")
+    monkeypatch.setattr(app, "signed_url_cache", app.LRUCache(16, 60))
+    monkeypatch.setattr(app, "image_exists_cache", app.LRUCache(16, 60))
+    return latency
+
+
+def test_signed_url_is_cached(storage):
+    url = app.get_signed_url("Pikachu")
+    assert url == f"https://storage.invalid/images/pikachu.png?X-Goog-Expires={app.SIGNED_URL_EXPIRATION}"
+    assert storage.calls == 2  # exists() and signing
+    assert app.get_signed_url("Pikachu") == url
+    assert storage.calls == 2
+
+
+def test_signed_url_is_resigned_after_expiry(storage, monkeypatch):
+    monkeypatch.setattr(app, "signed_url_cache", app.LRUCache(16, 0.05))
+    app.get_signed_url("Pikachu")
+    time.sleep(0.1)
+    assert app.get_signed_url("Pikachu") is not None
+    assert storage.calls == 3  # Existence is still cached; only the URL is signed again
+
+
+def test_signed_url_for_missing_image(storage):
+    app.image_exists_cache.set("images/missingno.png", False)
+    assert app.get_signed_url("MissingNo") is None
+    assert storage.calls == 0
+
+
+def test_signed_url_without_storage_client(monkeypatch):
+    monkeypatch.setattr(app, "storage_client", None)
+    monkeypatch.setattr(app, "_google_retry_at", time.monotonic() + 60)  # In backoff after a failed init
+    assert app.get_signed_url("Pikachu") is None
@@ -0,0 +1,163 @@
+"""Request coalescing with SingleFlight."""
+import threading
+import time
+
+import pytest
+
+import app
+
+
+def run_concurrently(count, target):
+    results, errors = [None] * count, [None] * count
+
+    def call(i):
+        try:
+            results[i] = target()
+        except Exception as e:
+            errors[i] = e
+
+    threads = [threading.Thread(target=call, args=(i,)) for i in range(count)]
+    for thread in threads:
+        thread.start()
+    return threads, results, errors
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.005)
+
+
+def test_single_flight_coalesces_concurrent_calls():
+    flight = app.SingleFlight(max_waiters=10, timeout=5)
+    release = threading.Event()
+    calls = []
+
+    def slow(value):
+        calls.append(value)
+        release.wait(5)
+        return {'answer': value}
+
+    threads, results, errors = run_concurrently(5, lambda: flight.do("fire type", slow, 42))
+    wait_for(lambda: flight.stats()['coalesced'] == 4)
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert calls == [42]
+    assert errors == [None] * 5
+    assert all(result is results[0] for result in results)
+    assert flight.stats() == {'in_flight': 0, 'leaders': 1, 'coalesced': 4, 'overflows': 0, 'timeouts': 0}
+    assert flight.do("fire type", lambda: "new call") == "new call"
+
+
+def test_single_flight_shares_errors():
+    flight = app.SingleFlight(max_waiters=10, timeout=5)
+    release = threading.Event()
+
+    def failing():
+        release.wait(5)
+        raise ValueError("boom")
+
+    threads, _, errors = run_concurrently(3, lambda: flight.do("key", failing))
+    wait_for(lambda: flight.stats()['coalesced'] == 2)
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert [type(e) for e in errors] == [ValueError] * 3
+
+
+def test_single_flight_overflow_runs_own_call():
+    flight = app.SingleFlight(max_waiters=1, timeout=5)
+    release = threading.Event()
+    calls = []
+
+    def slow():
+        calls.append(1)
+        release.wait(5)
+        return len(calls)
+
+    threads, _, errors = run_concurrently(2, lambda: flight.do("key", slow))
+    wait_for(lambda: flight.stats()['coalesced'] == 1)
+    assert flight.do("key", lambda: "own") == "own"
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert errors == [None, None]
+    assert flight.stats()['overflows'] == 1
+
+
+def test_single_flight_waiter_times_out():
+    flight = app.SingleFlight(max_waiters=10, timeout=0.05)
+    release = threading.Event()
+    leader = threading.Thread(target=flight.do, args=("key", release.wait, 5))
+    leader.start()
+    wait_for(lambda: flight.stats()['in_flight'] == 1)
+    with pytest.raises(app.SingleFlightTimeout):
+        flight.do("key", lambda: "unused")
+    release.set()
+    leader.join()
+    assert flight.stats()['timeouts'] == 1
+
+
+def test_single_flight_stream_replays_items_to_waiters():
+    flight = app.SingleFlight(max_waiters=10, timeout=5)
+    first_sent, release = threading.Event(), threading.Event()
+    calls = []
+
+    def produce():
+        calls.append(1)
+        yield "a"
+        first_sent.set()
+        release.wait(5)
+        yield "b"
+        yield "c"
+
+    leader = flight.stream("key", produce)
+    assert next(leader) == "a"
+    threads, results, errors = run_concurrently(3, lambda: list(flight.stream("key", produce)))
+    wait_for(lambda: flight.stats()['coalesced'] == 3)
+    release.set()
+    assert list(leader) == ["b", "c"]
+    for thread in threads:
+        thread.join()
+    assert calls == [1]
+    assert results == [["a", "b", "c"]] * 3
+    assert errors == [None] * 3
+
+
+def test_single_flight_stream_continues_after_leader_disconnects():
+    flight = app.SingleFlight(max_waiters=10, timeout=5)
+    release = threading.Event()
+
+    def produce():
+        yield "a"
+        release.wait(5)
+        yield "b"
+
+    leader = flight.stream("key", produce)
+    assert next(leader) == "a"
+    threads, results, _ = run_concurrently(1, lambda: list(flight.stream("key", produce)))
+    wait_for(lambda: flight.stats()['coalesced'] == 1)
+    closer = threading.Thread(target=leader.close)  # The leader's client went away
+    closer.start()
+    release.set()
+    closer.join()
+    threads[0].join()
+    assert results[0] == ["a", "b"]
+
+
+def test_single_flight_stream_stops_when_nobody_listens():
+    flight = app.SingleFlight(max_waiters=10, timeout=5)
+    produced = []
+
+    def produce():
+        for item in "abc":
+            produced.append(item)
+            yield item
+
+    leader = flight.stream("key", produce)
+    assert next(leader) == "a"
+    leader.close()
+    assert produced == ["a"]
+    assert flight.stats()['in_flight'] == 0
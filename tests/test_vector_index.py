@@ -0,0 +1,129 @@
+"""InMemoryVectorIndex ranks like pgvector's ORDER BY, also when compact and re-ranked."""
+import time
+
+import numpy as np
+import pytest
+
+import app
+from fakedb import StubPool
+
+DIM = 16
+
+# pgvector's operators, ascending order is nearest first
+SQL_DISTANCES = {
+    'cosine': lambda rows, q: 1 - rows @ q / (np.linalg.norm(rows, axis=1) * np.linalg.norm(q)),  # <=>
+    'l2': lambda rows, q: np.linalg.norm(rows - q, axis=1),  # <->
+    'ip': lambda rows, q: -(rows @ q),  # <#>
+}
+
+
+def catalogue(rows=200, seed=0):
+    rng = np.random.default_rng(seed)
+    matrix = rng.normal(size=(rows, DIM)) * rng.uniform(0.5, 2.0, size=(rows, 1))  # Unequal norms
+    return [f"P{i:03d}" for i in range(rows)], matrix
+
+
+def sql_order(matrix, query, distance, k):
+    distances = SQL_DISTANCES[distance](matrix.astype(np.float64), np.asarray(query, dtype=np.float64))
+    return [f"P{i:03d}" for i in np.argsort(distances, kind='stable')[:k]]
+
+
+def build(distance, names, matrix, **kwargs):
+    index = app.InMemoryVectorIndex(None, dim=DIM, distance=distance, **kwargs)
+    index.build(names, [f"{name} description" for name in names], matrix.astype(np.float32))
+    return index
+
+
+@pytest.mark.parametrize("distance", sorted(SQL_DISTANCES))
+def test_float32_top_k_matches_sql_order(distance):
+    names, matrix = catalogue()
+    index = build(distance, names, matrix, dtype='float32')
+    queries = np.random.default_rng(1).normal(size=(50, DIM))
+    for query in queries:
+        rows = index.search(query.tolist(), k=5)
+        assert [name for name, _ in rows] == sql_order(matrix, query, distance, 5)
+    assert rows[0][1] == f"{rows[0][0]} description"
+
+
+def test_search_edge_cases():
+    names, matrix = catalogue(rows=3)
+    index = build('cosine', names, matrix, dtype='float32')
+    assert len(index.search(matrix[0].tolist(), k=10)) == 3
+    assert index.search([0.0] * DIM, k=3) == []  # Cosine is undefined for a zero query
+    assert build('cosine', [], np.empty((0, DIM)), dtype='float32').search(matrix[0].tolist()) == []
+
+
+def test_load_reads_pgvector_text():
+    names, matrix = catalogue(rows=20)
+    rows = [(name, f"{name} description", "[" + ",".join(map(str, vector.astype(np.float32))) + "]")
+            for name, vector in zip(names, matrix)]
+    index = app.InMemoryVectorIndex(StubPool(lambda sql, params: rows), dim=DIM, distance='l2', dtype='float32')
+    assert not index.ready
+    assert index.load() is True
+    query = matrix[7] + 0.01
+    assert [name for name, _ in index.search(query.tolist(), k=3)] == sql_order(matrix, query, 'l2', 3)
+
+
+def test_unknown_dtype_is_rejected():
+    with pytest.raises(ValueError):
+        app.InMemoryVectorIndex(None, dtype='bf16')
+
+
+class VectorStore:
+    """Answers the re-rank fetch from the float32 catalogue; `down` simulates an unavailable database."""
+
+    def __init__(self, names, matrix):
+        self.vectors = dict(zip(names, matrix.astype(np.float32)))
+        self.down = False
+        self.fetches = 0
+
+    def run(self, fn, *args):
+        self.fetches += 1
+        if self.down:
+            return fn(None, *args)  # What DBConnectionPool.run passes when no connection is available
+        return StubPool(self.respond).run(fn, *args)
+
+    def respond(self, sql, params):
+        return [(name, self.vectors[name].tolist()) for name in params[0] if name in self.vectors]
+
+
+@pytest.mark.parametrize("dtype", ["int8", "float16"])
+@pytest.mark.parametrize("distance", sorted(SQL_DISTANCES))
+def test_compact_index_with_rerank_matches_exact(dtype, distance):
+    names, matrix = catalogue()
+    store = VectorStore(names, matrix)
+    index = app.InMemoryVectorIndex(store, dim=DIM, distance=distance, dtype=dtype, rerank=40)
+    index.build(names, names, matrix.astype(np.float32))
+    for query in np.random.default_rng(2).normal(size=(30, DIM)):
+        assert [name for name, _ in index.search(query.tolist(), k=5)] == sql_order(matrix, query, distance, 5)
+    assert store.fetches == 30
+    assert index.nbytes < build(distance, names, matrix, dtype='float32').nbytes
+
+
+def test_rerank_drops_rows_deleted_since_load():
+    names, matrix = catalogue()
+    store = VectorStore(names, matrix)
+    index = app.InMemoryVectorIndex(store, dim=DIM, distance='l2', dtype='int8', rerank=40)
+    index.build(names, names, matrix.astype(np.float32))
+    query = matrix[5]
+    nearest = sql_order(matrix, query, 'l2', 4)
+    del store.vectors[nearest[0]]
+    assert [name for name, _ in index.search(query.tolist(), k=3)] == nearest[1:]
+
+
+def test_failed_rerank_fetch_backs_off():
+    names, matrix = catalogue()
+    store = VectorStore(names, matrix)
+    store.down = True
+    index = app.InMemoryVectorIndex(store, dim=DIM, distance='cosine', dtype='int8', rerank=40, failure_backoff=0.1)
+    index.build(names, names, matrix.astype(np.float32))
+    query = matrix[5].tolist()
+    for _ in range(5):
+        assert len(index.search(query, k=3)) == 3  # The int8 ranking is still served
+    assert store.fetches == 1
+    assert index.rerank_skips == 4
+
+    store.down = False
+    time.sleep(0.15)
+    assert [name for name, _ in index.search(query, k=3)] == sql_order(matrix, matrix[5], 'cosine', 3)
+    assert store.fetches == 2
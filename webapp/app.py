@@ -1,15 +1,30 @@
 import os
+import re
+import time
+import hashlib
+import json
+import signal
+import datetime
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict
+import atexit
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
 import psycopg2
-from flask import Flask, request, jsonify, render_template # Import render_template
+from psycopg2 import extensions
+import numpy as np
+from flask import Flask, Response, g, has_request_context, request, jsonify, render_template, stream_with_context # Import render_template
 from google.cloud import storage
 import logging
 from google import auth
 
 from google import genai
-from google.genai.types import EmbedContentConfig
+from google.genai.types import EmbedContentConfig, GenerateContentConfig, HttpOptions
 
 # Configure logging (moved to top for consistent logging)
-logging.basicConfig(level=logging.DEBUG)  # Set the default log level
+logging.basicConfig(level=os.environ.get('LOG_LEVEL', 'INFO').upper())  # DEBUG logs every request and LLM response
 logger = logging.getLogger(__name__)  # Get a logger for this module
 
 app = Flask(__name__)  # Flask automatically looks for templates/ and static/
@@ -19,36 +34,285 @@ DB_HOST = os.environ.get('DB_HOST_PROXY')
 DB_NAME = os.environ.get('DB_NAME')
 DB_USER = os.environ.get('DB_USER')
 DB_PASSWORD = os.environ.get('DB_PASSWORD')
+DB_PORT = int(os.environ.get('DB_PORT', 5432))
 BUCKET_NAME = os.environ.get('BUCKET_NAME')
 
+# Connection pool sizing (per worker process)
+DB_POOL_MIN_SIZE = int(os.environ.get('DB_POOL_MIN_SIZE', 1))
+DB_POOL_MAX_SIZE = int(os.environ.get('DB_POOL_MAX_SIZE', 5))
+DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', 10))  # Seconds to wait for a free connection
+DB_POOL_HEALTHCHECK_INTERVAL = float(os.environ.get('DB_POOL_HEALTHCHECK_INTERVAL', 30))  # Ping connections idle longer than this
+DB_CONNECT_TIMEOUT = int(os.environ.get('DB_CONNECT_TIMEOUT', 5))  # Seconds; keeps startup and reconnects from hanging
+
+# Vector distance used for search. The HNSW index must be built with the matching
+# operator class (see db/migrations, `python db/migrate.py --reindex --distance=...`).
+VECTOR_DISTANCES = {
+    'cosine': ('<=>', 'vector_cosine_ops'),
+    'l2': ('<->', 'vector_l2_ops'),
+    'ip': ('<#>', 'vector_ip_ops'),
+}
+VECTOR_DISTANCE = os.environ.get('VECTOR_DISTANCE', 'cosine')
+VECTOR_OPERATOR = VECTOR_DISTANCES[VECTOR_DISTANCE][0]
+HNSW_EF_SEARCH = int(os.environ.get('HNSW_EF_SEARCH', 40))  # Candidate list size per HNSW search (recall vs latency)
+VECTOR_INDEX_NAME = 'pokemon_embedding_idx'
+
+# Two-stage search over the optional compact columns (db/migrate.py --compact_embeddings):
+# an HNSW search on the float16 (halfvec) or sign-bit (binary) copy picks RERANK_CANDIDATES
+# rows, which are re-ranked exactly with the float32 embedding. 'exact' searches the float32
+# index directly and needs no compact columns.
+VECTOR_SEARCH_MODE = os.environ.get('VECTOR_SEARCH_MODE', 'exact')  # exact | halfvec | binary
+RERANK_CANDIDATES = int(os.environ.get('RERANK_CANDIDATES', 40))  # Shortlist size; also bounds hnsw.ef_search from below
+# SEARCH_BACKEND=memory: float32 | int8 (a quarter of the memory, and faster) | float16 (half the memory,
+# but an order of magnitude slower to score: NumPy has no fast float16 matmul; use it only to save memory)
+MEMORY_INDEX_DTYPE = os.environ.get('MEMORY_INDEX_DTYPE', 'float32')
+RERANK_FAILURE_BACKOFF = float(os.environ.get('RERANK_FAILURE_BACKOFF', 30))  # Seconds a failed in-memory re-rank fetch stays skipped
+
 PROJECT_ID = os.environ.get('GOOGLE_CLOUD_PROJECT')
 region = "us-central1"
 MODEL_NAME_EMBEDDING = "text-embedding-005" # Change based on SDK
 MODEL_NAME_LLM = "gemini-2.0-flash"
+EMBEDDING_DIM = 768
+# Per-call timeouts for Vertex AI (milliseconds)
+EMBEDDING_TIMEOUT_MS = int(os.environ.get('EMBEDDING_TIMEOUT_MS', 10000))
+LLM_TIMEOUT_MS = int(os.environ.get('LLM_TIMEOUT_MS', 30000))
 
-credentials=None
+# Query-embedding cache
+EMBEDDING_CACHE_SIZE = int(os.environ.get('EMBEDDING_CACHE_SIZE', 2048))  # Entries kept in-process
+EMBEDDING_CACHE_TTL = float(os.environ.get('EMBEDDING_CACHE_TTL', 86400))  # Seconds
+CACHE_REDIS_URL = os.environ.get('CACHE_REDIS_URL')  # Optional shared tier (e.g. Memorystore), shared by all replicas
 
-# Storage Client Init (keep as before)
-try:
-    credentials, project = auth.default(
-        #     scopes=SCOPES
-        )
-    credentials.refresh(auth.transport.requests.Request())
-    storage_client = storage.Client(credentials=credentials)
-    logger.info("Storage client initialized successfully.")
-except Exception as e:
-    logger.error(f"Failed to initialize storage client: {e}")
-    storage_client = None
-
-# DB Connection function (keep as before)
+# LLM re-ranking cache, dropped whenever the pokemon table changes
+LLM_CACHE_SIZE = int(os.environ.get('LLM_CACHE_SIZE', 1024))
+LLM_CACHE_TTL = float(os.environ.get('LLM_CACHE_TTL', 3600))
+CATALOG_CHECK_INTERVAL = float(os.environ.get('CATALOG_CHECK_INTERVAL', 60))  # Seconds between pokemon table fingerprint checks
+
+# Precomputed answers for popular queries (webapp/precompute.py)
+POPULAR_MATCH_THRESHOLD = float(os.environ.get('POPULAR_MATCH_THRESHOLD', 0.95))  # Min cosine similarity to reuse an answer; >1 disables fuzzy matches
+
+# Signed image URLs
+SIGNED_URL_EXPIRATION = int(os.environ.get('SIGNED_URL_EXPIRATION', 900))  # Seconds a signed URL stays valid
+SIGNED_URL_REFRESH_MARGIN = int(os.environ.get('SIGNED_URL_REFRESH_MARGIN', 120))  # Re-sign this long before expiry
+IMAGE_MISSING_RECHECK = float(os.environ.get('IMAGE_MISSING_RECHECK', 300))  # Seconds before re-checking a missing image
+
+# Request coalescing: concurrent identical queries share one embed -> search -> LLM run
+SINGLEFLIGHT_MAX_WAITERS = int(os.environ.get('SINGLEFLIGHT_MAX_WAITERS', 64))  # Further identical requests run on their own
+SINGLEFLIGHT_TIMEOUT = float(os.environ.get('SINGLEFLIGHT_TIMEOUT', (EMBEDDING_TIMEOUT_MS + LLM_TIMEOUT_MS) / 1000 + 5))  # Seconds a waiter waits
+
+# Background threads for independent per-request I/O (e.g. signing image URLs while the LLM runs)
+IO_POOL_SIZE = int(os.environ.get('IO_POOL_SIZE', 16))
+
+# Vector search backend: 'pgvector' (ORDER BY in Postgres) or 'memory' (NumPy matrix loaded at startup)
+SEARCH_BACKEND = os.environ.get('SEARCH_BACKEND', 'pgvector')
+
+# Access tokens are refreshed in the background this long before they expire
+CREDENTIAL_REFRESH_MARGIN = float(os.environ.get('CREDENTIAL_REFRESH_MARGIN', 300))
+GOOGLE_INIT_MAX_BACKOFF = float(os.environ.get('GOOGLE_INIT_MAX_BACKOFF', 60))  # Max seconds between failed ADC/client setup attempts
+
+# Observability
+TRACE_PROPAGATION = os.environ.get('TRACE_PROPAGATION', 'false').lower() in ('1', 'true', 'yes')  # Forward W3C traceparent to Vertex AI
+SLOW_REQUEST_SECONDS = float(os.environ.get('SLOW_REQUEST_SECONDS', 5))  # Requests slower than this log their stage breakdown as WARNING
+
+# --- Metrics ---
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def metric_labels(names, values):
+    """'a="x",b="y"' with Prometheus label value escaping."""
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for v in values)
+    return ','.join(f'{n}="{v}"' for n, v in zip(names, escaped))
+
+
+class Histogram:
+    """Thread-safe Prometheus histogram (cumulative buckets, sum and count) per set of label values.
+
+    Metrics are per worker process; every series carries a `worker` label so
+    scrapes that land on different gunicorn workers don't look like resets.
+    """
+
+    def __init__(self, name, documentation, labelnames, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}  # label values -> [count per bucket..., count above the last bucket, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labelvalues):
+        index = bisect_left(self.buckets, value)  # First bucket with value <= le
+        with self._lock:
+            series = self._series.get(labelvalues)
+            if series is None:
+                series = self._series[labelvalues] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    def render(self):
+        with self._lock:
+            snapshot = {labels: list(series) for labels, series in self._series.items()}
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        names = ('worker',) + self.labelnames
+        for labelvalues, series in sorted(snapshot.items()):
+            labels = metric_labels(names, (os.getpid(),) + labelvalues)
+            cumulative = 0
+            for le, count in zip(self.buckets + (float('inf'),), series):
+                cumulative += count
+                le = '+Inf' if le == float('inf') else repr(le)
+                lines.append(f'{self.name}_bucket{{{labels},le="{le}"}} {cumulative}')
+            lines.append(f"{self.name}_sum{{{labels}}} {series[-1]}")
+            lines.append(f"{self.name}_count{{{labels}}} {cumulative}")
+        return lines
+
+
+request_latency = Histogram('pokemon_http_request_duration_seconds', 'HTTP request latency.', ('endpoint', 'method', 'status'))
+stage_latency = Histogram('pokemon_stage_duration_seconds', 'Latency of each recommendation stage, cache hits included.', ('stage',))
+
+
+@contextmanager
+def timed(stage):
+    """Times a block (or, as a decorator, a call) into stage_latency and the current request's Server-Timing."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        stage_latency.observe(elapsed, stage)
+        if has_request_context():  # Not set for work running on io_executor threads
+            g.stage_timings = getattr(g, 'stage_timings', []) + [(stage, elapsed)]
+
+
+# --- Trace context (W3C traceparent) ---
+TRACEPARENT_RE = re.compile(r'^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$')
+
+def trace_headers():
+    """traceparent for an outgoing call, as a child of the current request's trace. Empty if disabled."""
+    if not TRACE_PROPAGATION or not has_request_context() or 'trace_id' not in g:
+        return {}
+    return {'traceparent': f"00-{g.trace_id}-{os.urandom(8).hex()}-{g.trace_flags}"}
+
+
+# --- Google credentials and Storage client ---
+# Resolved by the background warmup (see warm_up) rather than at import, so the
+# server starts listening immediately. Code paths that need them before warmup
+# finishes initialize them on demand.
+credentials = None
+storage_client = None
+_google_init_lock = threading.Lock()
+_google_init_failures = 0
+_google_retry_at = 0.0  # time.monotonic() before which a failed setup isn't retried
+
+def init_google_clients():
+    """Resolves ADC, fetches the first access token and creates the Storage client once.
+
+    A failure is not final: the next call after an exponential backoff (capped
+    at GOOGLE_INIT_MAX_BACKOFF) tries again, and calls in between return False
+    at once instead of waiting on ADC. Returns True if a Storage client is available.
+    """
+    global credentials, storage_client, _google_init_failures, _google_retry_at
+    if storage_client is not None:
+        return True
+    if time.monotonic() < _google_retry_at:
+        return False
+    with _google_init_lock:
+        if storage_client is None and time.monotonic() >= _google_retry_at:
+            try:
+                resolved, project = auth.default(
+                    #     scopes=SCOPES
+                    )
+                resolved.refresh(auth.transport.requests.Request())
+                credentials = resolved
+                storage_client = storage.Client(credentials=resolved)
+                _google_init_failures = 0
+                logger.info("Storage client initialized successfully.")
+            except Exception as e:
+                delay = min(GOOGLE_INIT_MAX_BACKOFF, 2 ** _google_init_failures)
+                _google_init_failures += 1
+                _google_retry_at = time.monotonic() + delay
+                logger.error(f"Failed to initialize storage client, retrying in {delay:.0f}s: {e}")
+    return storage_client is not None
+
+
+def google_clients_ready():
+    return credentials is not None and _genai_client is not None
+
+
+def ensure_google_clients():
+    """Retries whichever of credentials, Storage and GenAI clients is still missing. Returns google_clients_ready()."""
+    if init_google_clients():
+        try:
+            get_genai_client()
+        except Exception as e:
+            logger.error(f"GenAI client setup failed: {e}")
+    return google_clients_ready()
+
+
+class CredentialRefresher:
+    """Refreshes the shared credentials shortly before the access token expires.
+
+    The GenAI client and URL signing read the same credentials object, so
+    requests find a valid token instead of blocking on a refresh. Failed
+    refreshes are retried every `retry_interval` seconds. Until credentials and
+    the GenAI client exist (e.g. ADC failed at startup) it keeps retrying their
+    setup, following init_google_clients' backoff.
+    """
+
+    def __init__(self, margin, retry_interval=30.0):
+        self.margin = margin
+        self.retry_interval = retry_interval
+        self._stop = threading.Event()
+
+    def seconds_until_refresh(self, creds):
+        expiry = getattr(creds, 'expiry', None)  # Naive UTC datetime; None for tokens without an expiry
+        if expiry is None:
+            return None
+        now = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+        return (expiry - now).total_seconds() - self.margin
+
+    def start(self):
+        threading.Thread(target=self._run, name="credential-refresher", daemon=True).start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            if not google_clients_ready() and not ensure_google_clients():
+                self._stop.wait(min(self.retry_interval, max(1.0, _google_retry_at - time.monotonic())))
+                continue
+            creds = credentials
+            delay = self.retry_interval
+            if creds is not None:
+                remaining = self.seconds_until_refresh(creds)
+                if remaining is not None and remaining <= 0:
+                    try:
+                        creds.refresh(auth.transport.requests.Request())
+                        logger.info(f"Refreshed access token; valid until {creds.expiry} UTC.")
+                        remaining = self.seconds_until_refresh(creds)
+                    except Exception as e:
+                        logger.warning(f"Access token refresh failed, retrying in {self.retry_interval}s: {e}")
+                        remaining = None
+                if remaining is not None and remaining > 0:
+                    delay = remaining
+            self._stop.wait(delay)
+
+
+credential_refresher = CredentialRefresher(CREDENTIAL_REFRESH_MARGIN)
+
+def search_ef(mode=VECTOR_SEARCH_MODE):
+    """hnsw.ef_search for the session; an HNSW scan returns at most ef_search rows, so the shortlist needs that many."""
+    return HNSW_EF_SEARCH if mode == 'exact' else max(HNSW_EF_SEARCH, RERANK_CANDIDATES)
+
+
+# DB Connection function (used by the pool to open new connections)
 def get_db_connection():
     try:
         conn = psycopg2.connect(
             host=DB_HOST,
-            port=5432, # Use DB_PORT env var if set, else 5432
+            port=DB_PORT,
             database=DB_NAME,
             user=DB_USER,
-            password=DB_PASSWORD
+            password=DB_PASSWORD,
+            connect_timeout=DB_CONNECT_TIMEOUT,
+            options=f"-c hnsw.ef_search={search_ef()}", # Per-session HNSW tuning, no extra round trip
             )
         # logging.info("Database connection successful.")
         return conn
@@ -56,26 +320,861 @@ def get_db_connection():
         logger.error(f"Error connecting to database: {e}")
         return None
 
-# Signed URL function (keep as before)
+
+class DBConnectionPool:
+    """Bounded, thread-safe pool of long-lived psycopg2 connections.
+
+    Connections idle for longer than `healthcheck_interval` are pinged on
+    checkout and replaced if the Cloud SQL proxy dropped them (e.g. after a
+    proxy restart). A recently used connection is not pinged, so `run()`
+    retries once when the connection dies mid-query. When all `max_size`
+    connections are in use, callers wait up to `timeout` seconds for one to
+    be returned.
+    """
+
+    def __init__(self, connect, min_size=1, max_size=5, timeout=10.0, healthcheck_interval=30.0):
+        self._connect = connect
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.healthcheck_interval = healthcheck_interval
+        self._cond = threading.Condition()
+        self._idle = []  # (conn, last_used) pairs, most recently used last
+        self._size = 0  # Open connections, idle + in use (+ ones being opened)
+        self._in_use = 0
+        self._waiters = 0
+        # Counters for stats()
+        self._checkouts = 0
+        self._timeouts = 0
+        self._reconnects = 0
+        self._wait_time_total = 0.0
+        self._wait_time_max = 0.0
+
+    def prefill(self):
+        """Opens `min_size` connections up front so the first requests don't pay for the handshake."""
+        while True:
+            with self._cond:
+                if self._size >= self.min_size:
+                    return
+                self._size += 1
+            conn = self._connect()
+            with self._cond:
+                if conn is None:
+                    self._size -= 1
+                    return
+                self._idle.append((conn, time.monotonic()))
+                self._cond.notify()
+
+    def getconn(self):
+        """Borrows a healthy connection. Returns None if none could be obtained."""
+        start = time.monotonic()
+        deadline = start + self.timeout
+        with self._cond:
+            if not self._idle and self._size >= self.max_size:
+                self._waiters += 1
+                try:
+                    while not self._idle and self._size >= self.max_size:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            self._timeouts += 1
+                            logger.error(f"Timed out after {self.timeout}s waiting for a database connection ({self._in_use} in use).")
+                            return None
+                        self._cond.wait(remaining)
+                finally:
+                    self._waiters -= 1
+            if self._idle:
+                conn, last_used = self._idle.pop()
+            else:
+                conn, last_used = None, None
+                self._size += 1  # Reserve the slot; the connection is opened outside the lock
+            self._in_use += 1
+            waited = time.monotonic() - start
+            self._checkouts += 1
+            self._wait_time_total += waited
+            self._wait_time_max = max(self._wait_time_max, waited)
+
+        if conn is not None and not self._is_healthy(conn, last_used):
+            logger.warning("Discarding broken pooled database connection; reconnecting.")
+            self._close_quietly(conn)
+            conn = None
+            with self._cond:
+                self._reconnects += 1
+        if conn is None:
+            conn = self._connect()
+            if conn is None:
+                with self._cond:
+                    self._size -= 1
+                    self._in_use -= 1
+                    self._cond.notify()
+                return None
+        return conn
+
+    def putconn(self, conn, discard=False):
+        """Returns a connection to the pool, rolling back any open transaction."""
+        if not discard and not conn.closed:
+            try:
+                if conn.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            except psycopg2.Error:
+                discard = True
+        discard = discard or bool(conn.closed)
+        with self._cond:
+            self._in_use -= 1
+            if discard:
+                self._size -= 1
+            else:
+                self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+        if discard:
+            self._close_quietly(conn)
+
+    @contextmanager
+    def connection(self):
+        """Context manager borrowing a connection (None if unavailable) for the duration of the block."""
+        conn = self.getconn()
+        discard = False
+        try:
+            yield conn
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            discard = True
+            if conn is not None and conn.closed:
+                self._expire_idle()  # The server side went away; the idle connections are probably dead too
+            raise
+        finally:
+            if conn is not None:
+                self.putconn(conn, discard=discard)
+
+    def run(self, fn, *args):
+        """Returns fn(conn, *args) with a borrowed connection (None if unavailable).
+
+        If the connection turns out to be dead (psycopg2 closes it on the
+        error), fn is called once more with a checked or new connection, so
+        it must be safe to repeat. Other errors, e.g. a statement timeout,
+        are raised as they are.
+        """
+        for attempt in (1, 2):
+            lost = False
+            try:
+                with self.connection() as conn:
+                    try:
+                        return fn(conn, *args)
+                    except (psycopg2.OperationalError, psycopg2.InterfaceError):
+                        lost = conn is not None and bool(conn.closed)  # Before putconn() closes it anyway
+                        raise
+            except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+                if attempt == 2 or not lost:
+                    raise
+                logger.warning(f"Database connection lost ({e}); retrying with a fresh connection.")
+                with self._cond:
+                    self._reconnects += 1
+
+    def _expire_idle(self):
+        """Makes the next checkout of each idle connection ping it first."""
+        with self._cond:
+            self._idle = [(conn, float('-inf')) for conn, _ in self._idle]
+
+    def closeall(self):
+        with self._cond:
+            idle, self._idle = self._idle, []
+            self._size -= len(idle)
+        for conn, _ in idle:
+            self._close_quietly(conn)
+
+    def stats(self):
+        with self._cond:
+            return {
+                'size': self._size,
+                'max_size': self.max_size,
+                'idle': len(self._idle),
+                'in_use': self._in_use,
+                'waiters': self._waiters,
+                'checkouts': self._checkouts,
+                'timeouts': self._timeouts,
+                'reconnects': self._reconnects,
+                'wait_time_total': self._wait_time_total,
+                'wait_time_max': self._wait_time_max,
+            }
+
+    def _is_healthy(self, conn, last_used):
+        if conn.closed:
+            return False
+        if time.monotonic() - last_used < self.healthcheck_interval:
+            return True
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    @staticmethod
+    def _close_quietly(conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+
+def fetch_rows(conn, sql, params=None):
+    """Runs one read-only query for DBConnectionPool.run(); None without a connection."""
+    if not conn:
+        return None
+    with conn.cursor() as cursor:
+        cursor.execute(sql, params)
+        return cursor.fetchall()
+
+
+db_pool = DBConnectionPool(
+    get_db_connection,
+    min_size=DB_POOL_MIN_SIZE,
+    max_size=DB_POOL_MAX_SIZE,
+    timeout=DB_POOL_TIMEOUT,
+    healthcheck_interval=DB_POOL_HEALTHCHECK_INTERVAL,
+)
+atexit.register(db_pool.closeall)
+
+# --- Caches ---
+def normalize_query(text):
+    """Canonical form of a user query used for cache keys ("Fire  type!" -> "fire type")."""
+    return re.sub(r'\s+', ' ', text).strip().strip('.!?').strip().lower()
+
+
+class LRUCache:
+    """Thread-safe in-process LRU cache with a per-entry TTL and hit/miss counters."""
+
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self._data.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                del self._data[key]  # Expired
+            self.misses += 1
+            return None
+
+    def set(self, key, value, ttl=None):
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            return {'size': len(self._data), 'max_size': self.max_size, 'hits': self.hits, 'misses': self.misses}
+
+
+def create_shared_cache(url):
+    """Connects to the optional Redis-compatible shared cache tier. Returns None if not configured/reachable."""
+    if not url:
+        return None
+    try:
+        import redis  # Only needed when a shared tier is configured
+        client = redis.Redis.from_url(url, socket_timeout=0.2, socket_connect_timeout=0.5)
+        client.ping()
+        logger.info("Shared cache tier connected.")
+        return client
+    except Exception as e:
+        logger.error(f"Shared cache tier unavailable, using in-process cache only: {e}")
+        return None
+
+
+class QueryEmbeddingCache:
+    """Two-tier cache of query embeddings: in-process LRU, then an optional shared store.
+
+    Keys combine the normalized query with the model name and dimensionality, so
+    changing either never serves a stale vector. `shared` only needs Redis' get/setex.
+    """
+
+    def __init__(self, local, shared=None, model=MODEL_NAME_EMBEDDING, dim=EMBEDDING_DIM):
+        self.local = local
+        self.shared = shared
+        self.prefix = f"emb:{model}:{dim}:"
+        self.shared_hits = 0
+        self.shared_misses = 0
+        self.shared_errors = 0
+
+    def key(self, text):
+        return self.prefix + hashlib.sha256(normalize_query(text).encode('utf-8')).hexdigest()
+
+    def get(self, text):
+        key = self.key(text)
+        embedding = self.local.get(key)
+        if embedding is not None or self.shared is None:
+            return embedding
+        try:
+            raw = self.shared.get(key)
+        except Exception as e:
+            self.shared_errors += 1
+            logger.warning(f"Shared embedding cache read failed: {e}")
+            return None
+        if raw is None:
+            self.shared_misses += 1
+            return None
+        self.shared_hits += 1
+        embedding = array('f', raw).tolist()
+        self.local.set(key, embedding)
+        return embedding
+
+    def set(self, text, embedding):
+        key = self.key(text)
+        self.local.set(key, embedding)
+        if self.shared is not None:
+            try:
+                self.shared.setex(key, int(self.local.ttl), array('f', embedding).tobytes())
+            except Exception as e:
+                self.shared_errors += 1
+                logger.warning(f"Shared embedding cache write failed: {e}")
+
+    def stats(self):
+        stats = self.local.stats()
+        stats.update({'shared_hits': self.shared_hits, 'shared_misses': self.shared_misses, 'shared_errors': self.shared_errors})
+        return stats
+
+
+embedding_cache = QueryEmbeddingCache(LRUCache(EMBEDDING_CACHE_SIZE, EMBEDDING_CACHE_TTL))  # Shared tier attached by warm_up()
+
+def connect_shared_cache():
+    embedding_cache.shared = create_shared_cache(CACHE_REDIS_URL)
+
+llm_cache = LRUCache(LLM_CACHE_SIZE, LLM_CACHE_TTL)
+
+def llm_cache_key(user_query, top_pokemon_list):
+    """Normalized query + ordered candidate names: the LLM's only inputs besides the (fixed) prompt."""
+    names = '\x1f'.join(p['name'] for p in top_pokemon_list)
+    return f"{MODEL_NAME_LLM}\x1e{normalize_query(user_query)}\x1e{names}"
+
+
+# --- Catalogue change detection ---
+# A cheap fingerprint of the catalogue. It changes whenever the Dataflow job
+# adds, removes or changes rows, including re-embedding unchanged descriptions
+# with another model (embedding_model, migration 0003).
+CATALOG_FINGERPRINT_SQL = """
+    SELECT count(*), md5(coalesce(string_agg(
+        name || ':' || md5(coalesce(description, '')) || ':' || coalesce(embedding_model, ''), ',' ORDER BY name
+    ), ''))
+    FROM pokemon;
+"""
+
+def catalog_version_key(version):
+    """Fingerprint row -> the string stored with derived data (e.g. popular_answers.catalog_version)."""
+    return f"{version[0]}:{version[1]}"
+
+
+class CatalogWatcher:
+    """Polls a table fingerprint (by default the pokemon catalogue's) and calls listeners when it changes.
+
+    Listeners run on the first successful check and on every change after that.
+    A listener returning False (or raising) is retried on the next poll, alone,
+    so one failing listener does not re-run the others. refresh() (wired to
+    SIGHUP) wakes the watcher immediately and re-runs listeners even if nothing changed.
+    `sql` must return a row whose first column is a row count.
+    """
+
+    def __init__(self, pool, interval, sql=CATALOG_FINGERPRINT_SQL, name='pokemon catalogue'):
+        self.pool = pool
+        self.interval = interval
+        self.sql = sql
+        self.name = name
+        self.version = None
+        self._listeners = []
+        self._pending = []  # Listeners that failed; retried on the next check
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._force = False
+
+    def add_listener(self, listener):
+        self._listeners.append(listener)
+
+    def check(self, force=False):
+        """Fetches the current fingerprint; returns True (after notifying listeners) if it changed."""
+        try:
+            rows = self.pool.run(fetch_rows, self.sql)
+            if rows is None:
+                return False
+            version = rows[0]
+        except psycopg2.Error as e:
+            logger.warning(f"{self.name.capitalize()} fingerprint check failed: {e}")
+            return False
+
+        with self._lock:
+            changed = version != self.version
+            self.version = version
+            listeners = self._listeners if changed or force else self._pending
+        if changed or force:
+            logger.info(f"{self.name.capitalize()} loaded ({version[0]} rows); refreshing derived caches.")
+        failed = []
+        for listener in listeners:
+            try:
+                ok = listener()
+            except Exception as e:
+                logger.error(f"Catalogue change listener {listener} failed: {e}", exc_info=True)
+                ok = False
+            if ok is False:
+                failed.append(listener)
+        with self._lock:
+            self._pending = failed
+        return changed
+
+    def refresh(self):
+        """Requests an immediate re-check that re-runs listeners. Safe to call from a signal handler."""
+        self._force = True
+        self._wake.set()
+
+    def start(self):
+        threading.Thread(target=self._run, name=f"{self.name.replace(' ', '-')}-watcher", daemon=True).start()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            force, self._force = self._force, False
+            self.check(force=force)
+            self._wake.wait(self.interval)
+            self._wake.clear()
+
+
+catalog_watcher = CatalogWatcher(db_pool, CATALOG_CHECK_INTERVAL)
+catalog_watcher.add_listener(llm_cache.clear)
+
+
+# --- pgvector parameter adaptation ---
+class VectorParam:
+    """Query parameter that psycopg2 sends as a compact pgvector literal.
+
+    pgvector stores float32, so 9 significant digits round-trip exactly. For a
+    768-dim embedding this literal is ~40% smaller and ~2x cheaper to build
+    than str(list) of Python floats (about 700 -> 330 us per query in
+    bench/bench_vector_serialization.py). psycopg2 has no binary parameter
+    format; the bulk loader uses binary COPY instead.
+    """
+
+    _formats = {}  # dim -> '[%.9g,...]' format string
+
+    def __init__(self, values):
+        self.values = np.asarray(values, dtype=np.float32)
+        self._literal = None
+
+    def __conform__(self, proto):
+        if proto is extensions.ISQLQuote:
+            return self
+
+    def literal(self):
+        if self._literal is None:  # Built once even when the query uses the vector twice
+            dim = len(self.values)
+            fmt = self._formats.get(dim)
+            if fmt is None:
+                fmt = self._formats[dim] = '[' + ','.join(['%.9g'] * dim) + ']'
+            self._literal = fmt % tuple(self.values.tolist())
+        return self._literal
+
+    def getquoted(self):
+        return b"'" + self.literal().encode('ascii') + b"'"
+
+
+# --- In-memory vector search ---
+def parse_vector(value):
+    """pgvector's text form ('[0.1,0.2,...]') -> float32 array."""
+    if isinstance(value, str):
+        return np.array(value.strip('[]').split(','), dtype=np.float32)
+    return np.asarray(value, dtype=np.float32)
+
+
+class InMemoryVectorIndex:
+    """The whole catalogue as one contiguous matrix.
+
+    Top-k search is one matrix-vector product plus argpartition, giving the
+    same ranking as `ORDER BY embedding <op> q` for the configured distance
+    (rows are L2-normalized up front for cosine). Reloads build a new snapshot
+    and swap it in atomically, and the last good snapshot keeps serving while
+    the database is unavailable.
+
+    With dtype float16 or int8 (per-row scale) the matrix takes a half or a
+    quarter of the float32 memory, and search is two-stage: the compact scores
+    pick `rerank` candidates, which are re-ranked exactly with their float32
+    vectors fetched from Postgres by primary key. That fetch is a database
+    round trip per search. If it fails, the compact ranking is served as is,
+    and re-ranking is skipped for `failure_backoff` seconds so that requests
+    don't each wait on an unavailable database. float16 saves memory only: it
+    scores slower than float32 (see bench/bench_quantization.py).
+    """
+
+    BLOCK_ROWS = 256  # Compact rows widened to float32 per step; small enough to stay in cache
+
+    def __init__(self, pool, dim=EMBEDDING_DIM, distance=VECTOR_DISTANCE, dtype=MEMORY_INDEX_DTYPE,
+                 rerank=RERANK_CANDIDATES, failure_backoff=RERANK_FAILURE_BACKOFF):
+        if dtype not in ('float32', 'float16', 'int8'):
+            raise ValueError(f"Unsupported in-memory index dtype: {dtype}")
+        self.pool = pool
+        self.dim = dim
+        self.distance = distance
+        self.dtype = dtype
+        self.rerank = rerank if dtype != 'float32' else 0  # float32 scores are already exact
+        self.failure_backoff = failure_backoff
+        self._rerank_retry_at = 0.0  # Re-ranking is skipped until then after a failed fetch
+        self.rerank_skips = 0
+        self._snapshot = None  # (names, descriptions, matrix, per-row scales or None, squared row norms)
+
+    @property
+    def ready(self):
+        return self._snapshot is not None
+
+    @property
+    def nbytes(self):
+        """Memory held by the vectors (matrix, scales and norms)."""
+        _, _, matrix, scales, sq_norms = self._snapshot
+        return matrix.nbytes + sq_norms.nbytes + (scales.nbytes if scales is not None else 0)
+
+    def load(self):
+        rows = self.pool.run(
+            fetch_rows, "SELECT name, description, embedding FROM pokemon WHERE embedding IS NOT NULL ORDER BY name;"
+        )
+        if rows is None:
+            logger.error("Vector index load skipped: no database connection.")
+            return False
+
+        matrix = np.empty((len(rows), self.dim), dtype=np.float32)
+        for i, row in enumerate(rows):
+            matrix[i] = parse_vector(row[2])
+        self.build([row[0] for row in rows], [row[1] for row in rows], matrix)
+        logger.info(
+            f"In-memory vector index loaded with {len(rows)} embeddings "
+            f"({self.dtype}, {self.nbytes / 2**20:.1f} MiB)."
+        )
+        return True
+
+    def build(self, names, descriptions, matrix):
+        """Swaps in a snapshot of the given rows; `matrix` is float32 and may be modified."""
+        if self.distance == 'cosine':
+            norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+            norms[norms == 0] = 1.0
+            matrix /= norms
+        sq_norms = np.einsum('ij,ij->i', matrix, matrix)  # Kept exact for the l2 scores
+        scales = None
+        if self.dtype == 'int8':
+            scales = np.abs(matrix).max(axis=1) / 127
+            scales[scales == 0] = 1.0
+            matrix = np.rint(matrix / scales[:, None]).astype(np.int8)
+        elif self.dtype == 'float16':
+            matrix = matrix.astype(np.float16)
+        self._snapshot = (list(names), list(descriptions), matrix, scales, sq_norms)
+
+    def _scores(self, matrix, scales, sq_norms, query):
+        """Higher is closer: -|x - q|^2 (up to a constant) for l2, the dot product otherwise."""
+        if matrix.dtype == np.float32:
+            dots = matrix @ query
+        else:
+            dots = np.empty(len(matrix), dtype=np.float32)
+            buffer = np.empty((min(self.BLOCK_ROWS, len(matrix)), matrix.shape[1]), dtype=np.float32)
+            for start in range(0, len(matrix), self.BLOCK_ROWS):
+                block = buffer[:len(matrix[start:start + self.BLOCK_ROWS])]
+                block[...] = matrix[start:start + len(block)]
+                dots[start:start + len(block)] = block @ query
+            if scales is not None:
+                dots *= scales
+        if self.distance == 'l2':
+            return 2 * dots - sq_norms
+        return dots
+
+    @staticmethod
+    def _top(scores, k):
+        top = np.argpartition(-scores, k - 1)[:k]
+        return top[np.argsort(-scores[top], kind='stable')]
+
+    def search(self, query_embedding, k=3):
+        """Returns up to k (name, description) rows ordered like the SQL path."""
+        names, descriptions, matrix, scales, sq_norms = self._snapshot
+        query = np.asarray(query_embedding, dtype=np.float32)
+        k = min(k, len(names))
+        if k == 0:
+            return []
+        if self.distance == 'cosine':
+            norm = np.linalg.norm(query)
+            if norm == 0:
+                return []
+            query = query / norm
+        top = self._top(self._scores(matrix, scales, sq_norms, query), min(max(k, self.rerank), len(names)))
+        if len(top) > k:
+            top = self._rerank([names[i] for i in top], top, query, k)
+        return [(names[i], descriptions[i]) for i in top]
+
+    def _rerank(self, shortlist, top, query, k):
+        """Exact re-ranking of the shortlist; falls back to its compact order if the vectors can't be fetched."""
+        if time.monotonic() < self._rerank_retry_at:
+            self.rerank_skips += 1
+            return top[:k]
+        vectors = self.fetch_vectors(shortlist)
+        if vectors is None:
+            self._rerank_retry_at = time.monotonic() + self.failure_backoff
+            return top[:k]
+        found = [i for i, vector in enumerate(vectors) if vector is not None]  # Rows deleted since the load drop out
+        if len(found) < k:
+            return top[:k]
+        exact = np.stack([vectors[i] for i in found])
+        if self.distance == 'cosine':
+            norms = np.linalg.norm(exact, axis=1)
+            norms[norms == 0] = 1.0
+            exact /= norms[:, None]
+        scores = self._scores(exact, None, np.einsum('ij,ij->i', exact, exact), query)
+        return top[np.asarray(found)[self._top(scores, k)]]
+
+    @timed('vector_rerank')
+    def fetch_vectors(self, names):
+        """float32 embeddings for `names` in order (None where a row is gone), or None if the database is unavailable."""
+        try:
+            rows = self.pool.run(fetch_rows, "SELECT name, embedding FROM pokemon WHERE name = ANY(%s);", (list(names),))
+        except psycopg2.Error as e:
+            logger.warning(f"Re-rank fetch failed, serving the {self.dtype} ranking for {self.failure_backoff:.0f}s: {e}")
+            return None
+        if rows is None:
+            logger.warning(f"Re-rank fetch got no database connection, serving the {self.dtype} ranking for {self.failure_backoff:.0f}s.")
+            return None
+        found = {name: parse_vector(embedding) for name, embedding in rows}
+        return [found.get(name) for name in names]
+
+
+vector_index = InMemoryVectorIndex(db_pool)
+if SEARCH_BACKEND == 'memory':
+    catalog_watcher.add_listener(vector_index.load)
+
+
+def find_index_scans(plan):
+    """Names of the indexes used anywhere in an EXPLAIN (FORMAT JSON) plan tree."""
+    found = [plan['Index Name']] if 'Index Name' in plan else []
+    for child in plan.get('Plans', []):
+        found.extend(find_index_scans(child))
+    return found
+
+
+# Coarse stage per two-stage search mode: (ORDER BY expression, HNSW index it must use)
+COMPACT_SEARCHES = {
+    'halfvec': (f"embedding_half {VECTOR_OPERATOR} %s::halfvec({EMBEDDING_DIM})", 'pokemon_embedding_half_idx'),
+    'binary': (f"embedding_bits <~> binary_quantize(%s::vector)::bit({EMBEDDING_DIM})", 'pokemon_embedding_bits_idx'),
+}
+if VECTOR_SEARCH_MODE != 'exact' and VECTOR_SEARCH_MODE not in COMPACT_SEARCHES:
+    raise ValueError(f"Unsupported VECTOR_SEARCH_MODE: {VECTOR_SEARCH_MODE}")
+
+
+def vector_search_query(query_embedding, k, mode=VECTOR_SEARCH_MODE):
+    """(SQL, parameters, index name) of the top-k search for a search mode."""
+    vector = VectorParam(query_embedding)
+    exact_order = f"embedding {VECTOR_OPERATOR} %s::vector"  # Must match the HNSW operator class
+    if mode == 'exact':
+        return f"SELECT name, description FROM pokemon ORDER BY {exact_order} LIMIT %s", (vector, k), VECTOR_INDEX_NAME
+    coarse_order, index_name = COMPACT_SEARCHES[mode]
+    sql = f"""
+        SELECT name, description FROM (
+            SELECT name, description, embedding FROM pokemon ORDER BY {coarse_order} LIMIT %s
+        ) AS shortlist
+        ORDER BY {exact_order}
+        LIMIT %s
+    """
+    return sql, (vector, max(k, RERANK_CANDIDATES), vector, k), index_name
+
+
+def verify_vector_index(mode=VECTOR_SEARCH_MODE):
+    """Warns loudly if the search query cannot use its HNSW index (e.g. operator/opclass mismatch).
+
+    Sequential scans are disabled for the check, because with a handful of rows
+    the planner would rightly prefer one even though the index is usable.
+    """
+    probe = [1.0] + [0.0] * (EMBEDDING_DIM - 1)
+    sql, params, index_name = vector_search_query(probe, 3, mode)
+
+    def explain(conn):
+        if not conn:
+            return None
+        with conn.cursor() as cursor:
+            cursor.execute("SET LOCAL enable_seqscan = off;")
+            try:
+                cursor.execute(f"EXPLAIN (FORMAT JSON) {sql}", params)
+            except psycopg2.ProgrammingError as e:  # e.g. the optional compact columns were never added
+                conn.rollback()
+                logger.error(f"!!! Vector search query for VECTOR_SEARCH_MODE={mode} cannot run: {e}")
+                return None
+            return cursor.fetchone()[0]
+
+    plan = db_pool.run(explain)
+    if plan is None:
+        return None
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    indexes = find_index_scans(plan[0]['Plan'])
+    if index_name in indexes:
+        logger.info(
+            f"Vector search ({mode}) uses HNSW index {index_name} ({VECTOR_DISTANCE}, ef_search={search_ef(mode)})."
+        )
+    else:
+        logger.error(
+            f"!!! Vector search query ({mode}, {VECTOR_DISTANCE}) does NOT use index {index_name}; "
+            f"every request will do a sequential scan. Rebuild it to match the distance "
+            f"(python db/migrate.py --reindex --distance={VECTOR_DISTANCE}). Plan indexes: {indexes or 'none'}"
+        )
+    return None
+
+
+# Re-checked on every catalogue reload, since reloads may drop and rebuild the index
+catalog_watcher.add_listener(verify_vector_index)
+
+
+@timed('vector_search')
+def search_similar_pokemon(query_embedding, k=3, mode=VECTOR_SEARCH_MODE):
+    """Returns up to k (name, description) rows closest to the query embedding, or None if the DB is unavailable."""
+    if SEARCH_BACKEND == 'memory' and vector_index.ready:
+        return vector_index.search(query_embedding, k)
+
+    sql, params, _ = vector_search_query(query_embedding, k, mode)
+    return db_pool.run(fetch_rows, sql, params)
+
+# --- Precomputed popular answers ---
+POPULAR_ANSWERS_FINGERPRINT_SQL = "SELECT count(*), max(created_at) FROM popular_answers;"
+
+def model_version():
+    """Models a precomputed answer depends on; rows from other models are ignored."""
+    return f"{MODEL_NAME_EMBEDDING}/{EMBEDDING_DIM}+{MODEL_NAME_LLM}"
+
+
+class PopularAnswers:
+    """Answers for popular queries, precomputed by webapp/precompute.py, served without calling Vertex AI.
+
+    A query matches by its normalized text, or (once its embedding is known,
+    usually from the embedding cache) by cosine similarity to a precomputed
+    query of at least `threshold`. Only rows computed against the current
+    catalogue fingerprint are loaded, so a catalogue reload disables stale
+    answers until precompute.py has run again.
+    """
+
+    def __init__(self, pool, threshold=POPULAR_MATCH_THRESHOLD):
+        self.pool = pool
+        self.threshold = threshold
+        self._snapshot = ({}, [], None)  # (normalized text -> answer, answers, unit-length embedding rows)
+
+    def load(self):
+        try:
+            rows = self.pool.run(self._fetch)
+        except psycopg2.Error as e:
+            logger.warning(f"Popular answers not loaded: {e}")
+            return False
+        if rows is None:
+            return False
+
+        answers = []
+        matrix = np.empty((len(rows), EMBEDDING_DIM), dtype=np.float32)
+        for i, (query_norm, embedding, candidates, choice_name, explanation) in enumerate(rows):
+            if isinstance(candidates, str):
+                candidates = json.loads(candidates)
+            answers.append({'query': query_norm, 'candidates': candidates, 'name': choice_name, 'explanation': explanation})
+            matrix[i] = parse_vector(embedding)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        self._snapshot = ({a['query']: a for a in answers}, answers, matrix / norms)
+        logger.info(f"Loaded {len(answers)} precomputed popular answers.")
+        return True
+
+    @staticmethod
+    def _fetch(conn):
+        if not conn:
+            return None
+        with conn.cursor() as cursor:
+            cursor.execute(CATALOG_FINGERPRINT_SQL)
+            version = catalog_version_key(cursor.fetchone())
+            cursor.execute(
+                "SELECT query_norm, embedding, candidates, choice_name, explanation FROM popular_answers "
+                "WHERE catalog_version = %s AND model_version = %s;",
+                (version, model_version()),
+            )
+            return cursor.fetchall()
+
+    @timed('popular_answer')
+    def match(self, text, embedding=None):
+        """The precomputed answer for this query, or None."""
+        by_text, answers, matrix = self._snapshot
+        answer = by_text.get(normalize_query(text))
+        if answer is None and embedding is not None and answers:
+            query = np.asarray(embedding, dtype=np.float32)
+            norm = np.linalg.norm(query)
+            if norm > 0:
+                scores = matrix @ (query / norm)
+                best = int(np.argmax(scores))
+                if scores[best] >= self.threshold:
+                    answer = answers[best]
+                    logger.debug(f"Query matched popular answer '{answer['query']}' (similarity {scores[best]:.3f}).")
+        return answer
+
+
+popular_answers = PopularAnswers(db_pool)
+catalog_watcher.add_listener(popular_answers.load)  # Drops answers computed for the previous catalogue
+# Picks up newly precomputed answers
+answers_watcher = CatalogWatcher(db_pool, CATALOG_CHECK_INTERVAL, sql=POPULAR_ANSWERS_FINGERPRINT_SQL, name='popular answers')
+answers_watcher.add_listener(popular_answers.load)
+
+
+# --- Signed image URLs ---
+# Signed URLs are reused until SIGNED_URL_REFRESH_MARGIN before they expire, and
+# image existence is cached (warmed by listing images/ at startup), so GCS is
+# only contacted when a URL is about to expire or an unknown image is requested.
+signed_url_cache = LRUCache(2048, SIGNED_URL_EXPIRATION - SIGNED_URL_REFRESH_MARGIN)
+image_exists_cache = LRUCache(2048, 86400)
+
+def warm_image_cache():
+    """Records every existing images/*.png blob with one bucket listing."""
+    if not init_google_clients():
+        return
+    try:
+        count = 0
+        for blob in storage_client.list_blobs(BUCKET_NAME, prefix="images/"):
+            image_exists_cache.set(blob.name, True)
+            count += 1
+        logger.info(f"Image cache warmed with {count} blobs from gs://{BUCKET_NAME}/images/.")
+    except Exception as e:
+        logger.error(f"Failed to warm image cache from gs://{BUCKET_NAME}/images/: {e}")
+
+
+# Signed URL function
+@timed('signed_url')
 def get_signed_url(pokemon_name):
 
-    if not storage_client:
+    if not init_google_clients():
         logger.error("Storage client not available for generating signed URL.")
         return None
+    blob_name = f"images/{pokemon_name.lower()}.png"
+    url = signed_url_cache.get(blob_name)
+    if url is not None:
+        return url
     try:
-        blob_name = f"images/{pokemon_name.lower()}.png"
         bucket = storage_client.bucket(BUCKET_NAME)
         blob = bucket.blob(blob_name)
-        if not blob.exists():
+        exists = image_exists_cache.get(blob_name)
+        if exists is None:
+            exists = blob.exists()
+            image_exists_cache.set(blob_name, exists, ttl=None if exists else IMAGE_MISSING_RECHECK)
+        if not exists:
              logger.warning(f"Image blob not found: gs://{BUCKET_NAME}/{blob_name}")
              # Return placeholder or None - Using placeholder defined in HTML/CSS now
              return None # Let template handle missing image
-        
-        
 
-        
-        url = blob.generate_signed_url(version="v4", expiration=900, service_account_email=credentials.service_account_email,
+        url = blob.generate_signed_url(version="v4", expiration=SIGNED_URL_EXPIRATION, service_account_email=credentials.service_account_email,
     access_token=credentials.token, )
+        signed_url_cache.set(blob_name, url)
         # logger.info(f"Generated signed URL for {blob_name}")
         return url
     except Exception as e:
@@ -83,11 +1182,209 @@ def get_signed_url(pokemon_name):
         return None
 
 
+# --- Request coalescing ---
+class SingleFlightTimeout(Exception):
+    """Raised to a waiter whose shared call did not finish within the timeout."""
+
 
+class SingleFlight:
+    """Runs concurrent calls with the same key once and hands every caller the same result (or exception).
+
+    Coalescing is per worker process and uses blocking threading primitives,
+    which suits gunicorn's sync/gthread workers (and gevent once monkey-patched).
+    At most `max_waiters` callers wait on one call. Any further callers run
+    their own call rather than piling onto a single slow one. A waiter gives up
+    with SingleFlightTimeout after `timeout` seconds.
+
+    stream() does the same for generator functions: waiters replay the items
+    the leader's generator has yielded so far, then receive the rest as they
+    are produced.
+    """
+
+    class _Call:
+        def __init__(self):
+            self.done = threading.Event()
+            self.waiters = 0
+            self.result = None
+            self.error = None
+            self.items = []  # stream(): everything yielded so far
+            self.changed = threading.Condition()
+
+    def __init__(self, max_waiters, timeout):
+        self.max_waiters = max_waiters
+        self.timeout = timeout
+        self._calls = {}  # key -> _Call in flight
+        self._lock = threading.Lock()
+        # Counters for stats()
+        self.leaders = 0
+        self.coalesced = 0
+        self.overflows = 0
+        self.timeouts = 0
+
+    def _join(self, key):
+        """(call, role) for a new caller of `key`; role is 'leader', 'waiter' or 'overflow'."""
+        with self._lock:
+            call = self._calls.get(key)
+            if call is None:
+                call = self._calls[key] = self._Call()
+                self.leaders += 1
+                return call, 'leader'
+            if call.waiters >= self.max_waiters:
+                self.overflows += 1
+                return call, 'overflow'
+            call.waiters += 1
+            self.coalesced += 1
+            return call, 'waiter'
+
+    def _release(self, key, call):
+        with self._lock:
+            if self._calls.get(key) is call:
+                del self._calls[key]  # Later callers start a fresh call
+
+    def do(self, key, fn, *args):
+        call, role = self._join(key)
+        if role == 'overflow':
+            return fn(*args)
+        if role == 'leader':
+            try:
+                call.result = fn(*args)
+                return call.result
+            except BaseException as e:
+                call.error = e
+                raise
+            finally:
+                self._release(key, call)
+                call.done.set()
+
+        with timed('coalesced_wait'):
+            finished = call.done.wait(self.timeout)
+        if not finished:
+            with self._lock:
+                self.timeouts += 1
+            raise SingleFlightTimeout(f"Shared call for {key!r} still running after {self.timeout}s")
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+    def stream(self, key, fn, *args):
+        """Generator: the items of fn(*args), produced once for all concurrent callers with the same key.
+
+        If the leader's client goes away, the leader keeps running fn for the
+        waiters that are still attached.
+        """
+        call, role = self._join(key)
+        if role == 'overflow':
+            yield from fn(*args)
+            return
+        if role == 'leader':
+            yield from self._lead(key, call, fn, *args)
+            return
+
+        deadline = time.monotonic() + self.timeout
+        with timed('coalesced_wait'):  # Until the first item arrives
+            items, finished = self._wait_items(key, call, 0, deadline)
+        seen = 0
+        while True:
+            seen += len(items)
+            yield from items
+            if finished:
+                break
+            items, finished = self._wait_items(key, call, seen, deadline)
+        if call.error is not None:
+            raise call.error
+
+    def _wait_items(self, key, call, seen, deadline):
+        """(items after the first `seen`, whether the stream has ended) once there is something new."""
+        with call.changed:
+            while seen == len(call.items) and not call.done.is_set():
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    with self._lock:
+                        self.timeouts += 1
+                    raise SingleFlightTimeout(f"Shared stream for {key!r} still running after {self.timeout}s")
+                call.changed.wait(remaining)
+            return call.items[seen:], call.done.is_set()
+
+    def _lead(self, key, call, fn, *args):
+        attached = True  # The leader's own client is still reading
+        try:
+            for item in fn(*args):
+                with call.changed:
+                    call.items.append(item)
+                    call.changed.notify_all()
+                if attached:
+                    try:
+                        yield item
+                    except GeneratorExit:
+                        attached = False
+                        with self._lock:
+                            if call.waiters == 0:  # Nobody else is listening; stop producing
+                                del self._calls[key]
+                                break
+        except Exception as e:
+            call.error = e
+            if attached:
+                raise
+            logger.error(f"Shared stream for {key!r} failed after its leader disconnected: {e}")
+        finally:
+            self._release(key, call)
+            with call.changed:
+                call.done.set()
+                call.changed.notify_all()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'in_flight': len(self._calls),
+                'leaders': self.leaders,
+                'coalesced': self.coalesced,
+                'overflows': self.overflows,
+                'timeouts': self.timeouts,
+            }
+
+
+recommendation_flight = SingleFlight(SINGLEFLIGHT_MAX_WAITERS, SINGLEFLIGHT_TIMEOUT)
+recommendation_stream_flight = SingleFlight(SINGLEFLIGHT_MAX_WAITERS, SINGLEFLIGHT_TIMEOUT)  # /recommend/stream
+
+
+# Shared GenAI client. genai.Client keeps an httpx connection pool and the
+# resolved credentials, so one instance per process is reused across requests.
+_genai_client = None
+_genai_client_lock = threading.Lock()
+
+def get_genai_client():
+    global _genai_client
+    if _genai_client is None:
+        init_google_clients()  # No-op once it has succeeded; backs off after failures
+        with _genai_client_lock:
+            if _genai_client is None:
+                _genai_client = genai.Client(
+                    vertexai=True,
+                    project=PROJECT_ID,
+                    location=region,
+                    credentials=credentials, # Shared ADC kept fresh by credential_refresher (None -> client resolves its own)
+                    http_options=HttpOptions(timeout=LLM_TIMEOUT_MS),
+                )
+                logger.info("GenAI client initialized.")
+    return _genai_client
+
+
+io_executor = ThreadPoolExecutor(max_workers=IO_POOL_SIZE, thread_name_prefix='io')
+
+def prefetch_signed_urls(pokemon_names):
+    """Starts signing image URLs for every candidate in the background. Returns {name: Future}."""
+    return {name: io_executor.submit(get_signed_url, name) for name in pokemon_names}
+
+
+@timed('embedding')
 def generate_embedding_app(text):
      if not text: return None
+     cached = embedding_cache.get(text)
+     if cached is not None:
+         logger.debug("Query embedding served from cache.")
+         return cached
      try:
-        client = genai.Client(vertexai=True, project=PROJECT_ID, location=region)
+        client = get_genai_client()
         response = client.models.embed_content(
             model=MODEL_NAME_EMBEDDING,
             contents=[
@@ -95,20 +1392,19 @@ def generate_embedding_app(text):
             ],
             config=EmbedContentConfig(
                 task_type="RETRIEVAL_DOCUMENT",  # Optional
-                output_dimensionality=768,  # Optional
+                output_dimensionality=EMBEDDING_DIM,  # Optional
+                http_options=HttpOptions(timeout=EMBEDDING_TIMEOUT_MS, headers=trace_headers() or None),
             ),
         )
-        return response.embeddings[0].values
+        embedding = response.embeddings[0].values
+        embedding_cache.set(text, embedding)
+        return embedding
      except Exception as e:
          logger.error(f"App: Failed to get GenAI embedding: {e}", exc_info=True)
          return None
 
-def call_llm_to_choose_genai(user_query, top_pokemon_list):
-    """Uses Gemini via GenAI SDK to choose the best Pokemon."""
-    if not top_pokemon_list:
-        logger.warning("No top Pokemon provided to LLM.")
-        return None
-
+def build_llm_prompt(user_query, top_pokemon_list):
+    """The prompt asking Gemini to pick one of the candidates: name on the first line, explanation after."""
     # --- Prompt Engineering ---
     prompt = f"""You are a helpful Pokémon expert assistant.
                 A user is looking for a starter Pokémon and has provided the following request:
@@ -130,76 +1426,356 @@ def call_llm_to_choose_genai(user_query, top_pokemon_list):
                 Because you asked for something fast and electric, Pikachu fits perfectly with its speed and electric shocks.
             """
     # --- End Prompt ---
+    return prompt
+
+
+DEFAULT_EXPLANATION = "This Pokémon seems like a good match for your request."
+
+def llm_fallback_choice(top_pokemon_list, note=""):
+    """The top vector-search match, used when the LLM fails or names a Pokemon outside the candidates."""
+    first_match = top_pokemon_list[0]
+    return {
+        'name': first_match['name'],
+        'explanation': f"Based on similarity, {first_match['name']} seems like a good starting point{note}.",
+        'fallback': True, # Not a genuine LLM answer; never cached or precomputed
+    }
+
+
+@timed('llm')
+def call_llm_to_choose_genai(user_query, top_pokemon_list):
+    """Uses Gemini via GenAI SDK to choose the best Pokemon."""
+    if not top_pokemon_list:
+        logger.warning("No top Pokemon provided to LLM.")
+        return None
+
+    cache_key = llm_cache_key(user_query, top_pokemon_list)
+    cached = llm_cache.get(cache_key)
+    if cached is not None:
+        logger.info(f"LLM choice for query '{user_query}' served from cache.")
+        return dict(cached)
+
+    prompt = build_llm_prompt(user_query, top_pokemon_list)
 
     try:
-        # Create client and model instance (relies on ADC)
-        client = genai.Client(vertexai=True, project=PROJECT_ID, location=region)
+        client = get_genai_client()
 
-        logger.info(f"Sending prompt to LLM {MODEL_NAME_LLM} for query: '{user_query}'")
+        logger.debug(f"Sending prompt to LLM {MODEL_NAME_LLM} for query: '{user_query}'")
         
         response: GenerateContentResponse = client.models.generate_content(
             model=MODEL_NAME_LLM,
             contents=prompt,
+            config=GenerateContentConfig(http_options=HttpOptions(timeout=LLM_TIMEOUT_MS, headers=trace_headers() or None)),
         )
 
         if response.candidates and response.candidates[0].content.parts:
             llm_text = response.text # .text provides convenience access
-            logger.info(f"LLM Response received:\n{llm_text}")
+            logger.debug(f"LLM Response received:\n{llm_text}")
 
             lines = llm_text.strip().split('\n', 1)
             recommended_name = lines[0].strip()
-            explanation = lines[1].strip() if len(lines) > 1 else "This Pokémon seems like a good match for your request."
+            explanation = lines[1].strip() if len(lines) > 1 else DEFAULT_EXPLANATION
 
             valid_names = [p['name'] for p in top_pokemon_list]
             if recommended_name not in valid_names:
                 logger.warning(f"LLM recommended '{recommended_name}', which was not in the top 3 options {valid_names}. Falling back.")
-                first_match = top_pokemon_list[0]
-                return {
-                    'name': first_match['name'],
-                    'explanation': f"Based on similarity, {first_match['name']} seems like a good starting point."
-                }
+                return llm_fallback_choice(top_pokemon_list)
 
-            return {'name': recommended_name, 'explanation': explanation}
+            choice = {'name': recommended_name, 'explanation': explanation}
+            llm_cache.set(cache_key, choice) # Only genuine LLM answers are cached, never fallbacks
+            return dict(choice)
         else:
             logger.warning(f"LLM returned an empty or invalid response for query: {user_query}")
             logger.warning(f"LLM Raw Response: {response}")
             # Fallback: Return the first Pokemon from the vector search
-            first_match = top_pokemon_list[0]
-            return {
-                'name': first_match['name'],
-                'explanation': f"Based on similarity, {first_match['name']} seems like a good starting point."
-            }
+            return llm_fallback_choice(top_pokemon_list)
 
     except Exception as e:
         logger.error(f"Error calling LLM ({MODEL_NAME_LLM}): {e}", exc_info=True)
         # Fallback: Return the first Pokemon from the vector search
-        first_match = top_pokemon_list[0]
-        return {
-            'name': first_match['name'],
-            'explanation': f"Based on similarity, {first_match['name']} seems like a good starting point (LLM refinement failed)."
-        }
+        return llm_fallback_choice(top_pokemon_list, " (LLM refinement failed)")
+
+
+def stream_llm_choice(user_query, top_pokemon_list):
+    """Streaming variant of call_llm_to_choose_genai, using generate_content_stream.
+
+    Yields ('choice', {'name': ...}) as soon as the first line (the name) is
+    complete and valid, then ('token', text) explanation chunks as they
+    arrive, then ('done', choice). An invalid name, an empty response or an
+    error before the name falls back to the top match, as the blocking call does.
+    """
+    def fallback(note=""):
+        choice = llm_fallback_choice(top_pokemon_list, note)
+        return [('choice', {'name': choice['name']}), ('token', choice['explanation']), ('done', choice)]
+
+    cache_key = llm_cache_key(user_query, top_pokemon_list)
+    cached = llm_cache.get(cache_key)
+    if cached is not None:
+        logger.info(f"LLM choice for query '{user_query}' served from cache.")
+        yield 'choice', {'name': cached['name']}
+        yield 'token', cached['explanation']
+        yield 'done', dict(cached)
+        return
+
+    valid_names = [p['name'] for p in top_pokemon_list]
+    head = ''  # Text received before the end of the first line
+    name = None
+    explanation = []
+    with timed('llm_stream'):
+        try:
+            client = get_genai_client()
+            logger.debug(f"Streaming prompt to LLM {MODEL_NAME_LLM} for query: '{user_query}'")
+            stream = client.models.generate_content_stream(
+                model=MODEL_NAME_LLM,
+                contents=build_llm_prompt(user_query, top_pokemon_list),
+                config=GenerateContentConfig(http_options=HttpOptions(timeout=LLM_TIMEOUT_MS, headers=trace_headers() or None)),
+            )
+            for chunk in stream:
+                text = chunk.text or ''
+                if name is None:
+                    head = (head + text).lstrip()
+                    if '\n' not in head:
+                        continue
+                    name, text = head.split('\n', 1)
+                    name = name.strip()
+                    if name not in valid_names:
+                        logger.warning(f"LLM recommended '{name}', which was not in the top 3 options {valid_names}. Falling back.")
+                        yield from fallback()
+                        return
+                    yield 'choice', {'name': name}
+                    text = text.lstrip()
+                if text:
+                    explanation.append(text)
+                    yield 'token', text
+        except Exception as e:
+            logger.error(f"Error streaming from LLM ({MODEL_NAME_LLM}): {e}", exc_info=True)
+            if name is None:
+                yield from fallback(" (LLM refinement failed)")
+            else:
+                # The name is already on screen; finish with what arrived (not cached)
+                yield 'done', {'name': name, 'explanation': ''.join(explanation).strip() or DEFAULT_EXPLANATION, 'fallback': True}
+            return
+
+    if name is None:  # The response was a single line
+        name = head.strip()
+        if name not in valid_names:
+            logger.warning(f"LLM recommended '{name}', which was not in the top 3 options {valid_names}. Falling back.")
+            yield from fallback()
+            return
+        yield 'choice', {'name': name}
+    explanation_text = ''.join(explanation).strip()
+    if not explanation_text:
+        explanation_text = DEFAULT_EXPLANATION
+        yield 'token', explanation_text
+    choice = {'name': name, 'explanation': explanation_text}
+    llm_cache.set(cache_key, choice) # Only genuine LLM answers are cached, never fallbacks
+    yield 'done', dict(choice)
+
+@app.before_request
+def before_request():
+    g.request_start = time.perf_counter()
+    match = TRACEPARENT_RE.match(request.headers.get('traceparent', ''))
+    if match:
+        g.trace_id, g.trace_flags = match.group(1), match.group(3)
+    elif TRACE_PROPAGATION:
+        g.trace_id, g.trace_flags = os.urandom(16).hex(), '01'
+
 
 @app.after_request
 def after_request(response):
-    if response.status_code >= 500:
+    stages = g.get('stage_timings', [])
+    if stages:
+        response.headers['Server-Timing'] = ', '.join(f"{stage};dur={elapsed * 1000:.1f}" for stage, elapsed in stages)
+    if not g.get('record_when_streamed'):
+        record_request(response.status_code)
+    return response
+
+
+def record_request(status_code):
+    """Observes the request's latency and logs it with its stage breakdown.
+
+    Called from after_request, or, for streamed responses, once the body has
+    been sent (after_request runs before a stream's body, when its stages
+    haven't happened yet).
+    """
+    duration = time.perf_counter() - g.get('request_start', time.perf_counter())
+    stages = g.get('stage_timings', [])
+    request_latency.observe(duration, request.endpoint or 'unmatched', request.method, status_code)
+
+    if request.endpoint in ('healthz', 'readyz'):
+        log_level = logging.DEBUG  # Probes run every few seconds; /readyz is 503 by design while warming up
+    elif status_code >= 500:
         log_level = logging.ERROR  # Log 5xx as ERROR
-    elif response.status_code >= 400:
+    elif status_code >= 400:
         log_level = logging.WARNING  # Log 4xx as WARNING
+    elif duration >= SLOW_REQUEST_SECONDS:
+        log_level = logging.WARNING  # Slow requests show where the time went
     else:
-        log_level = logging.DEBUG  # Log 2xx and 3xx as INFO
+        log_level = logging.DEBUG  # Log 2xx and 3xx as DEBUG
 
-    logger.log(log_level, '%s %s %s %s',
-                    request.remote_addr,
-                    request.method,
-                    request.path,
-                    response.status_code)
+    if logger.isEnabledFor(log_level):
+        logger.log(log_level, '%s %s %s %s %.0fms trace=%s stages=[%s]',
+                        request.remote_addr,
+                        request.method,
+                        request.path,
+                        status_code,
+                        duration * 1000,
+                        g.get('trace_id', '-'),
+                        ' '.join(f"{stage}={elapsed * 1000:.0f}ms" for stage, elapsed in stages))
+
+
+def render_metrics():
+    """Prometheus text exposition of latency histograms, cache counters and DB pool state."""
+    worker = os.getpid()
+    lines = request_latency.render() + stage_latency.render()
+
+    def sample(name, kind, documentation, values):
+        lines.extend([f"# HELP {name} {documentation}", f"# TYPE {name} {kind}"])
+        for labels, value in values:
+            lines.append(f"{name}{{{metric_labels(('worker',) + tuple(labels), (worker,) + tuple(labels.values()))}}} {value}")
+
+    caches = {
+        'embedding': embedding_cache.local,
+        'llm': llm_cache,
+        'signed_url': signed_url_cache,
+        'image_exists': image_exists_cache,
+    }
+    cache_stats = {name: cache.stats() for name, cache in caches.items()}
+    sample('pokemon_cache_hits_total', 'counter', 'In-process cache hits.',
+           [({'cache': name}, stats['hits']) for name, stats in cache_stats.items()])
+    sample('pokemon_cache_misses_total', 'counter', 'In-process cache misses.',
+           [({'cache': name}, stats['misses']) for name, stats in cache_stats.items()])
+    sample('pokemon_cache_hit_ratio', 'gauge', 'Hits / lookups since the worker started.',
+           [({'cache': name}, stats['hits'] / max(1, stats['hits'] + stats['misses'])) for name, stats in cache_stats.items()])
+    sample('pokemon_cache_entries', 'gauge', 'Entries currently cached.',
+           [({'cache': name}, stats['size']) for name, stats in cache_stats.items()])
+    embedding_stats = embedding_cache.stats()
+    sample('pokemon_shared_cache_requests_total', 'counter', 'Shared (Redis) embedding cache lookups by result.',
+           [({'result': result}, embedding_stats[f'shared_{result}']) for result in ('hits', 'misses', 'errors')])
+
+    flights = {'recommend': recommendation_flight.stats(), 'stream': recommendation_stream_flight.stats()}
+    sample('pokemon_singleflight_in_flight', 'gauge', 'Distinct recommendation runs in progress.',
+           [({'path': path}, flight['in_flight']) for path, flight in flights.items()])
+    sample('pokemon_singleflight_requests_total', 'counter', 'Recommendation requests by coalescing role.',
+           [({'path': path, 'role': role}, flight[role])
+            for path, flight in flights.items() for role in ('leaders', 'coalesced', 'overflows', 'timeouts')])
+
+    if SEARCH_BACKEND == 'memory' and vector_index.rerank:
+        sample('pokemon_vector_rerank_skipped_total', 'counter',
+               'In-memory searches served without re-ranking while a failed vector fetch backs off.',
+               [({}, vector_index.rerank_skips)])
+
+    pool = db_pool.stats()
+    sample('pokemon_db_pool_connections', 'gauge', 'Database pool connections by state.',
+           [({'state': state}, pool[state]) for state in ('idle', 'in_use')])
+    sample('pokemon_db_pool_max_connections', 'gauge', 'Database pool size limit.', [({}, pool['max_size'])])
+    sample('pokemon_db_pool_waiters', 'gauge', 'Threads waiting for a pooled connection.', [({}, pool['waiters'])])
+    sample('pokemon_db_pool_checkouts_total', 'counter', 'Connections borrowed from the pool.', [({}, pool['checkouts'])])
+    sample('pokemon_db_pool_timeouts_total', 'counter', 'Checkouts that timed out waiting for a connection.', [({}, pool['timeouts'])])
+    sample('pokemon_db_pool_reconnects_total', 'counter', 'Broken pooled connections replaced.', [({}, pool['reconnects'])])
+    sample('pokemon_db_pool_wait_seconds_total', 'counter', 'Total time spent waiting for a connection.', [({}, pool['wait_time_total'])])
+    sample('pokemon_db_pool_wait_seconds_max', 'gauge', 'Longest wait for a connection.', [({}, pool['wait_time_max'])])
+    return '\n'.join(lines) + '\n'
+
+
+@app.route('/metrics')
+def metrics():
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
+
+def run_recommendation(query_text):
+    """Embed -> search -> LLM for one query.
+
+    Returns (recommendation dict or None, error message or None, HTTP status).
+    The result may be shared by coalesced requests, so callers must not modify it.
+    """
+    final_pokemon_recommendation = None
+    error_msg = None
+    results = None
+    top_3_candidates = None
+    llm_choice = None
+    image_urls = {}
+    try:
+        # Popular queries: exact text match first, then similarity once the embedding is known
+        answer = popular_answers.match(query_text)
+        query_embedding = None
+        if answer is None:
+            query_embedding = generate_embedding_app(query_text) # Use chosen function
+            if query_embedding:
+                answer = popular_answers.match(query_text, query_embedding)
+        if answer is not None:
+            logger.info(f"Answered from precomputed popular query '{answer['query']}': {answer['name']}")
+            chosen_description = next((p['description'] for p in answer['candidates'] if p['name'] == answer['name']), "No description found.")
+            final_pokemon_recommendation = {
+                "name": answer['name'],
+                "description": chosen_description,
+                "image_url": get_signed_url(answer['name']),
+                "explanation": answer['explanation'],
+            }
+            return final_pokemon_recommendation, None, 200
+
+        if query_embedding:
+            results = search_similar_pokemon(query_embedding)
+            if results is None:
+                return None, "Database connection failed.", 500
+            logger.debug(f"Found {len(results)} candidates from vector search.")
+        else:
+            error_msg = "Failed to process your query (embedding generation failed)."
+            logger.warning("Could not generate query embedding.")
+
+        if results:
+            top_3_candidates = [{'name': row[0], 'description': row[1]} for row in results]
+            # Sign all candidate image URLs while the LLM decides; only one is used
+            image_urls = prefetch_signed_urls(p['name'] for p in top_3_candidates)
+
+            # --- Call LLM to refine ---
+            llm_choice = call_llm_to_choose_genai(query_text, top_3_candidates)
+
+        elif query_embedding: # No results from vector search
+            error_msg = "Could not find any potentially matching Pokemon."
+            logger.info("No matches found from vector search.")
+
+        # --- Prepare final result based on LLM choice ---
+        if llm_choice and llm_choice.get('name'):
+            chosen_name = llm_choice['name']
+            # Find the description for the chosen Pokemon from our top 3 list
+            chosen_description = next((p['description'] for p in top_3_candidates if p['name'] == chosen_name), "No description found.")
+
+            logger.info(f"LLM recommended: {chosen_name}")
+            signed_image_url = image_urls[chosen_name].result() if chosen_name in image_urls else get_signed_url(chosen_name)
+            final_pokemon_recommendation = {
+                "name": chosen_name,
+                "description": chosen_description, # Pass the actual description
+                "image_url": signed_image_url,
+                "explanation": llm_choice.get('explanation', '') # Add explanation
+            }
+        elif top_3_candidates and not llm_choice: # LLM failed, but had candidates
+             # Fallback: Use the #1 vector search result if LLM fails
+             first_match = top_3_candidates[0]
+             logger.warning("LLM choice failed or was invalid, using top vector search result.")
+             signed_image_url = image_urls[first_match['name']].result()
+             final_pokemon_recommendation = {
+                "name": first_match['name'],
+                "description": first_match['description'],
+                "image_url": signed_image_url,
+                "explanation": "This Pokémon had the closest description match based on our search." # Generic explanation
+            }
+        # If embedding failed or no candidates found, error_msg is already set
+
+    except psycopg2.Error as db_err:
+        logger.error(f"Database error: {db_err}")
+        error_msg = "A database error occurred."
+        # The pool rolls back (or discards a broken connection) when it is returned
+    except Exception as e:
+        logger.error(f"Error during query or processing: {e}", exc_info=True)
+        error_msg = "An application error occurred."
+
+    return final_pokemon_recommendation, error_msg, 200
 
-    return response
 
 @app.route('/', methods=['GET', 'POST'])
 def recommend():
     final_pokemon_recommendation = None
     error_msg = None
+    status = 200
 
     if request.method == 'POST':
         query_text = request.form.get('query_text')
@@ -208,87 +1784,171 @@ def recommend():
         if not query_text:
              error_msg = "Please describe the Pokemon you're looking for."
         else:
-            conn = get_db_connection()
-            if not conn:
-                error_msg = "Database connection failed."
-                # Use render_template now
-                return render_template('index.html', error=error_msg), 500
-
             try:
-                cursor = conn.cursor()
-                query_embedding = generate_embedding_app(query_text) # Use chosen function
-
-                if query_embedding:
-                    query_sql = """
-                        SELECT name, description
-                        FROM pokemon
-                        ORDER BY embedding <=> %s -- Cosine distance
-                        LIMIT 3;
-                    """
-                    cursor.execute(query_sql, (str(query_embedding),))
-                    results = cursor.fetchall()
-                    logger.info(f"Found {len(results)} candidates from vector search.")
-                else:
-                    error_msg = "Failed to process your query (embedding generation failed)."
-                    logger.warning("Could not generate query embedding.")
-                    result = None
-
-                if results:
-                    top_3_candidates = [{'name': row[0], 'description': row[1]} for row in results]
-
-                    # --- Call LLM to refine ---
-                    llm_choice = call_llm_to_choose_genai(query_text, top_3_candidates)
-
-                else: # No results from vector search
-                    error_msg = "Could not find any potentially matching Pokemon."
-                    logger.info("No matches found from vector search.")
-
-                # --- Prepare final result based on LLM choice ---
-                if llm_choice and llm_choice.get('name'):
-                    chosen_name = llm_choice['name']
-                    # Find the description for the chosen Pokemon from our top 3 list
-                    chosen_description = next((p['description'] for p in top_3_candidates if p['name'] == chosen_name), "No description found.")
-
-                    logger.info(f"LLM recommended: {chosen_name}")
-                    signed_image_url = get_signed_url(chosen_name)
-                    final_pokemon_recommendation = {
-                        "name": chosen_name,
-                        "description": chosen_description, # Pass the actual description
-                        "image_url": signed_image_url,
-                        "explanation": llm_choice.get('explanation', '') # Add explanation
-                    }
-                elif top_3_candidates and not llm_choice: # LLM failed, but had candidates
-                     # Fallback: Use the #1 vector search result if LLM fails
-                     first_match = top_3_candidates[0]
-                     logger.warning("LLM choice failed or was invalid, using top vector search result.")
-                     signed_image_url = get_signed_url(first_match['name'])
-                     final_pokemon_recommendation = {
-                        "name": first_match['name'],
-                        "description": first_match['description'],
-                        "image_url": signed_image_url,
-                        "explanation": "This Pokémon had the closest description match based on our search." # Generic explanation
-                    }
-                # If embedding failed or no candidates found, error_msg is already set
-
-                
-                cursor.close()
-                conn.close()
-
-            except psycopg2.Error as db_err:
-                logger.error(f"Database error: {db_err}")
-                error_msg = "A database error occurred."
-                if conn: conn.rollback()
-            except Exception as e:
-                logger.error(f"Error during query or processing: {e}", exc_info=True)
-                error_msg = "An application error occurred."
-                if conn: conn.rollback()
-            finally:
-                if conn: conn.close()
+                # Identical concurrent queries share one run
+                final_pokemon_recommendation, error_msg, status = recommendation_flight.do(
+                    normalize_query(query_text), run_recommendation, query_text
+                )
+            except SingleFlightTimeout:
+                error_msg = "We're handling a lot of identical requests right now. Please try again in a moment."
+                status = 503
 
     # Use render_template for both GET and POST responses
-    return render_template('index.html', pokemon=final_pokemon_recommendation, error=error_msg)
+    return render_template('index.html', pokemon=final_pokemon_recommendation, error=error_msg), status
+
+
+def stream_recommendation(query_text):
+    """Streaming counterpart of run_recommendation, yielding (event, data) pairs for server-sent events.
+
+    'candidates' (cards with name, description and image URL) follows the
+    vector search, before the LLM is called. 'choice' carries the chosen
+    card, 'token' explanation text as it is generated, then 'done' or 'error'.
+    """
+    try:
+        answer = popular_answers.match(query_text)
+        query_embedding = None
+        if answer is None:
+            query_embedding = generate_embedding_app(query_text)
+            if query_embedding:
+                answer = popular_answers.match(query_text, query_embedding)
+        if answer is not None:
+            logger.info(f"Answered from precomputed popular query '{answer['query']}': {answer['name']}")
+            cards = {p['name']: dict(p) for p in answer['candidates']}
+            chosen = cards.get(answer['name'], {'name': answer['name'], 'description': "No description found."})
+            yield 'choice', dict(chosen, image_url=get_signed_url(answer['name']))
+            yield 'token', answer['explanation']
+            yield 'done', {'name': answer['name'], 'explanation': answer['explanation']}
+            return
+
+        if not query_embedding:
+            logger.warning("Could not generate query embedding.")
+            yield 'error', {'message': "Failed to process your query (embedding generation failed)."}
+            return
+        results = search_similar_pokemon(query_embedding)
+        if results is None:
+            yield 'error', {'message': "Database connection failed."}
+            return
+        if not results:
+            logger.info("No matches found from vector search.")
+            yield 'error', {'message': "Could not find any potentially matching Pokemon."}
+            return
+
+        top_3_candidates = [{'name': row[0], 'description': row[1]} for row in results]
+        image_urls = prefetch_signed_urls(p['name'] for p in top_3_candidates)
+        cards = {p['name']: dict(p, image_url=image_urls[p['name']].result()) for p in top_3_candidates}
+        yield 'candidates', list(cards.values())
+
+        for event, data in stream_llm_choice(query_text, top_3_candidates):
+            if event == 'choice':
+                logger.info(f"LLM recommended: {data['name']}")
+                data = cards[data['name']]
+            yield event, data
+    except psycopg2.Error as db_err:
+        logger.error(f"Database error: {db_err}")
+        yield 'error', {'message': "A database error occurred."}
+    except Exception as e:
+        logger.error(f"Error during query or processing: {e}", exc_info=True)
+        yield 'error', {'message': "An application error occurred."}
+
+
+@app.route('/recommend/stream')
+def recommend_stream():
+    """Server-sent events version of recommend(), used by the page's script (GET, since EventSource can't POST)."""
+    query_text = request.args.get('query_text', '')
+    logger.info(f"Received query (stream): {query_text}")
+
+    def events():
+        if not query_text.strip():
+            pairs = [('error', {'message': "Please describe the Pokemon you're looking for."})]
+        else:
+            # Identical concurrent queries share one embed -> search -> LLM run and its token stream
+            pairs = recommendation_stream_flight.stream(normalize_query(query_text), stream_recommendation, query_text)
+        try:
+            for event, data in pairs:
+                yield f"event: {event}\ndata: {json.dumps(data)}\n\n"
+        except SingleFlightTimeout:
+            message = "We're handling a lot of identical requests right now. Please try again in a moment."
+            yield f"event: error\ndata: {json.dumps({'message': message})}\n\n"
+        finally:
+            record_request(200)  # Also when the client disconnected mid-stream
+
+    g.record_when_streamed = True  # The stages run while the body streams, after after_request
+    return Response(
+        stream_with_context(events()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}, # Don't let proxies buffer the stream
+    )
+
+
+# --- Health checks ---
+@app.route('/healthz')
+def healthz():
+    """Liveness: the worker is serving requests. Deliberately touches no dependency."""
+    return 'ok', 200
+
+
+@app.route('/readyz')
+def readyz():
+    """Readiness: warmup finished, the DB pool holds a connection and the model client and token are ready.
+
+    Only in-memory state is read, so frequent probes stay cheap. A pool that
+    lost its connections is reopened by the catalogue watcher's next poll.
+    """
+    checks = {
+        'warmup': startup_complete.is_set(),
+        'database': db_pool.stats()['size'] > 0,
+        'genai_client': _genai_client is not None,
+        'credentials': credentials is not None and credentials.valid,
+    }
+    return jsonify(checks), 200 if all(checks.values()) else 503
+
+
+# --- Background startup ---
+startup_complete = threading.Event()
+
+def warm_up():
+    """Initializes credentials, clients, the DB pool and the image cache off the request path.
+
+    Google client setup that fails here is retried by credential_refresher
+    until it succeeds, so /readyz recovers from a transient ADC failure.
+    """
+    start = time.monotonic()
+    ensure_google_clients()
+    credential_refresher.start()
+    for step in (connect_shared_cache, db_pool.prefill, warm_image_cache):
+        try:
+            step()
+        except Exception as e:
+            logger.error(f"Warmup step {step.__name__} failed: {e}")  # /readyz reports what is missing
+    startup_complete.set()
+    logger.info(f"Warmup finished in {time.monotonic() - start:.1f}s.")
+
+
+_background_started = False
+
+def start_background_tasks():
+    """Starts warmup, the catalogue watchers and the SIGHUP handler, once per serving process.
+
+    Importing this module starts nothing, so CLIs and tests that use its
+    functions (precompute.py, the benchmarks) get no background DB or GCP
+    traffic. gunicorn calls this from its post_worker_init hook.
+    """
+    global _background_started
+    if _background_started:
+        return
+    _background_started = True
+    threading.Thread(target=warm_up, name="warmup", daemon=True).start()
+    catalog_watcher.start()
+    answers_watcher.start()
+    try:
+        # `kill -HUP <pid>` forces the catalogue-derived caches, index and popular answers to reload now
+        signal.signal(signal.SIGHUP, lambda signum, frame: (catalog_watcher.refresh(), answers_watcher.refresh()))
+    except ValueError:
+        pass # Not called from the main thread; periodic refresh still applies
 
 
 if __name__ == '__main__':
+    # Local development only; the container serves through gunicorn (see gunicorn.conf.py)
     # Set debug=False for production/deployment
+    start_background_tasks()
     app.run(debug=True, host='0.0.0.0', port=int(os.environ.get('PORT', 8080)))
\ No newline at end of file
@@ -0,0 +1,19 @@
+# Production server settings (see Dockerfile). Each worker process gets its own
+# DB pool, GenAI client and caches; threads let one worker serve other users
+# while a request waits on Vertex AI, Postgres or GCS.
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 8080)}"
+workers = int(os.environ.get('WEB_CONCURRENCY', 1))  # ~100 MiB RSS each; size the pod's memory to match
+worker_class = "gthread"
+threads = int(os.environ.get('GUNICORN_THREADS', 8))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 60))  # Must exceed the slowest LLM call (LLM_TIMEOUT_MS)
+graceful_timeout = 30
+keepalive = 5
+accesslog = None  # app.after_request already logs each request
+
+
+def post_worker_init(worker):
+    # Importing the app starts nothing; each worker runs its own warmup, catalogue watchers and SIGHUP handler
+    import app
+    app.start_background_tasks()
@@ -0,0 +1,152 @@
+"""Precomputes answers for popular queries into the popular_answers table.
+
+Run after data_prep/dataflow_pipeline.py has (re)loaded the catalogue, with
+the same environment as the app (DB_*, GOOGLE_CLOUD_PROJECT):
+
+    python precompute.py [--queries popular_queries.txt] [--log app.log --top 50] [--if-stale]
+
+Queries come from the curated list plus, with --log, the most frequent
+queries in an exported app log ("Received query: ..." lines). Each one goes
+through the app's own embedding, vector search and LLM code, so the stored
+answer is what a live request would have returned. Rows are tagged with the
+catalogue fingerprint and the app ignores them once the catalogue changes.
+"""
+import argparse
+import collections
+import logging
+import os
+import re
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+from psycopg2.extras import Json, execute_values
+
+import app
+
+logger = logging.getLogger("precompute")
+
+LOG_QUERY_RE = re.compile(r"Received query(?: \(stream\))?: (.+)$")
+
+UPSERT_SQL = """
+    INSERT INTO popular_answers
+        (query_norm, query_text, embedding, candidates, choice_name, explanation, catalog_version, model_version)
+    VALUES %s
+    ON CONFLICT (query_norm) DO UPDATE SET
+        query_text = EXCLUDED.query_text,
+        embedding = EXCLUDED.embedding,
+        candidates = EXCLUDED.candidates,
+        choice_name = EXCLUDED.choice_name,
+        explanation = EXCLUDED.explanation,
+        catalog_version = EXCLUDED.catalog_version,
+        model_version = EXCLUDED.model_version,
+        created_at = now()
+"""
+
+
+def read_curated(path):
+    with open(path) as f:
+        return [line.strip() for line in f if line.strip() and not line.startswith("#")]
+
+
+def read_log(path, top, min_count):
+    """The `top` most frequent normalized queries in an app log seen at least `min_count` times."""
+    counts = collections.Counter()
+    with open(path, errors="replace") as f:
+        for line in f:
+            match = LOG_QUERY_RE.search(line.rstrip("\n"))
+            if match:
+                counts[app.normalize_query(match.group(1))] += 1
+    return [query for query, count in counts.most_common(top) if query and count >= min_count]
+
+
+def current_catalog_version():
+    rows = app.db_pool.run(app.fetch_rows, app.CATALOG_FINGERPRINT_SQL)
+    if rows is None:
+        raise SystemExit("Database connection failed.")
+    return app.catalog_version_key(rows[0])
+
+
+def store_answers(conn, rows, version):
+    """Upserts the answers and drops those for other catalogues or models, in one transaction."""
+    if not conn:
+        raise SystemExit("Database connection failed.")
+    with conn.cursor() as cursor:
+        if rows:
+            execute_values(cursor, UPSERT_SQL, rows)
+        # Answers for older catalogues or models can never be served again
+        cursor.execute(
+            "DELETE FROM popular_answers WHERE catalog_version <> %s OR model_version <> %s;",
+            (version, app.model_version()),
+        )
+    conn.commit()
+
+
+def precompute_answer(query_text, catalog_version):
+    """The popular_answers row for one query, or None if any stage failed."""
+    embedding = app.generate_embedding_app(query_text)
+    if not embedding:
+        logger.warning(f"Skipping '{query_text}': embedding failed.")
+        return None
+    results = app.search_similar_pokemon(embedding)
+    if not results:
+        logger.warning(f"Skipping '{query_text}': no candidates found.")
+        return None
+    candidates = [{'name': row[0], 'description': row[1]} for row in results]
+    choice = app.call_llm_to_choose_genai(query_text, candidates)
+    if not choice or choice.get('fallback'):
+        logger.warning(f"Skipping '{query_text}': no genuine LLM answer.")
+        return None
+    return (
+        app.normalize_query(query_text),
+        query_text,
+        app.VectorParam(embedding),
+        Json(candidates),
+        choice['name'],
+        choice['explanation'],
+        catalog_version,
+        app.model_version(),
+    )
+
+
+def run(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--queries", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "popular_queries.txt"))
+    parser.add_argument("--log", help="Exported app log to mine for frequent queries")
+    parser.add_argument("--top", type=int, default=50, help="Most frequent logged queries to add")
+    parser.add_argument("--min-count", type=int, default=3, help="Ignore logged queries seen fewer times")
+    parser.add_argument("--concurrency", type=int, default=4, help="Queries precomputed in parallel")
+    parser.add_argument("--if-stale", action="store_true", help="Do nothing if every query already has an answer for this catalogue")
+    args = parser.parse_args(argv)
+
+    queries = {}
+    for query in read_curated(args.queries) + (read_log(args.log, args.top, args.min_count) if args.log else []):
+        queries.setdefault(app.normalize_query(query), query)  # First phrasing wins
+
+    version = current_catalog_version()
+    if args.if_stale:
+        current = app.db_pool.run(
+            app.fetch_rows,
+            "SELECT count(*) FROM popular_answers WHERE catalog_version = %s AND model_version = %s AND query_norm = ANY(%s);",
+            (version, app.model_version(), list(queries)),
+        )
+        if current is None:
+            raise SystemExit("Database connection failed.")
+        if current[0][0] == len(queries):
+            logger.info(f"All {len(queries)} popular answers are current for catalogue {version}.")
+            return
+
+    logger.info(f"Precomputing {len(queries)} popular answers for catalogue {version}.")
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        rows = [row for row in executor.map(lambda q: precompute_answer(q, version), queries.values()) if row]
+
+    if current_catalog_version() != version:
+        raise SystemExit("The catalogue changed while precomputing; run again once the load has finished.")
+    app.db_pool.run(store_answers, rows, version)
+    logger.info(f"Stored {len(rows)} of {len(queries)} popular answers.")
+    if len(rows) < len(queries):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    logging.getLogger().setLevel(logging.INFO)
+    run()